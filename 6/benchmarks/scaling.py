@@ -0,0 +1,270 @@
+"""
+Data-size scaling suite for the in-memory services in 6/.
+
+Seeds each service in-process with N entities (1k, 10k, 100k and 1M by
+default), times every endpoint through the ASGI app, records the heap
+used by the seeded data and the peak allocation of each endpoint, and
+fits the growth exponent k of time ~ N^k per endpoint on a log-log scale.
+
+Endpoints are declared O(1) or O(n). The run fails (exit code 1) when an
+O(1) endpoint grows with an exponent above --max-exponent, which is what
+a lookup that became a scan over all entities looks like.
+
+    python scaling.py
+    python scaling.py --sizes 1000 10000 100000 --repeat 20
+"""
+import argparse
+import asyncio
+import gc
+import importlib.util
+import math
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INVENTORY_PER_LOCATION = 20
+PURCHASES_PER_LOCATION = 5
+
+
+def load_service(name):
+    """Imports a fresh copy of <name>/main.py, so every size starts empty."""
+    directory = os.path.join(ROOT, name)
+    # The services import the common package from the repository root
+    for path in (os.path.dirname(ROOT), directory):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(
+        f"{name}_main", os.path.join(directory, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def construct(model, **fields):
+    # Skips validation, seeding 1M entities through it would take minutes
+    build = getattr(model, "model_construct", None) or model.construct
+    return build(**fields)
+
+
+def seed_network_goods(service, size):
+    for item_id in range(size):
+        service.items_db[str(item_id)] = construct(
+            service.Item, id=str(item_id), name=f"Item {item_id}",
+            description=None, min_quantity=10, max_quantity=1000)
+    for location_id in range(size):
+        inventory = {
+            str((location_id + offset) % size): 500
+            for offset in range(min(INVENTORY_PER_LOCATION, size))
+        }
+        service.locations_db[location_id] = construct(
+            service.Location, id=location_id, name=f"Location {location_id}",
+            location=f"Street {location_id}", inventory=inventory)
+    for location_id in range(0, size, max(1, size // 1000)):
+        service.purchases_db[location_id] = [
+            construct(service.Purchase, item_id=str(location_id % size), quantity=1)
+            for _ in range(PURCHASES_PER_LOCATION)
+        ]
+
+
+def seed_orders(service, size):
+    for order_id in range(size):
+        service.orders_db[order_id] = construct(
+            service.Order, order_id=order_id, product_id=order_id % 1000,
+            quantity=10, source_warehouse_id=None,
+            destination_warehouse_id=None, supplier_id=None,
+            status=service.OrderStatus.pending)
+
+
+def network_goods_endpoints(service, size):
+    location = size // 2
+    item = str(location)
+    new_locations = iter(range(size, size * 10))
+    return [
+        ("GET /locations/{id}", "1",
+         lambda: ("GET", f"/locations/{location}", None)),
+        ("GET /locations/{id}/inventory/", "1",
+         lambda: ("GET", f"/locations/{location}/inventory/", None)),
+        ("PUT /locations/{id}/inventory/", "1",
+         lambda: ("PUT", f"/locations/{location}/inventory/",
+                  {"item_id": item, "quantity_change": 1})),
+        ("GET /locations/{id}/excess_inventory/", "1",
+         lambda: ("GET", f"/locations/{location}/excess_inventory/", None)),
+        ("POST /locations/{id}/purchases/", "1",
+         lambda: ("POST", f"/locations/{location}/purchases/",
+                  {"item_id": item, "quantity": 1})),
+        ("GET /locations/{id}/purchases/", "1",
+         lambda: ("GET", f"/locations/{location}/purchases/", None)),
+        ("POST /locations/{id}/reservations/", "1",
+         lambda: ("POST", f"/locations/{location}/reservations/",
+                  {"item_id": item, "quantity": 1})),
+        ("POST /locations/", "1",
+         lambda: ("POST", "/locations/", {
+             "id": next(new_locations), "name": "New", "location": "Street"})),
+        # Every item below its minimum counts, so the catalog is scanned
+        ("GET /locations/{id}/missing_inventory/", "n",
+         lambda: ("GET", f"/locations/{location}/missing_inventory/", None)),
+        ("GET /items/", "n", lambda: ("GET", "/items/", None)),
+        ("GET /locations/", "n", lambda: ("GET", "/locations/", None)),
+    ]
+
+
+def orders_endpoints(service, size):
+    order = size // 2
+    new_orders = iter(range(size, size * 10))
+
+    def delete():
+        # Put the order back, so every call deletes an existing one
+        service.orders_db.setdefault(order, construct(
+            service.Order, order_id=order, product_id=1, quantity=1,
+            source_warehouse_id=None, destination_warehouse_id=None,
+            supplier_id=None, status=service.OrderStatus.pending))
+        return "DELETE", f"/orders/{order}", None
+
+    return [
+        ("POST /orders/", "1",
+         lambda: ("POST", "/orders/", {
+             "order_id": next(new_orders), "product_id": 1, "quantity": 1})),
+        ("GET /orders/{id}", "1", lambda: ("GET", f"/orders/{order}", None)),
+        ("PUT /orders/{id}", "1",
+         lambda: ("PUT", f"/orders/{order}?status=in_progress", None)),
+        ("DELETE /orders/{id}", "1", delete),
+        ("GET /orders/", "n", lambda: ("GET", "/orders/", None)),
+    ]
+
+
+SERVICES = {
+    "network_goods": (seed_network_goods, network_goods_endpoints),
+    "orders": (seed_orders, orders_endpoints),
+}
+
+
+async def time_endpoint(client, request, repeat):
+    timings = []
+    for _ in range(repeat):
+        method, url, body = request()
+        started = time.perf_counter()
+        response = await client.request(method, url, json=body)
+        timings.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url}: {response.status_code} {response.text}")
+    return statistics.median(timings)
+
+
+async def peak_memory(client, request):
+    method, url, body = request()
+    gc.collect()
+    tracemalloc.start()
+    await client.request(method, url, json=body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+async def measure(name, size, repeat, max_linear_size):
+    seed, endpoints = SERVICES[name]
+    service = load_service(name)
+    gc.collect()
+    tracemalloc.start()
+    seed(service, size)
+    heap, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = {}
+    transport = httpx.ASGITransport(app=service.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for endpoint, expected, request in endpoints(service, size):
+            if expected == "n" and size > max_linear_size:
+                continue
+            # Linear endpoints get fewer calls at large sizes
+            calls = repeat if expected == "1" else max(3, repeat // 10)
+            await time_endpoint(client, request, 1)
+            results[endpoint] = (
+                expected,
+                await time_endpoint(client, request, calls),
+                await peak_memory(client, request),
+            )
+    return heap, results
+
+
+def growth_exponent(points):
+    """Least-squares slope of log(time) over log(size)."""
+    if len(points) < 2:
+        return None
+    xs = [math.log(size) for size, _ in points]
+    ys = [math.log(seconds) for _, seconds in points]
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+def format_size(size):
+    for unit, scale in (("M", 1_000_000), ("k", 1_000)):
+        if size >= scale:
+            return f"{size // scale}{unit}"
+    return str(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+",
+        default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument(
+        "--services", nargs="+", choices=sorted(SERVICES), default=sorted(SERVICES))
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument(
+        "--max-linear-size", type=int, default=100_000,
+        help="skip O(n) endpoints above this size, their responses get huge")
+    parser.add_argument(
+        "--max-exponent", type=float, default=0.5,
+        help="fail when an O(1) endpoint grows faster than N^max-exponent")
+    args = parser.parse_args()
+
+    failures = []
+    for name in args.services:
+        timings = {}
+        expectations = {}
+        print(f"\n{name}")
+        for size in args.sizes:
+            heap, results = asyncio.run(
+                measure(name, size, args.repeat, args.max_linear_size))
+            print(f"  seeded {format_size(size):>5}: heap {heap / 2**20:8.1f} MiB")
+            for endpoint, (expected, seconds, peak) in results.items():
+                expectations[endpoint] = expected
+                timings.setdefault(endpoint, []).append((size, seconds, peak))
+
+        header = "".join(f"{format_size(size):>10}" for size in args.sizes)
+        print(f"  {'endpoint':<42}{'O()':>5}{header}{'peak KiB':>10}{'k':>7}")
+        for endpoint, points in timings.items():
+            expected = expectations[endpoint]
+            by_size = {size: seconds for size, seconds, _ in points}
+            cells = "".join(
+                f"{by_size[size] * 1e6:>8.0f}us" if size in by_size else f"{'-':>10}"
+                for size in args.sizes)
+            exponent = growth_exponent([(size, seconds) for size, seconds, _ in points])
+            failed = (
+                expected == "1" and exponent is not None
+                and exponent > args.max_exponent)
+            if failed:
+                failures.append(f"{name} {endpoint}: N^{exponent:.2f}")
+            print(
+                f"  {endpoint:<42}{expected:>5}{cells}"
+                f"{points[-1][2] / 1024:>10.0f}"
+                f"{'-' if exponent is None else f'{exponent:.2f}':>7}"
+                + ("  FAIL" if failed else ""))
+
+    if failures:
+        print("\nO(1) endpoints that grow with the data size:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,26 @@
-import json
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from datetime import datetime, timezone
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-from fastapi import FastAPI, HTTPException
+from typing import List, Dict, Optional, Tuple
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from common.profiler import ProfilerMiddleware, authorize, profile
+from common.startup import serve_prebuilt_openapi, timeline
+
+timeline.mark("imports")
 
 
 app = FastAPI()
+app.add_middleware(ProfilerMiddleware)
+serve_prebuilt_openapi(app)
 
 @app.on_event("startup")
-def save_openapi_json():
-    openapi_data = app.openapi()
-    with open("openapi.json", 'w') as fin:
-        json.dump(openapi_data, fin)
+def finish_startup():
+    timeline.finish("startup")
 
 
 class Item(BaseModel):
@@ -50,7 +60,8 @@ class Location(BaseModel):
     inventory: Dict[str, int] = {}
 
 
-locations_db: List[Location] = []
+# Indexed by location id, so lookups do not scan every location
+locations_db: Dict[int, Location] = {}
 
 
 class Purchase(BaseModel):
@@ -65,7 +76,53 @@ class Purchase(BaseModel):
     quantity: int
 
 
-purchases_db: List[Purchase] = []
+# Purchases of each location, indexed by location id
+purchases_db: Dict[int, List[Purchase]] = {}
+
+
+class ReservationRequest(BaseModel):
+    """
+    Represents a request to hold an item for a checkout.
+
+    Attributes:
+    - item_id: Unique identifier for the item to reserve (str).
+    - quantity: The quantity to reserve (int).
+    - ttl_seconds: Seconds until the reservation expires, 15 minutes by default (float).
+    """
+    item_id: str
+    quantity: int
+    ttl_seconds: float = 900
+
+
+class Reservation(BaseModel):
+    """
+    Represents an open reservation of an item in a location.
+
+    Attributes:
+    - id: Unique identifier for the reservation (int).
+    - location_id: The location the item is held in (int).
+    - item_id: Unique identifier for the reserved item (str).
+    - quantity: The reserved quantity (int).
+    - expires_at: When the reservation is released unless confirmed (datetime).
+    """
+    id: int
+    location_id: int
+    item_id: str
+    quantity: int
+    expires_at: datetime
+
+
+MAX_RESERVATION_TTL = 24 * 60 * 60
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", 1))
+
+# Open reservations, indexed by reservation id
+reservations_db: Dict[int, Reservation] = {}
+# Reserved quantities of each location, by location id and item id
+reserved_db: Dict[int, Dict[str, int]] = {}
+# (deadline, reservation id) of open reservations; confirmed and released
+# ones stay until their deadline and are skipped then
+expiry_heap: List[Tuple[float, int]] = []
+reservation_ids = itertools.count(1)
 
 
 class UpdateInventoryRequest(BaseModel):
@@ -92,8 +149,13 @@ async def create_location(location: Location):
 
     Returns:
     - The newly created Location object.
+
+    Raises:
+    - HTTPException: If a location with the same ID exists (409).
     """
-    locations_db.append(location)
+    if location.id in locations_db:
+        raise HTTPException(status_code=409, detail="Location already exists")
+    locations_db[location.id] = location
     return location
 
 
@@ -105,7 +167,7 @@ async def get_locations():
     Returns:
     - A list of Location objects, each representing a different location.
     """
-    return locations_db
+    return list(locations_db.values())
 
 
 @app.get("/locations/{location_id}", response_model=Location)
@@ -122,7 +184,7 @@ async def get_location(location_id: int):
     Raises:
     - HTTPException: If the location is not found (404).
     """
-    location = next((loc for loc in locations_db if loc.id == location_id), None)
+    location = locations_db.get(location_id)
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
     return location
@@ -157,7 +219,7 @@ async def get_inventory(location_id: int):
     Raises:
     - HTTPException: If the location is not found (404).
     """
-    location = next((loc for loc in locations_db if loc.id == location_id), None)
+    location = locations_db.get(location_id)
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
     return location.inventory
@@ -180,9 +242,10 @@ async def update_inventory(location_id: int, update_request: UpdateInventoryRequ
     Raises:
     - HTTPException: If the location is not found (404),
         if the item is not found (404),
-        or if the resulting inventory would be negative (400).
+        or if the resulting inventory would be negative
+        or below the reserved quantity (400).
     """
-    location = next((loc for loc in locations_db if loc.id == location_id), None)
+    location = locations_db.get(location_id)
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
     
@@ -191,7 +254,8 @@ async def update_inventory(location_id: int, update_request: UpdateInventoryRequ
     
     new_quantity = location.inventory.get(update_request.item_id, 0)
     new_quantity += update_request.quantity_change
-    if new_quantity < 0:
+    release_expired_reservations()
+    if new_quantity < reserved_db.get(location_id, {}).get(update_request.item_id, 0):
         raise HTTPException(status_code=400, detail="Insufficient inventory")
     
     location.inventory[update_request.item_id] = new_quantity
@@ -215,7 +279,7 @@ async def get_excess_inventory(location_id: int):
     Raises:
     - HTTPException: If the location is not found (404).
     """
-    location = next((loc for loc in locations_db if loc.id == location_id), None)
+    location = locations_db.get(location_id)
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
     
@@ -243,7 +307,7 @@ async def get_missing_inventory(location_id: int):
     Raises:
     - HTTPException: If the location is not found (404).
     """
-    location = next((loc for loc in locations_db if loc.id == location_id), None)
+    location = locations_db.get(location_id)
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
     
@@ -274,10 +338,10 @@ async def create_purchase(location_id: int, purchase: Purchase):
     Raises:
     - HTTPException: If the location is not found (404),
         if the item is not found (404),
-        or if there is insufficient inventory
-        for the requested purchase (400).
+        or if there is insufficient inventory not held
+        by reservations for the requested purchase (400).
     """
-    location = next((loc for loc in locations_db if loc.id == location_id), None)
+    location = locations_db.get(location_id)
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
 
@@ -285,12 +349,12 @@ async def create_purchase(location_id: int, purchase: Purchase):
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
 
-    current_quantity = location.inventory.get(purchase.item_id, 0)
-    if current_quantity < purchase.quantity:
+    release_expired_reservations()
+    if available_quantity(location, purchase.item_id) < purchase.quantity:
         raise HTTPException(status_code=400, detail="Insufficient inventory for purchase")
 
     location.inventory[purchase.item_id] -= purchase.quantity
-    purchases_db.append(purchase)
+    purchases_db.setdefault(location_id, []).append(purchase)
     return purchase
 
 
@@ -310,9 +374,219 @@ async def get_purchases(location_id: int):
     Raises:
     - HTTPException: If the location is not found (404).
     """
-    location = next((loc for loc in locations_db if loc.id == location_id), None)
+    location = locations_db.get(location_id)
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
 
-    return [purchase for purchase in purchases_db if purchase.location_id == location_id]
+    return purchases_db.get(location_id, [])
+
+# --- Reservations ---
+
+def available_quantity(location: Location, item_id: str) -> int:
+    """Quantity of an item in a location that is not reserved."""
+    reserved = reserved_db.get(location.id, {}).get(item_id, 0)
+    return location.inventory.get(item_id, 0) - reserved
+
+
+def _unhold(reservation: Reservation):
+    reserved = reserved_db[reservation.location_id]
+    reserved[reservation.item_id] -= reservation.quantity
+    if not reserved[reservation.item_id]:
+        del reserved[reservation.item_id]
+
+
+def release_expired_reservations() -> int:
+    """
+    Releases every reservation whose deadline passed. Only the expired
+    deadlines are popped from the heap, so the cost does not depend
+    on the number of open reservations.
+    """
+    now = time.time()
+    released = 0
+    while expiry_heap and expiry_heap[0][0] <= now:
+        _, reservation_id = heapq.heappop(expiry_heap)
+        reservation = reservations_db.pop(reservation_id, None)
+        if reservation is not None:
+            _unhold(reservation)
+            released += 1
+    return released
+
+
+def _take_reservation(reservation_id: int) -> Reservation:
+    release_expired_reservations()
+    reservation = reservations_db.pop(reservation_id, None)
+    if reservation is None:
+        raise HTTPException(status_code=404, detail="Reservation not found or expired")
+    _unhold(reservation)
+    return reservation
+
+
+async def _release_expired_periodically():
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+        release_expired_reservations()
+
+
+@app.on_event("startup")
+async def start_reservation_expiry():
+    # Requests release expired reservations too, this frees their memory
+    # when no purchases come in
+    asyncio.create_task(_release_expired_periodically())
+
+
+@app.post("/locations/{location_id}/reservations/", response_model=Reservation)
+async def create_reservation(location_id: int, request: ReservationRequest):
+    """
+    Holds a quantity of an item in the specified location for a checkout,
+    so it can not be purchased by anyone else until the reservation
+    is confirmed, released or expires.
+
+    Parameters:
+    - **location_id**: The unique identifier for the location.
+    - **request**: An object containing the item ID, the quantity
+        and the time to live of the reservation in seconds (at most 24 hours).
+
+    Returns:
+    - The Reservation object, with the ID to confirm or release it.
+
+    Raises:
+    - HTTPException: If the location is not found (404),
+        if the item is not found (404),
+        if the quantity or time to live is invalid (400),
+        or if there is insufficient inventory (400).
+    """
+    location = locations_db.get(location_id)
+    if not location:
+        raise HTTPException(status_code=404, detail="Location not found")
+
+    if request.item_id not in items_db:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    if request.quantity <= 0 or not 0 < request.ttl_seconds <= MAX_RESERVATION_TTL:
+        raise HTTPException(status_code=400, detail="Invalid quantity or ttl_seconds")
+
+    release_expired_reservations()
+    if available_quantity(location, request.item_id) < request.quantity:
+        raise HTTPException(status_code=400, detail="Insufficient inventory for reservation")
+
+    deadline = time.time() + request.ttl_seconds
+    reservation = Reservation(
+        id=next(reservation_ids),
+        location_id=location_id,
+        item_id=request.item_id,
+        quantity=request.quantity,
+        expires_at=datetime.fromtimestamp(deadline, timezone.utc))
+    reservations_db[reservation.id] = reservation
+    reserved = reserved_db.setdefault(location_id, {})
+    reserved[request.item_id] = reserved.get(request.item_id, 0) + request.quantity
+    heapq.heappush(expiry_heap, (deadline, reservation.id))
+    return reservation
+
+
+@app.get("/reservations/{reservation_id}", response_model=Reservation)
+async def get_reservation(reservation_id: int):
+    """
+    Retrieves an open reservation.
+
+    Parameters:
+    - **reservation_id**: The unique identifier for the reservation.
+
+    Returns:
+    - The Reservation object.
+
+    Raises:
+    - HTTPException: If the reservation is not found or expired (404).
+    """
+    release_expired_reservations()
+    reservation = reservations_db.get(reservation_id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found or expired")
+    return reservation
+
+
+@app.post("/reservations/{reservation_id}/confirm", response_model=Purchase)
+async def confirm_reservation(reservation_id: int):
+    """
+    Purchases the reserved quantity, as
+    `POST /locations/{location_id}/purchases/` would.
+
+    Parameters:
+    - **reservation_id**: The unique identifier for the reservation.
+
+    Returns:
+    - The Purchase object containing the item ID and quantity purchased.
+
+    Raises:
+    - HTTPException: If the reservation is not found or expired (404),
+        or if the location's inventory no longer covers it (409).
+    """
+    release_expired_reservations()
+    reservation = reservations_db.get(reservation_id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found or expired")
+
+    location = locations_db[reservation.location_id]
+    if location.inventory.get(reservation.item_id, 0) < reservation.quantity:
+        raise HTTPException(
+            status_code=409, detail="Inventory no longer covers the reservation")
+
+    _take_reservation(reservation_id)
+    location.inventory[reservation.item_id] -= reservation.quantity
+    purchase = Purchase(item_id=reservation.item_id, quantity=reservation.quantity)
+    purchases_db.setdefault(reservation.location_id, []).append(purchase)
+    return purchase
+
+
+@app.delete("/reservations/{reservation_id}")
+async def release_reservation(reservation_id: int):
+    """
+    Releases a reservation before it expires,
+    so the item can be purchased again.
+
+    Parameters:
+    - **reservation_id**: The unique identifier for the reservation.
+
+    Returns:
+    - A confirmation message.
+
+    Raises:
+    - HTTPException: If the reservation is not found or expired (404).
+    """
+    _take_reservation(reservation_id)
+    return {"message": "Reservation released"}
+
+# --- Metrics ---
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    """
+    Returns the startup timeline of the service
+    in the Prometheus text format.
+    """
+    return timeline.render()
+
+# --- Profiling ---
+
+@app.get("/admin/profile", response_class=PlainTextResponse, include_in_schema=False)
+async def read_profile(
+        seconds: float = 5, route: Optional[str] = None,
+        x_profiler_token: Optional[str] = Header(None)):
+    """
+    Samples the service for a number of seconds and returns
+    collapsed stacks for flamegraph tools.
+    Disabled unless the PROFILER_TOKEN environment variable is set.
+
+    Parameters:
+    - **seconds**: How long to sample, at most 60 seconds.
+    - **route**: (Optional) Path template of the only route to sample,
+        e.g. `/locations/{location_id}`.
+    - **x_profiler_token**: Must match PROFILER_TOKEN.
+
+    Returns:
+    - Lines of `frame;frame;frame count`.
+    """
+    authorize(x_profiler_token)
+    return await profile(seconds, route)
+
 
+timeline.mark("app")
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+# For the common package at the root of the repository
+sys.path.insert(1, os.path.dirname(os.path.dirname(SERVICE_DIR)))
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def empty_databases():
+    """Every test starts without locations, items, purchases or reservations."""
+    for db in (
+            main.items_db, main.locations_db, main.purchases_db,
+            main.reservations_db, main.reserved_db):
+        db.clear()
+    main.expiry_heap.clear()
+    yield
@@ -0,0 +1,29 @@
+from fastapi.testclient import TestClient
+
+import main
+
+
+client = TestClient(main.app)
+
+
+def test_posting_an_existing_id_is_a_conflict():
+    location = {"id": 1, "name": "Store", "location": "Main street"}
+    assert client.post("/locations/", json=location).status_code == 200
+    response = client.post("/locations/", json=dict(location, name="Other"))
+    assert response.status_code == 409
+    assert client.get("/locations/1").json()["name"] == "Store"
+
+
+def test_purchases_are_listed_per_location():
+    main.items_db["apple"] = main.Item(
+        id="apple", name="Apple", min_quantity=1, max_quantity=100)
+    for location_id in (1, 2):
+        assert client.post("/locations/", json={
+            "id": location_id, "name": "Store", "location": "Main street",
+            "inventory": {"apple": 10},
+        }).status_code == 200
+    purchase = {"item_id": "apple", "quantity": 2}
+    assert client.post("/locations/1/purchases/", json=purchase).status_code == 200
+
+    assert client.get("/locations/1/purchases/").json() == [purchase]
+    assert client.get("/locations/2/purchases/").json() == []
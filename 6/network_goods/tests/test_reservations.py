@@ -0,0 +1,94 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+client = TestClient(main.app)
+
+
+@pytest.fixture
+def location():
+    main.items_db["apple"] = main.Item(
+        id="apple", name="Apple", min_quantity=1, max_quantity=100)
+    response = client.post("/locations/", json={
+        "id": 1, "name": "Store", "location": "Main street",
+        "inventory": {"apple": 10},
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+def reserve(quantity, ttl_seconds=60, location_id=1):
+    return client.post(f"/locations/{location_id}/reservations/", json={
+        "item_id": "apple", "quantity": quantity, "ttl_seconds": ttl_seconds,
+    })
+
+
+def purchase(quantity):
+    return client.post(
+        "/locations/1/purchases/", json={"item_id": "apple", "quantity": quantity})
+
+
+def test_reservation_holds_inventory_until_confirmed(location):
+    reservation = reserve(8).json()
+    assert purchase(3).status_code == 400
+    assert reserve(3).status_code == 400
+
+    response = client.post(f"/reservations/{reservation['id']}/confirm")
+    assert response.status_code == 200
+    assert response.json() == {"item_id": "apple", "quantity": 8}
+    assert client.get("/locations/1/inventory/").json() == {"apple": 2}
+    assert client.get(f"/reservations/{reservation['id']}").status_code == 404
+    assert purchase(2).status_code == 200
+
+
+def test_released_reservation_frees_inventory(location):
+    reservation = reserve(8).json()
+    assert client.delete(f"/reservations/{reservation['id']}").status_code == 200
+    assert client.post(f"/reservations/{reservation['id']}/confirm").status_code == 404
+    assert purchase(10).status_code == 200
+
+
+def test_expired_reservation_is_released(location, monkeypatch):
+    now = main.time.time()
+    reservation = reserve(8, ttl_seconds=30).json()
+    monkeypatch.setattr(main.time, "time", lambda: now + 31)
+    assert client.get(f"/reservations/{reservation['id']}").status_code == 404
+    assert main.reserved_db[1] == {}
+    assert purchase(10).status_code == 200
+
+
+def test_expiry_pops_only_expired_deadlines(location, monkeypatch):
+    now = main.time.time()
+    for ttl_seconds in (30, 10, 20):
+        reserve(1, ttl_seconds=ttl_seconds)
+    monkeypatch.setattr(main.time, "time", lambda: now + 25)
+    assert main.release_expired_reservations() == 2
+    assert [deadline for deadline, _ in main.expiry_heap] == [pytest.approx(now + 30, abs=1)]
+    assert main.reserved_db[1] == {"apple": 1}
+
+
+def test_inventory_can_not_drop_below_reserved(location):
+    reserve(8)
+    response = client.put(
+        "/locations/1/inventory/", json={"item_id": "apple", "quantity_change": -3})
+    assert response.status_code == 400
+
+
+def test_invalid_reservations_are_rejected(location):
+    assert reserve(0).status_code == 400
+    assert reserve(1, ttl_seconds=0).status_code == 400
+    assert reserve(1, location_id=2).status_code == 404
+    assert reserve(11).status_code == 400
+
+
+def test_confirm_when_the_inventory_no_longer_covers_it(location):
+    reservation = reserve(8).json()
+    main.locations_db[1].inventory = {"apple": 5}
+    response = client.post(f"/reservations/{reservation['id']}/confirm")
+    assert response.status_code == 409
+    # The reservation stays open, a restock lets it be confirmed
+    main.locations_db[1].inventory["apple"] = 8
+    assert client.post(f"/reservations/{reservation['id']}/confirm").status_code == 200
+    assert main.locations_db[1].inventory == {"apple": 0}
@@ -0,0 +1,27 @@
+import argparse
+
+from common.startup import OPENAPI_FILE, export_openapi
+
+
+def export_schema():
+    from main import app
+
+    export_openapi(app)
+    print(f"OpenAPI schema written to {OPENAPI_FILE}")
+
+
+COMMANDS = {
+    "export-openapi": export_schema,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build commands of the orders service.")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    COMMANDS[args.command]()
+
+
+if __name__ == "__main__":
+    main()
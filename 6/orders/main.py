@@ -1,17 +1,21 @@
-import json
 from enum import Enum
 from pydantic import BaseModel
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from common.profiler import ProfilerMiddleware, authorize, profile
+from common.startup import serve_prebuilt_openapi, timeline
+
+timeline.mark("imports")
 
 
 app = FastAPI()
+app.add_middleware(ProfilerMiddleware)
+serve_prebuilt_openapi(app)
 
 @app.on_event("startup")
-def save_openapi_json():
-    openapi_data = app.openapi()
-    with open("openapi.json", 'w') as fin:
-        json.dump(openapi_data, fin)
+def finish_startup():
+    timeline.finish("startup")
 
 
 class OrderStatus(str, Enum):
@@ -53,7 +57,8 @@ class Order(BaseModel):
     status: OrderStatus = OrderStatus.pending
 
 
-orders_db: List[Order] = []
+# Indexed by order id, so lookups do not scan every order
+orders_db: Dict[int, Order] = {}
 
 
 @app.post("/orders/", response_model=Order)
@@ -66,8 +71,13 @@ async def create_order(order: Order):
 
     Returns:
     - The created Order object.
+
+    Raises:
+    - HTTPException: If an order with the same ID exists (409).
     """
-    orders_db.append(order)
+    if order.order_id in orders_db:
+        raise HTTPException(status_code=409, detail="Order already exists")
+    orders_db[order.order_id] = order
     return order
 
 
@@ -79,7 +89,7 @@ async def get_orders():
     Returns:
     - A list of Order objects representing all existing orders.
     """
-    return orders_db
+    return list(orders_db.values())
 
 
 @app.get("/orders/{order_id}", response_model=Order)
@@ -96,10 +106,10 @@ async def get_order(order_id: int):
     Raises:
     - HTTPException: If the order is not found (404).
     """
-    for order in orders_db:
-        if order.order_id == order_id:
-            return order
-    raise HTTPException(status_code=404, detail="Order not found")
+    order = orders_db.get(order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
 
 
 @app.put("/orders/{order_id}", response_model=Order)
@@ -117,11 +127,11 @@ async def update_order(order_id: int, status: OrderStatus):
     Raises:
     - HTTPException: If the order is not found (404).
     """
-    for order in orders_db:
-        if order.order_id == order_id:
-            order.status = status
-            return order
-    raise HTTPException(status_code=404, detail="Order not found")
+    order = orders_db.get(order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    order.status = status
+    return order
 
 
 @app.delete("/orders/{order_id}", response_model=dict)
@@ -138,9 +148,42 @@ async def delete_order(order_id: int):
     Raises:
     - HTTPException: If the order is not found (404).
     """
-    for i, order in enumerate(orders_db):
-        if order.order_id == order_id:
-            del orders_db[i]
-            return {"message": "Order deleted"}
-    raise HTTPException(status_code=404, detail="Order not found")
+    if orders_db.pop(order_id, None) is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return {"message": "Order deleted"}
+
+# --- Metrics ---
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    """
+    Returns the startup timeline of the service
+    in the Prometheus text format.
+    """
+    return timeline.render()
+
+# --- Profiling ---
+
+@app.get("/admin/profile", response_class=PlainTextResponse, include_in_schema=False)
+async def read_profile(
+        seconds: float = 5, route: Optional[str] = None,
+        x_profiler_token: Optional[str] = Header(None)):
+    """
+    Samples the service for a number of seconds and returns
+    collapsed stacks for flamegraph tools.
+    Disabled unless the PROFILER_TOKEN environment variable is set.
+
+    Parameters:
+    - **seconds**: How long to sample, at most 60 seconds.
+    - **route**: (Optional) Path template of the only route to sample,
+        e.g. `/locations/{location_id}`.
+    - **x_profiler_token**: Must match PROFILER_TOKEN.
+
+    Returns:
+    - Lines of `frame;frame;frame count`.
+    """
+    authorize(x_profiler_token)
+    return await profile(seconds, route)
+
 
+timeline.mark("app")
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+# For the common package at the root of the repository
+sys.path.insert(1, os.path.dirname(os.path.dirname(SERVICE_DIR)))
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def empty_database():
+    """Every test starts without orders."""
+    main.orders_db.clear()
+    yield
@@ -0,0 +1,14 @@
+from fastapi.testclient import TestClient
+
+import main
+
+
+client = TestClient(main.app)
+
+
+def test_posting_an_existing_id_is_a_conflict():
+    order = {"order_id": 1, "product_id": 7, "quantity": 3}
+    assert client.post("/orders/", json=order).status_code == 200
+    response = client.post("/orders/", json=dict(order, quantity=5))
+    assert response.status_code == 409
+    assert client.get("/orders/1").json()["quantity"] == 3
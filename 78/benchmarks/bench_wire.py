@@ -0,0 +1,99 @@
+"""
+Compares the wire format from common/wire.py with plain JSON dicts, which is
+what create_delivery_order used to send, for delivery order batches.
+
+Reports encoded bytes per record and encode/decode time per record
+for single-record messages and for batched envelopes.
+
+    python bench_wire.py
+    python bench_wire.py --batch 1 10 100 1000 --rounds 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.wire import DELIVERY_ORDER, decode, encode
+
+
+def make_records(count: int) -> list:
+    rng = random.Random(count)
+    return [
+        {
+            "location_id": rng.randint(1, 500),
+            "product_id": rng.randint(1, 100000),
+            "product_name": f"Product {rng.randint(1, 100000)}",
+            "quantity": rng.choice((100, 200, 500)),
+        }
+        for _ in range(count)
+    ]
+
+
+def json_encode(records):
+    return [json.dumps(record).encode() for record in records]
+
+
+def json_decode(messages):
+    return [json.loads(message) for message in messages]
+
+
+def measure(name, batch, records, encode_all, decode_all, rounds):
+    messages = encode_all(records)
+    size = sum(len(message) for message in messages)
+    encode_time = min(timeit.repeat(
+        lambda: encode_all(records), number=1, repeat=rounds))
+    decode_time = min(timeit.repeat(
+        lambda: decode_all(messages), number=1, repeat=rounds))
+    count = len(records)
+    return {
+        "format": name,
+        "batch": batch,
+        "messages": len(messages),
+        "bytes_per_record": size / count,
+        "encode_us_per_record": encode_time / count * 1e6,
+        "decode_us_per_record": decode_time / count * 1e6,
+    }
+
+
+def run(batch: int, total: int, rounds: int):
+    records = make_records(total)
+    batches = [records[start:start + batch] for start in range(0, total, batch)]
+
+    def envelopes(use_json):
+        def encode_all(_):
+            return [encode(DELIVERY_ORDER, chunk, use_json) for chunk in batches]
+        return encode_all
+
+    def decode_all(messages):
+        return [decode(message) for message in messages]
+
+    return [
+        measure("json", 1, records, json_encode, json_decode, rounds),
+        measure("wire-json", batch, records, envelopes(True), decode_all, rounds),
+        measure("wire", batch, records, envelopes(False), decode_all, rounds),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'format':<10}{'batch':>6}{'messages':>9}{'B/record':>10}"
+          f"{'enc us':>9}{'dec us':>9}")
+    for batch in args.batch:
+        for result in run(batch, args.records, args.rounds):
+            print(f"{result['format']:<10}{result['batch']:>6}"
+                  f"{result['messages']:>9}{result['bytes_per_record']:>10.1f}"
+                  f"{result['encode_us_per_record']:>9.2f}"
+                  f"{result['decode_us_per_record']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
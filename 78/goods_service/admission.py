@@ -0,0 +1,168 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+
+from common.database import POOL_SIZE, MAX_OVERFLOW
+from common.metrics import metrics
+
+
+READS = "reads"
+PURCHASES = "purchases"
+ADMIN = "admin"
+
+PURCHASE_PATHS = ("/purchase", "/reservations")
+EXEMPT_PATHS = (
+    "/metrics", "/health/ready", "/admin/profile",
+    "/docs", "/redoc", "/openapi.json")
+
+ADMISSION_QUEUE_FACTOR = int(os.getenv("ADMISSION_QUEUE_FACTOR", 4))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 2))
+
+
+class ConcurrencyLimiter:
+    """
+    Lets at most `limit` requests of one route class run at once.
+    Up to `max_queue` further requests wait in FIFO order
+    for at most `queue_timeout` seconds; anything beyond is rejected.
+    """
+
+    def __init__(
+            self, name: str, limit: int, max_queue: int,
+            queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = deque()
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self._admit(0)
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self._shed("queue_full")
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._report()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove(waiter)
+            self._shed("timeout")
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+        self._admit(time.monotonic() - started)
+        return True
+
+    def release(self):
+        # The slot is handed to the next waiter instead of being freed
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._report()
+                return
+        self.in_flight -= 1
+        self._report()
+
+    def _admit(self, waited: float):
+        metrics.inc("admission_admitted_total", route_class=self.name)
+        metrics.inc(
+            "admission_queue_wait_seconds_total", waited, route_class=self.name)
+        self._report()
+
+    def _shed(self, reason: str):
+        metrics.inc(
+            "admission_shed_total", route_class=self.name, reason=reason)
+
+    def _remove(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._report()
+
+    def _report(self):
+        metrics.set("admission_in_flight", self.in_flight, route_class=self.name)
+        metrics.set(
+            "admission_queue_depth", len(self._waiters), route_class=self.name)
+
+
+def default_limiters(pool_capacity: int = POOL_SIZE + MAX_OVERFLOW):
+    """
+    Splits the DB connection pool between route classes,
+    so the admitted requests never wait on the pool itself.
+    """
+    reads = max(1, pool_capacity // 2)
+    purchases = max(1, pool_capacity * 3 // 10)
+    admin = max(1, pool_capacity - reads - purchases)
+    limits = {
+        READS: int(os.getenv("ADMISSION_READS_LIMIT", reads)),
+        PURCHASES: int(os.getenv("ADMISSION_PURCHASES_LIMIT", purchases)),
+        ADMIN: int(os.getenv("ADMISSION_ADMIN_LIMIT", admin)),
+    }
+    return {
+        name: ConcurrencyLimiter(name, limit, limit * ADMISSION_QUEUE_FACTOR)
+        for name, limit in limits.items()
+    }
+
+
+def classify_request(scope) -> str:
+    if scope["method"] in ("GET", "HEAD"):
+        return READS
+    if scope["path"].startswith(PURCHASE_PATHS):
+        return PURCHASES
+    return ADMIN
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware that limits concurrent requests per route class
+    and answers `503` with `Retry-After` when a class is saturated.
+    """
+
+    def __init__(self, app, limiters=None, classify=classify_request):
+        self.app = app
+        self.limiters = limiters or default_limiters()
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters[self.classify(scope)]
+        if not await limiter.acquire():
+            await _send_overloaded(send, limiter)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+async def _send_overloaded(send, limiter: ConcurrencyLimiter):
+    body = b'{"detail":"Service overloaded, retry later"}'
+    retry_after = str(max(1, math.ceil(limiter.queue_timeout))).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", retry_after),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,57 @@
+import asyncio
+import os
+
+from common.database import async_session
+from common.metrics import metrics
+
+
+COALESCED_ROUTES = set(
+    route.strip()
+    for route in os.getenv("COALESCED_ROUTES", "product,location").split(",")
+    if route.strip()
+)
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time and hands its result
+    to every caller that asks for the same key meanwhile.
+    Calls are only shared while in flight, nothing is cached.
+    """
+
+    def __init__(self, route: str, enabled: bool = True):
+        self.route = route
+        self.enabled = enabled
+        self._calls = {}
+
+    async def do(self, key, fn):
+        if not self.enabled:
+            return await fn()
+
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            metrics.inc("coalesce_executed_total", route=self.route)
+        else:
+            metrics.inc("coalesce_saved_total", route=self.route)
+        # A caller that goes away must not cancel the shared call
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+
+def single_flight(route: str) -> SingleFlight:
+    return SingleFlight(route, enabled=route in COALESCED_ROUTES)
+
+
+async def with_session(fn, *args):
+    """
+    Runs a crud function in its own session,
+    so a shared call does not depend on the caller's one.
+    """
+    async with async_session() as session:
+        return await fn(session, *args)
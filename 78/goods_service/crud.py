@@ -1,95 +1,236 @@
+from datetime import datetime, timedelta, timezone
+
 import httpx
 
+from fastapi import HTTPException
+from sqlalchemy import delete, func, literal, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
+
+from common.tracing import TracingTransport
 
 from models import *
 from schemas import *
 
 
 async def get_location(db: AsyncSession, location_id: int):
+    result = await db.execute(
+        select(
+            Location.id, Location.name, Location.address, Location.version,
+            _product_ids_agg())
+        .outerjoin(
+            location_product,
+            location_product.c.location_id == Location.id)
+        .where(Location.id == location_id)
+        .group_by(Location.id)
+    )
+    row = result.one_or_none()
+    return _location_row(row) if row else None
+
+async def get_locations(db: AsyncSession, skip: int = 0, limit: int = 10):
+    page = (
+        select(Location.id, Location.name, Location.address, Location.version)
+        .order_by(Location.id)
+        .offset(skip)
+        .limit(limit)
+        .subquery()
+    )
+    result = await db.execute(
+        select(page, _product_ids_agg())
+        .select_from(page)
+        .outerjoin(
+            location_product,
+            location_product.c.location_id == page.c.id)
+        .group_by(page.c.id, page.c.name, page.c.address, page.c.version)
+        .order_by(page.c.id)
+    )
+    return [_location_row(row) for row in result.all()]
+
+async def get_location_expanded(db: AsyncSession, location_id: int):
     result = await db.execute(
         select(Location)
         .where(Location.id == location_id)
-        .options(joinedload(Location.products))
+        .options(selectinload(Location.products))
     )
     return result.scalar_one_or_none()
 
-async def get_locations(db: AsyncSession, skip: int = 0, limit: int = 10):
+async def get_locations_expanded(
+        db: AsyncSession, skip: int = 0, limit: int = 10):
     result = await db.execute(
         select(Location)
+        .order_by(Location.id)
         .offset(skip)
         .limit(limit)
-        .options(joinedload(Location.products))
+        .options(selectinload(Location.products))
+    )
+    return result.scalars().all()
+
+def _product_ids_agg():
+    return (
+        func.array_agg(location_product.c.product_id)
+        .filter(location_product.c.product_id.is_not(None))
+        .label("products")
     )
-    locations = result.unique().scalars().all()
-    return locations
+
+def _location_row(row) -> dict:
+    location = dict(row._mapping)
+    location["products"] = location["products"] or []
+    return location
 
 async def create_location(db: AsyncSession, location: LocationCreate):
     db_location = Location(name=location.name, address=location.address)
     db.add(db_location)
-    await db.commit()
-    await db.refresh(db_location)
+    await db.flush()
 
-    if location.products:
-        result = await db.execute(
-            select(Product)
-            .filter(Product.id.in_(location.products))
-        )
-        products = result.scalars().all()
-        db_location.products.extend(products)
-        await db.commit()
-        await db.refresh(db_location)
+    product_ids = await _insert_location_products(
+        db, db_location.id, location.products)
 
-    return db_location
+    await db.commit()
+    return {
+        "id": db_location.id,
+        "name": db_location.name,
+        "address": db_location.address,
+        "version": db_location.version,
+        "products": product_ids,
+    }
 
 
 async def update_location(
         db: AsyncSession, location_id: int, location: LocationUpdate):
-    result = await db.execute(
-        select(Location)
-        .options(joinedload(Location.products))
-        .filter(Location.id == location_id)
-    )
-    db_location = result.scalars().unique().first()
+    data = location.dict(exclude_unset=True)
+    product_ids = data.pop("products", None)
 
-    if not db_location:
+    if not await _update_location_fields(db, location_id, data):
         return None
 
-    for key, value in location.dict(exclude_unset=True).items():
-        if key == "products":
-            continue
-        setattr(db_location, key, value)
-
-    if "products" in location.dict(exclude_unset=True):
-        product_ids = location.products
+    if product_ids is not None:
+        # Only the difference between the stored and the requested
+        # membership is written, the collection itself is never loaded.
         result = await db.execute(
-            select(Product)
-            .filter(Product.id.in_(product_ids))
+            delete(location_product)
+            .where(location_product.c.location_id == location_id)
+            .where(location_product.c.product_id.not_in(product_ids))
+            .returning(location_product.c.product_id)
         )
-        products = result.scalars().all()
-        db_location.products = products
+        await _shift_summary_for_membership(
+            db, location_id, list(result.scalars().all()), -1)
+        await _insert_location_products(db, location_id, product_ids)
 
     await db.commit()
-    await db.refresh(db_location)
+    return location_id
 
-    return db_location
+async def patch_location(
+        db: AsyncSession, location_id: int, patch: LocationPatch):
+    data = patch.dict(
+        exclude_unset=True, exclude={"add_products", "remove_products"})
 
-async def delete_location(db: AsyncSession, location_id: int):
+    if not await _update_location_fields(db, location_id, data):
+        return None
+
+    removed = await _delete_location_products(
+        db, location_id, patch.remove_products)
+    added = await _insert_location_products(
+        db, location_id, patch.add_products)
+
+    await db.commit()
+    return LocationProductsDiff(
+        location_id=location_id, added=added, removed=removed)
+
+async def add_location_products(
+        db: AsyncSession, location_id: int, product_ids: List[int]):
+    if not await _update_location_fields(db, location_id, {}):
+        return None
+    added = await _insert_location_products(db, location_id, product_ids)
+    await db.commit()
+    return LocationProductsDiff(location_id=location_id, added=added)
+
+async def remove_location_products(
+        db: AsyncSession, location_id: int, product_ids: List[int]):
+    if not await _update_location_fields(db, location_id, {}):
+        return None
+    removed = await _delete_location_products(db, location_id, product_ids)
+    await db.commit()
+    return LocationProductsDiff(location_id=location_id, removed=removed)
+
+async def _location_exists(db: AsyncSession, location_id: int) -> bool:
     result = await db.execute(
-        select(Location)
-        .filter(Location.id == location_id)
+        select(Location.id).where(Location.id == location_id))
+    return result.scalar_one_or_none() is not None
+
+async def _update_location_fields(
+        db: AsyncSession, location_id: int, data: dict) -> bool:
+    """
+    Updates the given fields and bumps the version of the location.
+    Returns False if the location does not exist.
+    """
+    result = await db.execute(
+        update(Location)
+        .where(Location.id == location_id)
+        .values(**data, version=Location.version + 1)
+        .returning(Location.id)
     )
-    db_location = result.scalars().unique().first()
+    return result.scalar_one_or_none() is not None
+
+async def _insert_location_products(
+        db: AsyncSession, location_id: int, product_ids: List[int]):
+    """
+    Links existing products to the location with a single
+    INSERT ... SELECT, skipping rows that are already present.
+    Returns the ids of the products that were actually linked.
+    """
+    if not product_ids:
+        return []
+    result = await db.execute(
+        insert(location_product)
+        .from_select(
+            ["location_id", "product_id"],
+            select(literal(location_id), Product.id)
+            .where(Product.id.in_(product_ids))
+        )
+        .on_conflict_do_nothing()
+        .returning(location_product.c.product_id)
+    )
+    added = list(result.scalars().all())
+    await _shift_summary_for_membership(db, location_id, added, 1)
+    return added
+
+async def _delete_location_products(
+        db: AsyncSession, location_id: int, product_ids: List[int]):
+    """
+    Unlinks products from the location with a single DELETE.
+    Returns the ids of the products that were actually unlinked.
+    """
+    if not product_ids:
+        return []
+    result = await db.execute(
+        delete(location_product)
+        .where(location_product.c.location_id == location_id)
+        .where(location_product.c.product_id.in_(product_ids))
+        .returning(location_product.c.product_id)
+    )
+    removed = list(result.scalars().all())
+    await _shift_summary_for_membership(db, location_id, removed, -1)
+    return removed
 
-    if not db_location:
+async def delete_location(db: AsyncSession, location_id: int):
+    location = await get_location(db, location_id)
+    if not location:
         return None
 
-    await db.delete(db_location)
+    await db.execute(
+        delete(location_product)
+        .where(location_product.c.location_id == location_id)
+    )
+    await db.execute(
+        delete(LocationInventorySummary)
+        .where(LocationInventorySummary.location_id == location_id)
+    )
+    await db.execute(delete(Location).where(Location.id == location_id))
     await db.commit()
 
-    return db_location
+    return location
 
 
 
@@ -109,75 +250,606 @@ async def create_product(db: AsyncSession, product: ProductCreate):
     return db_product
 
 async def update_product(db: AsyncSession, product_id: int, product: ProductUpdate):
-    db_product = await get_product(db, product_id)
+    db_product = await _get_product_for_update(db, product_id)
     if not db_product:
         return None
+    old_stock, old_value = _stock_and_value(db_product)
     for key, value in product.dict(exclude_unset=True).items():
         setattr(db_product, key, value)
+    db_product.version = Product.version + 1
+    new_stock, new_value = _stock_and_value(db_product)
+    # Reserved stock must stay on hand until confirmed or released
+    if new_stock < db_product.reserved:
+        await db.rollback()
+        raise HTTPException(
+            status_code=409, detail="Stock can not be below the reserved quantity")
+    await _shift_summary_for_product(
+        db, product_id, new_stock - old_stock, new_value - old_value)
+    if new_stock >= db_product.restock_threshold:
+        await _close_restock_orders(db, product_id)
     await db.commit()
     await db.refresh(db_product)
     return db_product
 
 async def delete_product(db: AsyncSession, product_id: int):
-    db_product = await get_product(db, product_id)
+    db_product = await _get_product_for_update(db, product_id)
     if not db_product:
         return None
 
     await create_delivery_order(-1, db_product.id, db_product.name, 100)
 
+    stock, value = _stock_and_value(db_product)
+    await _shift_summary_for_product(db, product_id, -stock, -value, -1)
+    await db.execute(
+        update(Location)
+        .where(
+            Location.id.in_(
+                select(location_product.c.location_id)
+                .where(location_product.c.product_id == product_id)
+            )
+        )
+        .values(version=Location.version + 1)
+        .execution_options(synchronize_session=False)
+    )
     await db.delete(db_product)
     await db.commit()
     return db_product
 
+async def _get_product_for_update(db: AsyncSession, product_id: int):
+    result = await db.execute(
+        select(Product).where(Product.id == product_id).with_for_update())
+    return result.scalar_one_or_none()
+
+def _stock_and_value(product: Product):
+    stock = product.stock or 0
+    return stock, product.price * stock
+
 
 async def make_purchase(db: AsyncSession, location_id: int, product_id: int, quantity: int):
-    # Проверяем, существует ли локация
-    result = await db.execute(
-        select(Location).where(Location.id == location_id).options(joinedload(Location.products))
+    if quantity <= 0:
+        raise HTTPException(status_code=400, detail="Invalid quantity")
+
+    # Списываем товар одним запросом, только если он есть в этой локации
+    # и его хватает без зарезервированного, чтобы параллельные покупки
+    # не теряли обновления
+    result = await db.execute(_purchase_update(location_id, product_id, quantity))
+    row = result.one_or_none()
+    if not row:
+        await db.rollback()
+        await _raise_purchase_error(db, location_id, product_id)
+
+    await _stock_sold(db, location_id, product_id, quantity, row)
+    await db.commit()
+
+    return {
+        "message": "Purchase successful",
+        "location_id": location_id,
+        "product_id": product_id,
+        "remaining_stock": row.stock
+    }
+
+def _purchase_update(location_id: int, product_id: int, quantity: int):
+    return (
+        update(Product)
+        .where(Product.id == product_id)
+        .where(Product.stock - Product.reserved >= quantity)
+        .where(_in_location(location_id))
+        .values(stock=Product.stock - quantity, version=Product.version + 1)
+        .returning(Product.stock, Product.price, Product.restock_threshold)
     )
-    location = result.scalar_one_or_none()
-    if not location:
+
+def _in_location(location_id: int):
+    return Product.id.in_(
+        select(location_product.c.product_id)
+        .where(location_product.c.location_id == location_id)
+    )
+
+async def _stock_sold(
+        db: AsyncSession, location_id: int, product_id: int, quantity: int, row):
+    """Follows up a sale; `row` holds the new stock, price and threshold."""
+    await _shift_summary_for_product(
+        db, product_id, -quantity, -quantity * row.price)
+    # Only the sale crossing the threshold marks it, the restock job
+    # turns the marks into orders, so a run of purchases orders once
+    if row.stock < row.restock_threshold <= row.stock + quantity:
+        await _mark_restock(db, location_id, product_id)
+
+async def _raise_purchase_error(
+        db: AsyncSession, location_id: int, product_id: int,
+        shortage_status_code: int = 400):
+    # Проверяем, существует ли локация
+    if not await _location_exists(db, location_id):
         raise HTTPException(status_code=404, detail="Location not found")
 
     # Проверяем, связан ли продукт с этой локацией
-    product = next((p for p in location.products if p.id == product_id), None)
-    if not product:
+    result = await db.execute(
+        select(location_product.c.product_id)
+        .where(location_product.c.location_id == location_id)
+        .where(location_product.c.product_id == product_id)
+    )
+    if result.scalar_one_or_none() is None:
         raise HTTPException(
             status_code=404, detail="Product not found in this location")
 
-    # Проверяем наличие нужного количества продукта
-    if product.stock < quantity:
+    raise HTTPException(
+        status_code=shortage_status_code,
+        detail="Not enough stock for the product")
+
+
+MAX_RESERVATION_TTL = 24 * 60 * 60
+
+async def get_reservation(db: AsyncSession, reservation_id: int):
+    result = await db.execute(
+        select(Reservation).where(Reservation.id == reservation_id))
+    return result.scalar_one_or_none()
+
+async def reserve_stock(
+        db: AsyncSession, location_id: int, product_id: int,
+        quantity: int, ttl_seconds: float):
+    """
+    Holds `quantity` of a product for `ttl_seconds`. The check for
+    available stock (stock - reserved) and the hold are one UPDATE,
+    so concurrent reservations and purchases can not oversell.
+    """
+    if quantity <= 0:
+        raise HTTPException(status_code=400, detail="Invalid quantity")
+    if not 0 < ttl_seconds <= MAX_RESERVATION_TTL:
         raise HTTPException(
-            status_code=400, detail="Not enough stock for the product")
+            status_code=400,
+            detail=f"ttl_seconds must be between 0 and {MAX_RESERVATION_TTL}")
 
-    # Вычитаем количество и сохраняем изменения
-    product.stock -= quantity
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .where(Product.stock - Product.reserved >= quantity)
+        .where(_in_location(location_id))
+        .values(
+            reserved=Product.reserved + quantity, version=Product.version + 1)
+        .returning(Product.id)
+    )
+    if result.scalar_one_or_none() is None:
+        await db.rollback()
+        await _raise_purchase_error(db, location_id, product_id)
+
+    reservation = Reservation(
+        location_id=location_id,
+        product_id=product_id,
+        quantity=quantity,
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds),
+    )
+    db.add(reservation)
+    await db.commit()
+    return reservation
+
+async def _take_reservation(db: AsyncSession, reservation_id: int):
+    """Deletes an unexpired reservation and returns it, or raises 404."""
+    result = await db.execute(
+        delete(Reservation)
+        .where(Reservation.id == reservation_id)
+        .where(Reservation.expires_at > datetime.now(timezone.utc))
+        .returning(
+            Reservation.location_id, Reservation.product_id,
+            Reservation.quantity)
+    )
+    reservation = result.one_or_none()
+    if not reservation:
+        await db.rollback()
+        raise HTTPException(
+            status_code=404, detail="Reservation not found or expired")
+    return reservation
+
+async def confirm_reservation(db: AsyncSession, reservation_id: int):
+    """
+    Turns a reservation into a purchase of the held stock, if the product
+    is still sold in the location and its stock still covers the hold.
+    """
+    reservation = await _take_reservation(db, reservation_id)
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == reservation.product_id)
+        .where(Product.stock >= reservation.quantity)
+        .where(_in_location(reservation.location_id))
+        .values(
+            stock=Product.stock - reservation.quantity,
+            reserved=Product.reserved - reservation.quantity,
+            version=Product.version + 1)
+        .returning(Product.stock, Product.price, Product.restock_threshold)
+    )
+    row = result.one_or_none()
+    if not row:
+        # The reservation stays open
+        await db.rollback()
+        await _raise_purchase_error(
+            db, reservation.location_id, reservation.product_id,
+            shortage_status_code=409)
+    await _stock_sold(
+        db, reservation.location_id, reservation.product_id,
+        reservation.quantity, row)
     await db.commit()
-    await db.refresh(product)
 
     return {
         "message": "Purchase successful",
-        "location_id": location_id,
-        "product_id": product_id,
-        "remaining_stock": product.stock
+        "location_id": reservation.location_id,
+        "product_id": reservation.product_id,
+        "remaining_stock": row.stock
     }
 
+async def release_reservation(db: AsyncSession, reservation_id: int):
+    reservation = await _take_reservation(db, reservation_id)
+    await db.execute(
+        update(Product)
+        .where(Product.id == reservation.product_id)
+        .values(
+            reserved=Product.reserved - reservation.quantity,
+            version=Product.version + 1)
+    )
+    await db.commit()
+    return {"message": "Reservation released"}
+
+async def release_expired_reservations(db: AsyncSession, limit: int) -> int:
+    """
+    Releases up to `limit` expired reservations with one statement:
+    the oldest are read from the expires_at index, deleted, and their
+    quantities returned to each product in a single UPDATE.
+    Returns the number of released reservations.
+    """
+    batch = (
+        select(Reservation.id)
+        .where(Reservation.expires_at <= datetime.now(timezone.utc))
+        .order_by(Reservation.expires_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    expired = (
+        delete(Reservation)
+        .where(Reservation.id.in_(batch.scalar_subquery()))
+        .returning(Reservation.product_id, Reservation.quantity)
+        .cte("expired")
+    )
+    totals = (
+        select(
+            expired.c.product_id,
+            func.sum(expired.c.quantity).label("quantity"),
+            func.count().label("reservations"),
+        )
+        .group_by(expired.c.product_id)
+        .cte("totals")
+    )
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == totals.c.product_id)
+        .values(
+            reserved=Product.reserved - totals.c.quantity,
+            version=Product.version + 1)
+        .returning(totals.c.reservations)
+        .execution_options(synchronize_session=False)
+    )
+    released = sum(result.scalars().all())
+    await db.commit()
+    return released
+
+
+async def _mark_restock(db: AsyncSession, location_id: int, product_id: int):
+    await db.execute(_restock_mark_insert(location_id, product_id))
+
+def _restock_mark_insert(location_id: int, product_id: int):
+    return (
+        insert(RestockDirty)
+        .values(location_id=location_id, product_id=product_id)
+        .on_conflict_do_nothing()
+    )
+
+async def _close_restock_orders(db: AsyncSession, product_id: int):
+    # Called once the product is back at its threshold
+    await db.execute(
+        delete(OpenRestockOrder).where(OpenRestockOrder.product_id == product_id))
+
+async def mark_due_restocks(
+        db: AsyncSession, limit: int, reorder_after: timedelta) -> int:
+    """
+    Marks up to `limit` locations and products below the restock
+    threshold that have no open restock order, or only one older than
+    `reorder_after`. Catches what no purchase marked: a raised threshold,
+    stock set by an update, a product added to a location, a lost order.
+    Returns the number of new marks.
+    """
+    cutoff = datetime.now(timezone.utc) - reorder_after
+    due = (
+        select(location_product.c.location_id, location_product.c.product_id)
+        .select_from(Product)
+        .join(location_product, location_product.c.product_id == Product.id)
+        .outerjoin(
+            OpenRestockOrder,
+            (OpenRestockOrder.location_id == location_product.c.location_id)
+            & (OpenRestockOrder.product_id == location_product.c.product_id)
+        )
+        .outerjoin(
+            RestockDirty,
+            (RestockDirty.location_id == location_product.c.location_id)
+            & (RestockDirty.product_id == location_product.c.product_id)
+        )
+        .where(BELOW_RESTOCK_THRESHOLD_PREDICATE)
+        .where(
+            OpenRestockOrder.ordered_at.is_(None)
+            | (OpenRestockOrder.ordered_at < cutoff)
+        )
+        .where(RestockDirty.location_id.is_(None))
+        .limit(limit)
+    )
+    result = await db.execute(
+        insert(RestockDirty)
+        .from_select(["location_id", "product_id"], due)
+        .on_conflict_do_nothing()
+    )
+    await db.commit()
+    return result.rowcount
+
+async def schedule_restocks(
+        db: AsyncSession, limit: int, reorder_after: timedelta) -> int:
+    """
+    Turns up to `limit` restock marks into restock orders, one per
+    location and product, sent to orders_service in a single batch.
+    Marks whose product is back at its threshold, or that already has
+    an open restock order younger than `reorder_after`, are dropped.
+    The marks are consumed and the orders recorded as open in one
+    transaction, which is committed before orders_service is called,
+    so no lock is held across the request. If sending fails the open
+    orders are deleted again and the next mark_due_restocks marks them;
+    if the process dies first, they are marked once `reorder_after` passes.
+    Returns the number of marks consumed.
+    """
+    batch = (
+        select(RestockDirty.location_id, RestockDirty.product_id)
+        .order_by(RestockDirty.marked_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = (
+        delete(RestockDirty)
+        .where(
+            tuple_(RestockDirty.location_id, RestockDirty.product_id)
+            .in_(batch)
+        )
+        .returning(RestockDirty.location_id, RestockDirty.product_id)
+        .cte("claimed")
+    )
+    ordered_at = datetime.now(timezone.utc)
+    cutoff = ordered_at - reorder_after
+    result = await db.execute(
+        select(
+            claimed.c.location_id,
+            claimed.c.product_id,
+            Product.name,
+            Product.stock,
+            Product.restock_threshold,
+            Product.restock_quantity,
+            OpenRestockOrder.ordered_at,
+        )
+        .select_from(claimed)
+        .join(Product, Product.id == claimed.c.product_id)
+        .outerjoin(
+            OpenRestockOrder,
+            (OpenRestockOrder.location_id == claimed.c.location_id)
+            & (OpenRestockOrder.product_id == claimed.c.product_id)
+        )
+    )
+    rows = result.all()
+
+    orders = [
+        {
+            "location_id": row.location_id,
+            "product_id": row.product_id,
+            "product_name": row.name,
+            # Enough to get back to the threshold, at least restock_quantity
+            "quantity": max(
+                row.restock_quantity, row.restock_threshold - (row.stock or 0)),
+        }
+        for row in rows
+        if (row.stock or 0) < row.restock_threshold
+        and (row.ordered_at is None or row.ordered_at < cutoff)
+    ]
+    if orders:
+        stmt = insert(OpenRestockOrder).values([
+            {
+                "location_id": order["location_id"],
+                "product_id": order["product_id"],
+                "quantity": order["quantity"],
+                "ordered_at": ordered_at,
+            }
+            for order in orders
+        ])
+        await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[
+                    OpenRestockOrder.location_id, OpenRestockOrder.product_id],
+                set_={
+                    "quantity": stmt.excluded.quantity,
+                    "ordered_at": stmt.excluded.ordered_at,
+                }
+            )
+        )
+    await db.commit()
+
+    if orders:
+        try:
+            await create_delivery_orders(orders)
+        except Exception:
+            # Only the rows written above, a later run may have replaced them
+            await db.execute(
+                delete(OpenRestockOrder)
+                .where(
+                    tuple_(OpenRestockOrder.location_id, OpenRestockOrder.product_id)
+                    .in_([(order["location_id"], order["product_id"]) for order in orders])
+                )
+                .where(OpenRestockOrder.ordered_at == ordered_at)
+            )
+            await db.commit()
+            raise
+    return len(rows)
+
+
+async def warm_up_queries(db: AsyncSession):
+    """
+    Runs the hot reads and the writes of a purchase (see database.warm_up).
+    Ids start at 1, so nothing matches product 0 and no row is locked.
+    """
+    await get_product(db, 0)
+    await get_location(db, 0)
+    await db.execute(_purchase_update(location_id=0, product_id=0, quantity=1))
+    await db.execute(
+        _summary_shift(product_id=0, stock_delta=-1, value_delta=-1.0))
+
+
+async def get_location_summary(db: AsyncSession, location_id: int):
+    result = await db.execute(
+        select(LocationInventorySummary)
+        .where(LocationInventorySummary.location_id == location_id)
+    )
+    summary = result.scalar_one_or_none()
+    if summary:
+        return summary
+    if not await _location_exists(db, location_id):
+        return None
+    return LocationSummaryOut(location_id=location_id)
+
+async def get_location_summaries(
+        db: AsyncSession, skip: int = 0, limit: int = 10):
+    result = await db.execute(
+        select(LocationInventorySummary)
+        .order_by(LocationInventorySummary.location_id)
+        .offset(skip)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+async def rebuild_inventory_summary(db: AsyncSession):
+    """
+    Recomputes every location summary from the products table.
+    Used to repair drift; the write paths keep it current otherwise.
+    """
+    # Writers wait for the rebuild, so no delta is applied twice or lost
+    await db.execute(text(
+        "LOCK TABLE location_inventory_summary IN SHARE ROW EXCLUSIVE MODE"))
+    await db.execute(delete(LocationInventorySummary))
+    stock = func.coalesce(Product.stock, 0)
+    await db.execute(
+        insert(LocationInventorySummary)
+        .from_select(
+            ["location_id", "sku_count", "total_stock", "stock_value"],
+            select(
+                location_product.c.location_id,
+                func.count(Product.id),
+                func.sum(stock),
+                func.sum(Product.price * stock),
+            )
+            .join(Product, Product.id == location_product.c.product_id)
+            .group_by(location_product.c.location_id)
+        )
+    )
+    await db.commit()
+
+async def _shift_summary_for_product(
+        db: AsyncSession, product_id: int,
+        stock_delta: int, value_delta: float, sku_delta: int = 0):
+    """
+    Applies a change of one product to the summaries
+    of all locations holding it with a single UPDATE.
+    """
+    if not (stock_delta or value_delta or sku_delta):
+        return
+    await db.execute(_summary_shift(product_id, stock_delta, value_delta, sku_delta))
+
+def _summary_shift(
+        product_id: int, stock_delta: int, value_delta: float, sku_delta: int = 0):
+    return (
+        update(LocationInventorySummary)
+        .where(
+            LocationInventorySummary.location_id.in_(
+                select(location_product.c.location_id)
+                .where(location_product.c.product_id == product_id)
+            )
+        )
+        .values(
+            sku_count=LocationInventorySummary.sku_count + sku_delta,
+            total_stock=LocationInventorySummary.total_stock + stock_delta,
+            stock_value=LocationInventorySummary.stock_value + value_delta,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+async def _shift_summary_for_membership(
+        db: AsyncSession, location_id: int, product_ids: List[int], sign: int):
+    """
+    Adds (sign=1) or subtracts (sign=-1) the contribution
+    of the given products to the summary of one location.
+    """
+    if not product_ids:
+        return
+    stock = func.coalesce(Product.stock, 0)
+    stmt = insert(LocationInventorySummary).from_select(
+        ["location_id", "sku_count", "total_stock", "stock_value"],
+        select(
+            literal(location_id),
+            sign * func.count(Product.id),
+            sign * func.coalesce(func.sum(stock), 0),
+            sign * func.coalesce(func.sum(Product.price * stock), 0),
+        )
+        .where(Product.id.in_(product_ids))
+    )
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[LocationInventorySummary.location_id],
+            set_={
+                "sku_count": LocationInventorySummary.sku_count
+                    + stmt.excluded.sku_count,
+                "total_stock": LocationInventorySummary.total_stock
+                    + stmt.excluded.total_stock,
+                "stock_value": LocationInventorySummary.stock_value
+                    + stmt.excluded.stock_value,
+            }
+        )
+    )
+
 
 DELIVERY_SERVICE_URL = "http://orders_service:8000/orders"
+_delivery_publisher = None
+
+def set_delivery_publisher(publisher):
+    """
+    Sends delivery orders through `publisher` (a messaging.BatchingPublisher)
+    instead of the HTTP API of orders_service. Pass None to go back to HTTP.
+    """
+    global _delivery_publisher
+    _delivery_publisher = publisher
+
 async def create_delivery_order(
         location_id: int, product_id: int, product_name: str, quantity: int):
-    async with httpx.AsyncClient() as client:
+    order = {
+        "location_id": location_id,
+        "product_id": product_id,
+        "product_name": product_name,
+        "quantity": quantity
+    }
+    if _delivery_publisher is not None:
+        await _delivery_publisher.publish(order)
+        return
+    async with httpx.AsyncClient(transport=TracingTransport()) as client:
         try:
-            response = await client.post(
-                DELIVERY_SERVICE_URL,
-                json={
-                    "location_id": location_id,
-                    "product_id": product_id,
-                    "product_name": product_name,
-                    "quantity": quantity
-                }
-            )
+            response = await client.post(DELIVERY_SERVICE_URL, json=order)
             response.raise_for_status()
         except httpx.HTTPError as e:
             print(f"Failed to create delivery order: {e}")
 
+async def create_delivery_orders(orders: List[dict]):
+    """
+    Sends many delivery orders at once. Unlike create_delivery_order
+    it raises when orders_service does not accept them.
+    """
+    if _delivery_publisher is not None:
+        for order in orders:
+            await _delivery_publisher.publish(order)
+        return
+    async with httpx.AsyncClient(transport=TracingTransport()) as client:
+        response = await client.post(
+            f"{DELIVERY_SERVICE_URL}/batch", json={"orders": orders})
+        response.raise_for_status()
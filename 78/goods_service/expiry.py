@@ -0,0 +1,71 @@
+import asyncio
+import heapq
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryTimer:
+    """
+    Runs `on_expired` within `resolution` seconds after the earliest
+    scheduled deadline passes, and at least every `interval` seconds
+    to catch deadlines scheduled by other workers or before a restart.
+
+    Deadlines (Unix timestamps) are kept in a heap: scheduling costs
+    O(log n) and a tick pops only the deadlines that passed, however many
+    are pending. `on_expired` is expected to release everything expired
+    by then, so all deadlines within `resolution` of each other are
+    handled in one run.
+    """
+
+    def __init__(self, on_expired, interval: float, resolution: float = 0.1):
+        self.on_expired = on_expired
+        self.interval = interval
+        self.resolution = resolution
+        self._deadlines = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def schedule(self, deadline: float):
+        heapq.heappush(self._deadlines, deadline)
+        if self._deadlines[0] == deadline:
+            # Earlier than what the timer sleeps for
+            self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def pending(self) -> int:
+        return len(self._deadlines)
+
+    async def _run(self):
+        while True:
+            timeout = self.interval
+            if self._deadlines:
+                timeout = min(
+                    timeout,
+                    max(0.0, self._deadlines[0] + self.resolution - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.time()
+            while self._deadlines and self._deadlines[0] <= now:
+                heapq.heappop(self._deadlines)
+            try:
+                await self.on_expired()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Expiry run failed")
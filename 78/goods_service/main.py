@@ -1,48 +1,237 @@
-from fastapi import FastAPI, HTTPException, Depends
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Literal, Optional, Union
+
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db, init_db
+from common.background import start_periodic, stop_all
+from common.database import async_session, get_db, warm_up
+from common.etag import entity_etag, is_not_modified, not_modified, versions_etag
+from common.idempotency import (
+    IDEMPOTENCY_TTL, IdempotencyMiddleware, delete_expired_idempotency_keys,
+    idempotency_key_claim
+)
+from common.messaging import DELIVERY_QUEUE, BatchingPublisher, create_transport
+from common.metrics import metrics
+from common.profiler import ProfilerMiddleware, authorize, profile
+from common.startup import serve_prebuilt_openapi, timeline
+from common.tracing import TracingMiddleware
+from common.wire import DELIVERY_ORDER, encode
+
+from admission import AdmissionControlMiddleware
+from coalescing import single_flight, with_session
+from expiry import ExpiryTimer
+from migrations import init_db
 from schemas import *
 from crud import *
 
+timeline.mark("imports")
+
+
+logger = logging.getLogger(__name__)
+
+# Schema creation normally runs once per deploy with `commands.py init-db`
+INIT_DB_ON_STARTUP = os.getenv("INIT_DB_ON_STARTUP", "0") == "1"
+# "http" posts delivery orders to orders_service, "rabbitmq" publishes
+# them to DELIVERY_QUEUE in confirmed batches
+DELIVERY_TRANSPORT = os.getenv("DELIVERY_TRANSPORT", "http")
+# "json" makes queued messages readable in the broker UI
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "msgpack")
+RESTOCK_INTERVAL = float(os.getenv("RESTOCK_INTERVAL", 10))
+# orders_service accepts at most 1000 orders per batch
+RESTOCK_BATCH_SIZE = min(int(os.getenv("RESTOCK_BATCH_SIZE", 100)), 1000)
+# An open restock order older than this is assumed lost and ordered again
+RESTOCK_REORDER_AFTER = timedelta(
+    seconds=float(os.getenv("RESTOCK_REORDER_AFTER", 24 * 60 * 60)))
+# Expired reservations of other workers are released within this interval,
+# those created here right at their deadline
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", 5))
+RESERVATION_EXPIRY_BATCH_SIZE = int(os.getenv("RESERVATION_EXPIRY_BATCH_SIZE", 1000))
+IDEMPOTENCY_CLEANUP_INTERVAL = float(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL", 60 * 60))
+IDEMPOTENCY_CLEANUP_BATCH_SIZE = 1000
+delivery_publisher = None
+ready = False
+
+
+def encode_delivery_orders(orders):
+    return encode(DELIVERY_ORDER, orders, use_json=WIRE_FORMAT == "json")
+
+
+async def warm_up_job():
+    started = time.perf_counter()
+    try:
+        await warm_up(warm_up_queries)
+    except Exception:
+        # Warm-up only saves latency, serve cold rather than never
+        logger.exception("Warm-up failed")
+    metrics.set("startup_warm_up_seconds", time.perf_counter() - started)
+    timeline.mark("warm_up")
+
+async def restock_job():
+    # One transaction and one orders_service request per batch
+    async with async_session() as session:
+        metrics.inc(
+            "restock_marks_swept_total",
+            await mark_due_restocks(
+                session, RESTOCK_BATCH_SIZE, RESTOCK_REORDER_AFTER))
+        while True:
+            consumed = await schedule_restocks(
+                session, RESTOCK_BATCH_SIZE, RESTOCK_REORDER_AFTER)
+            metrics.inc("restock_marks_consumed_total", consumed)
+            if consumed < RESTOCK_BATCH_SIZE:
+                break
+
+async def release_expired_reservations_job():
+    async with async_session() as session:
+        while True:
+            released = await release_expired_reservations(
+                session, RESERVATION_EXPIRY_BATCH_SIZE)
+            metrics.inc("reservations_expired_total", released)
+            if released < RESERVATION_EXPIRY_BATCH_SIZE:
+                break
+
+async def idempotency_cleanup_job():
+    async with async_session() as session:
+        while await delete_expired_idempotency_keys(
+                session, idempotency_keys, IDEMPOTENCY_TTL,
+                IDEMPOTENCY_CLEANUP_BATCH_SIZE) == IDEMPOTENCY_CLEANUP_BATCH_SIZE:
+            pass
+
+reservation_timer = ExpiryTimer(
+    release_expired_reservations_job, RESERVATION_SWEEP_INTERVAL)
 
 async def startup_event():
-    await init_db()
+    global delivery_publisher, ready
+    if INIT_DB_ON_STARTUP:
+        await init_db()
+        timeline.mark("db_init")
+    # Awaited, uvicorn accepts no request before startup is over
+    await warm_up_job()
+    if DELIVERY_TRANSPORT != "http":
+        transport = create_transport(DELIVERY_TRANSPORT)
+        await transport.connect()
+        delivery_publisher = BatchingPublisher(
+            transport, DELIVERY_QUEUE, encode_batch=encode_delivery_orders)
+        delivery_publisher.start()
+        set_delivery_publisher(delivery_publisher)
+    start_periodic("restock", RESTOCK_INTERVAL, restock_job)
+    start_periodic(
+        "idempotency_cleanup", IDEMPOTENCY_CLEANUP_INTERVAL,
+        idempotency_cleanup_job)
+    reservation_timer.start()
+    ready = True
+    timeline.finish("startup")
+    timeline.export(metrics)
+
+async def shutdown_event():
+    await stop_all()
+    await reservation_timer.stop()
+    if delivery_publisher is not None:
+        set_delivery_publisher(None)
+        await delivery_publisher.stop()
+        await delivery_publisher.transport.close()
+
+app = FastAPI(on_startup=[startup_event], on_shutdown=[shutdown_event])
+location_reads = single_flight("location")
+product_reads = single_flight("product")
+claim_idempotency_key = idempotency_key_claim(get_db)
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(AdmissionControlMiddleware)
+# Added last, so replayed responses are served before admission control
+app.add_middleware(
+    IdempotencyMiddleware, paths={"/purchase", "/reservations"},
+    table=idempotency_keys, session_factory=async_session)
+app.add_middleware(TracingMiddleware)
+serve_prebuilt_openapi(app)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics():
+    return metrics.render()
 
-app = FastAPI(on_startup=[startup_event])
+@app.get("/health/ready", include_in_schema=False)
+async def read_readiness():
+    if not ready:
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"status": "ready"}
+
+@app.get("/admin/profile", response_class=PlainTextResponse, include_in_schema=False)
+async def read_profile(
+        seconds: float = 5, route: Optional[str] = None,
+        x_profiler_token: Optional[str] = Header(None)):
+    authorize(x_profiler_token)
+    return await profile(seconds, route)
 
 
-@app.get("/locations", response_model=list[LocationOut])
 @app.get(
     "/locations",
     summary="Retrieve a list of locations",
     description="Fetches a paginated list of all locations."
         " You can specify `skip` to offset the results"
-        " and `limit` to control the number of items returned.",
-    response_model=list[LocationOut],
+        " and `limit` to control the number of items returned."
+        " Products are returned as IDs unless `expand=products` is given.",
+    response_model=list[Union[LocationOut, LocationExpandedOut]],
     responses={
-        200: {"description": "List of locations retrieved successfully"}
+        200: {"description": "List of locations retrieved successfully"},
+        304: {"description": "Not modified since the `If-None-Match` ETag"}
     }
 )
-async def read_locations(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_db)):
-    return await get_locations(db, skip=skip, limit=limit)
+async def read_locations(request: Request, response: Response, skip: int = 0, limit: int = 10, expand: Optional[Literal["products"]] = None, db: AsyncSession = Depends(get_db)):
+    if expand == "products":
+        locations = await get_locations_expanded(db, skip=skip, limit=limit)
+        etag = versions_etag("locations-expanded", (
+            version
+            for location in locations
+            for version in _expanded_location_versions(location)
+        ))
+    else:
+        locations = await get_locations(db, skip=skip, limit=limit)
+        etag = versions_etag("locations", (
+            (location["id"], location["version"]) for location in locations
+        ))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return locations
 
 @app.get(
     "/locations/{location_id}",
     summary="Retrieve a specific location by ID",
-    description="Fetches details of a specific location using its unique ID.",
-    response_model=LocationOut,
+    description="Fetches details of a specific location using its unique ID."
+        " Products are returned as IDs unless `expand=products` is given.",
+    response_model=Union[LocationOut, LocationExpandedOut],
     responses={
         200: {"description": "Location details retrieved successfully"},
+        304: {"description": "Not modified since the `If-None-Match` ETag"},
         404: {"description": "Location not found"}
     }
 )
-async def read_location(location_id: int, db: AsyncSession = Depends(get_db)):
-    location = await get_location(db, location_id)
+async def read_location(request: Request, response: Response, location_id: int, expand: Optional[Literal["products"]] = None):
+    load = get_location_expanded if expand == "products" else get_location
+    location = await location_reads.do(
+        (location_id, expand), lambda: with_session(load, location_id))
     if not location:
         raise HTTPException(status_code=404, detail="Location not found")
+    if expand == "products":
+        etag = versions_etag(
+            "location-expanded", _expanded_location_versions(location))
+    else:
+        etag = entity_etag("location", location_id, location["version"])
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return location
 
+def _expanded_location_versions(location):
+    # Product edits change the expanded payload without a location bump
+    yield f"location{location.id}", location.version
+    for product in location.products:
+        yield f"product{product.id}", product.version
+
 @app.post(
     "/locations",
     summary="Create a new location",
@@ -73,6 +262,57 @@ async def update_existing_location(location_id: int, location: LocationUpdate, d
         raise HTTPException(status_code=404, detail="Location not found")
     return 1
 
+@app.patch(
+    "/locations/{location_id}",
+    summary="Partially update a location",
+    description="Updates the given fields of a specific location"
+        " and links or unlinks only the listed products."
+        " Returns the product IDs that were actually added or removed.",
+    response_model=LocationProductsDiff,
+    responses={
+        200: {"description": "Location updated successfully"},
+        404: {"description": "Location not found"}
+    }
+)
+async def patch_existing_location(location_id: int, patch: LocationPatch, db: AsyncSession = Depends(get_db)):
+    diff = await patch_location(db, location_id, patch)
+    if not diff:
+        raise HTTPException(status_code=404, detail="Location not found")
+    return diff
+
+@app.post(
+    "/locations/{location_id}/products",
+    summary="Link products to a location",
+    description="Links the listed products to a specific location."
+        " Products that are already linked or do not exist are skipped.",
+    response_model=LocationProductsDiff,
+    responses={
+        200: {"description": "Products linked successfully"},
+        404: {"description": "Location not found"}
+    }
+)
+async def add_products_to_location(location_id: int, change: LocationProductsChange, db: AsyncSession = Depends(get_db)):
+    diff = await add_location_products(db, location_id, change.products)
+    if not diff:
+        raise HTTPException(status_code=404, detail="Location not found")
+    return diff
+
+@app.delete(
+    "/locations/{location_id}/products/{product_id}",
+    summary="Unlink a product from a location",
+    description="Removes a single product from a specific location.",
+    response_model=LocationProductsDiff,
+    responses={
+        200: {"description": "Product unlinked successfully"},
+        404: {"description": "Location not found"}
+    }
+)
+async def remove_product_from_location(location_id: int, product_id: int, db: AsyncSession = Depends(get_db)):
+    diff = await remove_location_products(db, location_id, [product_id])
+    if not diff:
+        raise HTTPException(status_code=404, detail="Location not found")
+    return diff
+
 @app.delete(
     "/locations/{location_id}",
     summary="Delete a specific location",
@@ -100,11 +340,18 @@ async def delete_existing_location(location_id: int, db: AsyncSession = Depends(
         " and `limit` to control the number of items returned.",
     response_model=list[ProductOut],
     responses={
-        200: {"description": "List of products retrieved successfully"}
+        200: {"description": "List of products retrieved successfully"},
+        304: {"description": "Not modified since the `If-None-Match` ETag"}
     }
 )
-async def read_products(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_db)):
-    return await get_products(db, skip=skip, limit=limit)
+async def read_products(request: Request, response: Response, skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_db)):
+    products = await get_products(db, skip=skip, limit=limit)
+    etag = versions_etag(
+        "products", ((product.id, product.version) for product in products))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return products
 
 @app.get(
     "/products/{product_id}",
@@ -113,13 +360,19 @@ async def read_products(skip: int = 0, limit: int = 10, db: AsyncSession = Depen
     response_model=ProductOut,
     responses={
         200: {"description": "Product details retrieved successfully"},
+        304: {"description": "Not modified since the `If-None-Match` ETag"},
         404: {"description": "Product not found"}
     }
 )
-async def read_product(product_id: int, db: AsyncSession = Depends(get_db)):
-    product = await get_product(db, product_id)
+async def read_product(request: Request, response: Response, product_id: int):
+    product = await product_reads.do(
+        product_id, lambda: with_session(get_product, product_id))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    etag = entity_etag("product", product.id, product.version)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return product
 
 @app.post(
@@ -140,11 +393,15 @@ async def create_new_product(product: ProductCreate, db: AsyncSession = Depends(
     summary="Update an existing product",
     description="Updates the details"
         " of a specific product using its unique ID."
-        " Returns the updated product details.",
+        " Returns the updated product details."
+        " If the stock is then below the `restock_threshold`, e.g. after"
+        " raising it, a restock is scheduled for every location of the"
+        " product by the next restock run.",
     response_model=ProductOut,
     responses={
         200: {"description": "Product updated successfully"},
-        404: {"description": "Product not found"}
+        404: {"description": "Product not found"},
+        409: {"description": "Stock would be below the reserved quantity"}
     }
 )
 async def update_existing_product(product_id: int, product: ProductUpdate, db: AsyncSession = Depends(get_db)):
@@ -171,19 +428,59 @@ async def delete_existing_product(product_id: int, db: AsyncSession = Depends(ge
     return deleted_product
 
 
+@app.get(
+    "/locations/{location_id}/summary",
+    summary="Retrieve the inventory summary of a location",
+    description="Returns the number of products, total stock"
+        " and total stock value (price * stock) of a specific location."
+        " Values are read from a materialized summary table.",
+    response_model=LocationSummaryOut,
+    responses={
+        200: {"description": "Location summary retrieved successfully"},
+        404: {"description": "Location not found"}
+    }
+)
+async def read_location_summary(location_id: int, db: AsyncSession = Depends(get_db)):
+    summary = await get_location_summary(db, location_id)
+    if not summary:
+        raise HTTPException(status_code=404, detail="Location not found")
+    return summary
+
+@app.get(
+    "/inventory/summary",
+    summary="Retrieve inventory summaries of all locations",
+    description="Fetches a paginated list of location inventory summaries."
+        " You can specify `skip` to offset the results"
+        " and `limit` to control the number of items returned.",
+    response_model=list[LocationSummaryOut],
+    responses={
+        200: {"description": "List of summaries retrieved successfully"}
+    }
+)
+async def read_location_summaries(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_db)):
+    return await get_location_summaries(db, skip=skip, limit=limit)
+
+
 @app.post(
     "/purchase",
     summary="Make a product purchase",
     description=(
         "Handles the purchase of a specific product from a specific location."
         " Reduces the product stock based on the purchase quantity."
-        " If the stock falls below 100, an order is created for restocking."
+        " Stock held by reservations can not be purchased."
+        " When the stock falls below the `restock_threshold` of the product,"
+        " a restock order of `restock_quantity` is scheduled for the location;"
+        " orders are sent to orders_service in batches every few seconds."
+        " Send an `Idempotency-Key` header to make retries safe."
     ),
     responses={
         200: {"description": "Purchase processed successfully"},
         404: {"description": "Location or product not found"},
-        400: {"description": "Invalid quantity or insufficient stock"}
-    }
+        400: {"description": "Invalid quantity or insufficient stock"},
+        409: {"description": "A request with the same Idempotency-Key is in progress"},
+        422: {"description": "The Idempotency-Key was used for another request"}
+    },
+    dependencies=[Depends(claim_idempotency_key)]
 )
 async def purchase_item(purchase: PurchaseRequest, db: AsyncSession = Depends(get_db)):
     return await make_purchase(
@@ -193,3 +490,85 @@ async def purchase_item(purchase: PurchaseRequest, db: AsyncSession = Depends(ge
         quantity=purchase.quantity
     )
 
+@app.post(
+    "/reservations",
+    summary="Reserve stock for a checkout",
+    description=(
+        "Holds `quantity` of a product in a location for `ttl_seconds`"
+        " (15 minutes by default, at most 24 hours), so it can not be sold"
+        " to anyone else meanwhile. Confirm the reservation after payment"
+        " or release it; when it expires the stock is released."
+        " Send an `Idempotency-Key` header to make retries safe."
+    ),
+    response_model=ReservationOut,
+    responses={
+        200: {"description": "Stock reserved"},
+        404: {"description": "Location or product not found"},
+        400: {"description": "Invalid quantity or TTL, or insufficient stock"},
+        409: {"description": "A request with the same Idempotency-Key is in progress"},
+        422: {"description": "The Idempotency-Key was used for another request"}
+    },
+    dependencies=[Depends(claim_idempotency_key)]
+)
+async def create_reservation(
+        reservation: ReservationCreate, db: AsyncSession = Depends(get_db)):
+    db_reservation = await reserve_stock(
+        db=db,
+        location_id=reservation.location_id,
+        product_id=reservation.product_id,
+        quantity=reservation.quantity,
+        ttl_seconds=reservation.ttl_seconds
+    )
+    reservation_timer.schedule(db_reservation.expires_at.timestamp())
+    return db_reservation
+
+@app.get(
+    "/reservations/{reservation_id}",
+    summary="Retrieve an open reservation",
+    description="Fetches a reservation that is not confirmed or released yet.",
+    response_model=ReservationOut,
+    responses={
+        200: {"description": "Reservation retrieved successfully"},
+        404: {"description": "Reservation not found"}
+    }
+)
+async def read_reservation(reservation_id: int, db: AsyncSession = Depends(get_db)):
+    reservation = await get_reservation(db, reservation_id)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return reservation
+
+@app.post(
+    "/reservations/{reservation_id}/confirm",
+    summary="Confirm a reservation",
+    description=(
+        "Purchases the reserved stock, as `POST /purchase` would."
+        " Fails once the reservation has expired, or if the product"
+        " is no longer sold in the location or short of stock;"
+        " the reservation then stays open."
+    ),
+    responses={
+        200: {"description": "Purchase processed successfully"},
+        404: {"description": "Reservation, location or product not found"},
+        409: {"description": "Stock no longer covers the reservation"}
+    }
+)
+async def confirm_reservation_endpoint(
+        reservation_id: int, db: AsyncSession = Depends(get_db)):
+    return await confirm_reservation(db, reservation_id)
+
+@app.delete(
+    "/reservations/{reservation_id}",
+    summary="Release a reservation",
+    description="Returns the reserved stock for sale before the reservation expires.",
+    responses={
+        200: {"description": "Reservation released"},
+        404: {"description": "Reservation not found or expired"}
+    }
+)
+async def release_reservation_endpoint(
+        reservation_id: int, db: AsyncSession = Depends(get_db)):
+    return await release_reservation(db, reservation_id)
+
+
+timeline.mark("app")
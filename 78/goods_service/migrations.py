@@ -0,0 +1,43 @@
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+
+from common.database import engine
+
+from models import Base
+
+
+# create_all only creates missing tables, it never changes existing ones.
+# These statements bring a database created by an earlier version up to
+# date and are safe to run on every deploy: each one checks first
+# or does nothing the second time.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE locations ADD COLUMN IF NOT EXISTS"
+    " version INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS"
+    " version INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS"
+    " restock_threshold INTEGER NOT NULL DEFAULT 100",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS"
+    " restock_quantity INTEGER NOT NULL DEFAULT 100",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS"
+    " reserved INTEGER NOT NULL DEFAULT 0",
+]
+
+
+async def upgrade_schema(conn):
+    """
+    Runs SCHEMA_UPGRADES, then creates every index of the models that
+    is missing, including those of tables that existed before the index.
+    """
+    for statement in SCHEMA_UPGRADES:
+        await conn.execute(text(statement))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            await conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+async def init_db():
+    """Creates the tables that are missing, then runs upgrade_schema."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await upgrade_schema(conn)
@@ -1,9 +1,16 @@
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, String, Float, Text, Table, ForeignKey
+from sqlalchemy import (
+    Column, Integer, String, Float, Text, Table, ForeignKey, DateTime, Index,
+    func, text
+)
 from sqlalchemy.ext.declarative import declarative_base
 
+from common.idempotency import idempotency_table
+
 Base = declarative_base()
 
+BELOW_RESTOCK_THRESHOLD_PREDICATE = text("coalesce(stock, 0) < restock_threshold")
+
 location_product = Table(
     'location_product',
     Base.metadata,
@@ -17,19 +24,104 @@ class Location(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     address = Column(String)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     products = relationship('Product', secondary=location_product, back_populates='locations')
 
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # The restock job reads the products to restock without a full scan
+        Index(
+            "ix_products_below_restock_threshold", "id",
+            postgresql_where=BELOW_RESTOCK_THRESHOLD_PREDICATE),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
     price = Column(Float, nullable=False)
     stock = Column(Integer, default=0)
+    # Held by open reservations, only stock - reserved can be sold
+    reserved = Column(Integer, nullable=False, default=0, server_default="0")
+    # A purchase that takes the stock below the threshold schedules a restock
+    restock_threshold = Column(
+        Integer, nullable=False, default=100, server_default="100")
+    restock_quantity = Column(
+        Integer, nullable=False, default=100, server_default="100")
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     locations = relationship('Location', secondary=location_product, back_populates='products')
 
 
+class LocationInventorySummary(Base):
+    """
+    Materialized stock totals of one location,
+    kept current by the write paths in crud.
+    """
+    __tablename__ = "location_inventory_summary"
+
+    location_id = Column(Integer, ForeignKey('locations.id'), primary_key=True)
+    sku_count = Column(Integer, nullable=False, default=0)
+    total_stock = Column(Integer, nullable=False, default=0)
+    stock_value = Column(Float, nullable=False, default=0)
+
+
+class RestockDirty(Base):
+    """
+    Locations and products whose stock fell below the restock threshold
+    since the restock job last ran. The job consumes the rows.
+    """
+    __tablename__ = "restock_dirty"
+
+    location_id = Column(
+        Integer, ForeignKey('locations.id', ondelete="CASCADE"), primary_key=True)
+    product_id = Column(
+        Integer, ForeignKey('products.id', ondelete="CASCADE"), primary_key=True)
+    marked_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class OpenRestockOrder(Base):
+    """
+    Restock orders sent to orders_service and not yet fulfilled,
+    at most one per location and product. Closed when the stock
+    of the product is back at its threshold.
+    """
+    __tablename__ = "open_restock_orders"
+
+    location_id = Column(
+        Integer, ForeignKey('locations.id', ondelete="CASCADE"), primary_key=True)
+    product_id = Column(
+        Integer, ForeignKey('products.id', ondelete="CASCADE"), primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    ordered_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class Reservation(Base):
+    """
+    Stock held for a checkout until it is confirmed, released
+    or `expires_at` passes. Only open reservations are stored;
+    the held quantity is counted in Product.reserved.
+    """
+    __tablename__ = "reservations"
+    __table_args__ = (
+        # Expiry reads the oldest deadlines first and stops at now
+        Index("ix_reservations_expires_at", "expires_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    location_id = Column(
+        Integer, ForeignKey('locations.id', ondelete="CASCADE"), nullable=False)
+    product_id = Column(
+        Integer, ForeignKey('products.id', ondelete="CASCADE"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+# Keys of the POST /purchase and POST /reservations requests
+idempotency_keys = idempotency_table(Base.metadata)
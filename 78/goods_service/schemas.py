@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from datetime import datetime
+from pydantic import BaseModel, validator
 from typing import Optional, List
 
 
@@ -27,6 +28,49 @@ class LocationUpdate(LocationBase):
     """
     pass
 
+class LocationPatch(BaseModel):
+    """
+    Schema for a partial update of a location.
+    Only the changed product links are sent,
+    so the stored product list is never rewritten as a whole.
+    Fields:
+        - name: Optional new name of the location.
+        - address: Optional new address of the location.
+        - add_products: IDs of products to link to the location.
+        - remove_products: IDs of products to unlink from the location.
+    Name and address may be left out, but not set to null.
+    """
+    name: Optional[str] = None
+    address: Optional[str] = None
+    add_products: List[int] = []
+    remove_products: List[int] = []
+
+    @validator("name", "address", pre=True)
+    def not_null(cls, value):
+        if value is None:
+            raise ValueError("may not be null")
+        return value
+
+class LocationProductsChange(BaseModel):
+    """
+    Schema for linking products to a location.
+    Fields:
+        - products: IDs of the products to link.
+    """
+    products: List[int]
+
+class LocationProductsDiff(BaseModel):
+    """
+    Schema for outputting the result of a location membership change.
+    Fields:
+        - location_id: ID of the changed location.
+        - added: IDs of products that were linked by the request.
+        - removed: IDs of products that were unlinked by the request.
+    """
+    location_id: int
+    added: List[int] = []
+    removed: List[int] = []
+
 class LocationOut(LocationBase):
     """
     Schema for outputting location details.
@@ -48,11 +92,15 @@ class ProductBase(BaseModel):
         - description: Optional description of the product.
         - price: Price of the product.
         - stock: Quantity of the product in stock.
+        - restock_threshold: A restock is ordered when the stock falls below it.
+        - restock_quantity: Quantity ordered per restock.
     """
     name: str
     description: Optional[str] = None
     price: float
     stock: int
+    restock_threshold: int = 100
+    restock_quantity: int = 100
 
 class ProductCreate(ProductBase):
     """
@@ -73,8 +121,29 @@ class ProductOut(ProductBase):
     Schema for outputting product details.
     Fields:
         - id: Unique identifier of the product.
+        - reserved: Quantity held by open reservations.
     """
     id: int
+    reserved: int = 0
+
+    class Config:
+        orm_mode = True
+
+
+class LocationExpandedOut(BaseModel):
+    """
+    Schema for outputting location details with full product payloads.
+    Returned only when `expand=products` is requested.
+    Fields:
+        - id: Unique identifier of the location.
+        - name: Name of the location.
+        - address: Address of the location.
+        - products: Details of the associated products.
+    """
+    id: int
+    name: str
+    address: str
+    products: List[ProductOut] = []
 
     class Config:
         orm_mode = True
@@ -86,9 +155,57 @@ class PurchaseRequest(BaseModel):
     Fields:
         - location_id: ID of the location where the purchase is made.
         - product_id: ID of the product being purchased.
-        - stock: Quantity of the product being purchased.
+        - quantity: Quantity of the product being purchased.
     """
     location_id: int
     product_id: int
-    stock: int
+    quantity: int
+
+
+class ReservationCreate(PurchaseRequest):
+    """
+    Schema for reserving stock until checkout completes.
+    Fields:
+        - location_id, product_id, quantity: As for a purchase.
+        - ttl_seconds: Seconds until the reservation expires
+          and the stock is released.
+    """
+    ttl_seconds: float = 900
+
+class ReservationOut(BaseModel):
+    """
+    Schema for outputting an open reservation.
+    Fields:
+        - id: Unique identifier of the reservation.
+        - location_id: ID of the location the stock is held in.
+        - product_id: ID of the reserved product.
+        - quantity: Reserved quantity.
+        - expires_at: When the reservation is released unless confirmed.
+    """
+    id: int
+    location_id: int
+    product_id: int
+    quantity: int
+    expires_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class LocationSummaryOut(BaseModel):
+    """
+    Schema for outputting the inventory summary of a location.
+    Fields:
+        - location_id: ID of the location.
+        - sku_count: Number of products linked to the location.
+        - total_stock: Sum of the stock of those products.
+        - stock_value: Sum of price * stock of those products.
+    """
+    location_id: int
+    sku_count: int = 0
+    total_stock: int = 0
+    stock_value: float = 0
+
+    class Config:
+        orm_mode = True
 
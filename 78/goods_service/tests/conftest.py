@@ -0,0 +1,24 @@
+"""
+The service modules import each other as top-level modules, like they
+do when run from the service directory, and the shared modules from the
+`common` package at the root of the repository. Tests that need Postgres
+run against TEST_DATABASE_URL and are skipped without it; they create
+the schema and empty the tables they use.
+
+    TEST_DATABASE_URL=postgresql+asyncpg://... python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(1, os.path.dirname(os.path.dirname(SERVICE_DIR)))
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+requires_database = pytest.mark.skipif(
+    not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
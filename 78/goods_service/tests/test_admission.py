@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from admission import (
+    ADMIN, PURCHASES, READS, AdmissionControlMiddleware, ConcurrencyLimiter,
+    classify_request
+)
+from common.metrics import metrics
+
+
+def test_waiters_are_admitted_in_order_as_slots_free_up():
+    async def run():
+        limiter = ConcurrencyLimiter("test_order", limit=1, max_queue=2)
+        assert await limiter.acquire()
+        admitted = []
+
+        async def wait(name):
+            assert await limiter.acquire()
+            admitted.append(name)
+
+        waiters = [asyncio.create_task(wait(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.sleep(0)
+        in_flight_after_handover = limiter.in_flight
+        limiter.release()
+        await asyncio.gather(*waiters)
+        limiter.release()
+        return admitted, in_flight_after_handover, limiter.in_flight
+
+    admitted, in_flight_after_handover, in_flight = asyncio.run(run())
+    assert admitted == ["first", "second"]
+    # A released slot goes to the next waiter, it is never free in between
+    assert in_flight_after_handover == 1
+    assert in_flight == 0
+
+
+def test_requests_beyond_the_queue_are_shed():
+    async def run():
+        limiter = ConcurrencyLimiter("test_full", limit=1, max_queue=1)
+        assert await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        shed = await limiter.acquire()
+        limiter.release()
+        return shed, await queued
+
+    assert asyncio.run(run()) == (False, True)
+    assert metrics.get(
+        "admission_shed_total", route_class="test_full", reason="queue_full") == 1
+
+
+def test_waiters_give_up_after_the_queue_timeout():
+    async def run():
+        limiter = ConcurrencyLimiter(
+            "test_timeout", limit=1, max_queue=1, queue_timeout=0.01)
+        assert await limiter.acquire()
+        return await limiter.acquire(), limiter.in_flight
+
+    assert asyncio.run(run()) == (False, 1)
+    assert metrics.get(
+        "admission_shed_total", route_class="test_timeout", reason="timeout") == 1
+
+
+@pytest.mark.parametrize("method, path, route_class", [
+    ("GET", "/products/1", READS),
+    ("POST", "/purchase", PURCHASES),
+    ("POST", "/reservations/1/confirm", PURCHASES),
+    ("PUT", "/products/1", ADMIN),
+])
+def test_requests_are_classified_by_method_and_path(method, path, route_class):
+    assert classify_request({"method": method, "path": path}) == route_class
+
+
+def test_saturated_route_class_gets_503_with_retry_after():
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def request(middleware, path):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": path}
+        await middleware(scope, None, send)
+        return messages[0]["status"], dict(messages[0]["headers"])
+
+    async def run():
+        limiter = ConcurrencyLimiter(READS, limit=1, max_queue=0, queue_timeout=1.5)
+        middleware = AdmissionControlMiddleware(app, limiters={READS: limiter})
+        running = asyncio.create_task(request(middleware, "/products"))
+        await asyncio.sleep(0)
+        rejected = await request(middleware, "/products")
+        # Exempt paths are never limited
+        health = asyncio.create_task(request(middleware, "/health/ready"))
+        await asyncio.sleep(0)
+        release.set()
+        return rejected, await running, await health
+
+    (status, headers), running, health = asyncio.run(run())
+    assert status == 503
+    assert headers[b"retry-after"] == b"2"
+    assert running[0] == 200 and health[0] == 200
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from coalescing import SingleFlight
+
+
+def test_concurrent_calls_for_a_key_share_one_execution():
+    calls = []
+
+    async def load(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {"id": key}
+
+    async def run():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(
+            *(flight.do(1, lambda: load(1)) for _ in range(5)),
+            flight.do(2, lambda: load(2)))
+        # Finished calls are not cached
+        again = await flight.do(1, lambda: load(1))
+        return results, again
+
+    results, again = asyncio.run(run())
+    assert calls == [1, 2, 1]
+    assert results == [{"id": 1}] * 5 + [{"id": 2}]
+    assert again == {"id": 1}
+
+
+def test_the_error_of_a_shared_call_reaches_every_caller():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise LookupError("gone")
+
+    async def run():
+        flight = SingleFlight("test")
+        return await asyncio.gather(
+            flight.do(1, fail), flight.do(1, fail), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [LookupError, LookupError]
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_call():
+    async def run():
+        flight = SingleFlight("test")
+        started = asyncio.Event()
+
+        async def load():
+            started.set()
+            await asyncio.sleep(0.01)
+            return "loaded"
+
+        first = asyncio.create_task(flight.do(1, load))
+        await started.wait()
+        second = asyncio.create_task(flight.do(1, load))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "loaded"
+
+
+def test_disabled_flight_runs_every_call():
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0)
+
+    async def run():
+        flight = SingleFlight("test", enabled=False)
+        await asyncio.gather(*(flight.do(1, load) for _ in range(3)))
+
+    asyncio.run(run())
+    assert len(calls) == 3
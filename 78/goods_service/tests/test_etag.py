@@ -0,0 +1,51 @@
+from conftest import requires_database
+from test_reservations import create_product_in_location, run_with_client
+
+
+pytestmark = requires_database
+
+
+def test_conditional_get_is_304_until_the_resource_changes():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        urls = [
+            f"/products/{product_id}", "/products",
+            f"/locations/{location_id}", f"/locations/{location_id}?expand=products",
+            "/locations",
+        ]
+        etags = {url: (await client.get(url)).headers["etag"] for url in urls}
+        unchanged = {
+            url: (await client.get(url, headers={"If-None-Match": etag})).status_code
+            for url, etag in etags.items()
+        }
+        await client.put(f"/products/{product_id}", json={
+            "name": "Apple", "price": 3.0, "stock": 10, "restock_threshold": 0})
+        changed = {
+            url: (await client.get(url, headers={"If-None-Match": etag})).status_code
+            for url, etag in etags.items()
+        }
+        return unchanged, changed, location_id, product_id
+
+    unchanged, changed, location_id, product_id = run_with_client(scenario)
+    assert set(unchanged.values()) == {304}
+    # Only representations that include the product fields change
+    assert changed == {
+        f"/products/{product_id}": 200, "/products": 200,
+        f"/locations/{location_id}": 304,
+        f"/locations/{location_id}?expand=products": 200,
+        "/locations": 304,
+    }
+
+
+def test_a_membership_change_changes_the_location_etag():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        url = f"/locations/{location_id}"
+        etag = (await client.get(url)).headers["etag"]
+        await client.delete(f"/locations/{location_id}/products/{product_id}")
+        return await client.get(url, headers={"If-None-Match": etag}), etag
+
+    response, etag = run_with_client(scenario)
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["products"] == []
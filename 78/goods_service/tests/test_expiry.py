@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from expiry import ExpiryTimer
+
+
+def run_timer(scenario, interval=60.0, resolution=0.01):
+    """Runs `scenario(timer, runs)` against a started timer."""
+    async def run():
+        runs = []
+
+        async def on_expired():
+            runs.append(time.time())
+
+        timer = ExpiryTimer(on_expired, interval, resolution)
+        timer.start()
+        try:
+            return await scenario(timer, runs)
+        finally:
+            await timer.stop()
+
+    return asyncio.run(run())
+
+
+def test_runs_soon_after_the_earliest_deadline():
+    async def scenario(timer, runs):
+        deadline = time.time() + 0.05
+        timer.schedule(deadline + 10)
+        timer.schedule(deadline)
+        await asyncio.sleep(0.2)
+        return deadline, runs, timer.pending()
+
+    deadline, runs, pending = run_timer(scenario)
+    assert len(runs) == 1
+    assert deadline <= runs[0] < deadline + 0.1
+    # Only the passed deadline was popped
+    assert pending == 1
+
+
+def test_deadlines_within_the_resolution_share_a_run():
+    async def scenario(timer, runs):
+        now = time.time()
+        for offset in (0.03, 0.031, 0.032, 0.033):
+            timer.schedule(now + offset)
+        await asyncio.sleep(0.2)
+        return runs, timer.pending()
+
+    runs, pending = run_timer(scenario, resolution=0.02)
+    assert len(runs) == 1
+    assert pending == 0
+
+
+def test_an_earlier_deadline_wakes_the_timer():
+    async def scenario(timer, runs):
+        timer.schedule(time.time() + 30)
+        await asyncio.sleep(0.05)
+        timer.schedule(time.time() + 0.05)
+        await asyncio.sleep(0.2)
+        return runs, timer.pending()
+
+    runs, pending = run_timer(scenario)
+    assert len(runs) == 1
+    assert pending == 1
+
+
+def test_runs_every_interval_without_deadlines():
+    async def scenario(timer, runs):
+        await asyncio.sleep(0.25)
+        return runs
+
+    assert 3 <= len(run_timer(scenario, interval=0.05)) <= 6
+
+
+def test_a_failing_run_does_not_stop_the_timer():
+    async def run():
+        runs = []
+
+        async def on_expired():
+            runs.append(time.time())
+            raise RuntimeError("database is down")
+
+        timer = ExpiryTimer(on_expired, 0.05)
+        timer.start()
+        await asyncio.sleep(0.2)
+        await timer.stop()
+        return runs
+
+    assert len(asyncio.run(run())) >= 2
+
+
+def test_a_stopped_timer_does_not_run():
+    async def run():
+        runs = []
+
+        async def on_expired():
+            runs.append(time.time())
+
+        timer = ExpiryTimer(on_expired, 60.0, 0.01)
+        timer.start()
+        timer.schedule(time.time() + 0.05)
+        await timer.stop()
+        await asyncio.sleep(0.1)
+        return runs, timer.pending()
+
+    runs, pending = asyncio.run(run())
+    assert runs == []
+    # Deadlines stay scheduled, a restarted timer handles them
+    assert pending == 1
@@ -0,0 +1,101 @@
+import pytest
+from sqlalchemy import text
+
+from conftest import requires_database
+from test_reservations import (
+    create_product_in_location, run_with_client, stock_and_reserved)
+
+
+pytestmark = requires_database
+
+
+def purchase(client, location_id, product_id, quantity, key):
+    return client.post(
+        "/purchase",
+        json={
+            "location_id": location_id, "product_id": product_id,
+            "quantity": quantity,
+        },
+        headers={"Idempotency-Key": key})
+
+
+def test_a_retried_purchase_is_replayed():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        first = await purchase(client, location_id, product_id, 3, "a")
+        retry = await purchase(client, location_id, product_id, 3, "a")
+        other_key = await purchase(client, location_id, product_id, 3, "b")
+        return first, retry, other_key, await stock_and_reserved(client, product_id)
+
+    first, retry, other_key, (stock, _) = run_with_client(scenario)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in other_key.headers
+    assert stock == 4
+
+
+def test_a_key_reused_for_another_request_is_rejected():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        await purchase(client, location_id, product_id, 3, "a")
+        return await purchase(client, location_id, product_id, 4, "a")
+
+    assert run_with_client(scenario).status_code == 422
+
+
+def test_a_client_error_is_stored_and_replayed():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client, stock=2)
+        first = await purchase(client, location_id, product_id, 3, "a")
+        # Stock arriving later does not change the answer for the key
+        await client.put(f"/products/{product_id}", json={
+            "name": "Apple", "price": 2.0, "stock": 10, "restock_threshold": 0})
+        retry = await purchase(client, location_id, product_id, 3, "a")
+        return first, retry
+
+    first, retry = run_with_client(scenario)
+    assert first.status_code == retry.status_code == 400
+    assert retry.headers["idempotent-replayed"] == "true"
+
+
+def test_a_key_in_progress_is_a_conflict():
+    from common.database import engine
+
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        first = await purchase(client, location_id, product_id, 3, "a")
+        # As seen while another worker has committed the purchase
+        # but not stored its response yet
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "UPDATE idempotency_keys SET status_code = NULL, response = NULL"))
+        retry = await purchase(client, location_id, product_id, 3, "a")
+        return first, retry, await stock_and_reserved(client, product_id)
+
+    first, retry, (stock, _) = run_with_client(scenario)
+    assert first.status_code == 200
+    assert retry.status_code == 409
+    assert stock == 7
+
+
+def test_a_server_error_is_not_stored(monkeypatch):
+    import main
+
+    async def failing_purchase(**kwargs):
+        raise RuntimeError("database went away")
+
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        with monkeypatch.context() as patch:
+            patch.setattr(main, "make_purchase", failing_purchase)
+            # The test transport raises what would be a 500
+            with pytest.raises(RuntimeError):
+                await purchase(client, location_id, product_id, 3, "a")
+        retry = await purchase(client, location_id, product_id, 3, "a")
+        return retry, await stock_and_reserved(client, product_id)
+
+    retry, (stock, _) = run_with_client(scenario)
+    assert retry.status_code == 200
+    assert "idempotent-replayed" not in retry.headers
+    assert stock == 7
@@ -0,0 +1,125 @@
+from conftest import requires_database
+from test_reservations import run_with_client
+
+
+pytestmark = requires_database
+
+
+async def create_products(client, count):
+    return [
+        (await client.post("/products", json={
+            "name": f"Product {number}", "price": 1.0, "stock": 10,
+        })).json()["id"]
+        for number in range(count)
+    ]
+
+
+async def create_location(client, products):
+    return (await client.post("/locations", json={
+        "name": "Store", "address": "Main street", "products": products,
+    })).json()["id"]
+
+
+def test_patch_links_and_unlinks_only_the_listed_products():
+    async def scenario(client):
+        first, second, third = await create_products(client, 3)
+        location_id = await create_location(client, [first, second])
+        patched = await client.patch(f"/locations/{location_id}", json={
+            "name": "Renamed",
+            # Already linked, missing and not linked ids are skipped
+            "add_products": [second, third, 999],
+            "remove_products": [first, 998],
+        })
+        location = (await client.get(f"/locations/{location_id}")).json()
+        return patched, location, second, third, first
+
+    patched, location, second, third, first = run_with_client(scenario)
+    assert patched.status_code == 200
+    assert patched.json()["added"] == [third]
+    assert patched.json()["removed"] == [first]
+    assert location["name"] == "Renamed"
+    assert location["address"] == "Main street"
+    assert sorted(location["products"]) == [second, third]
+
+
+def test_products_are_linked_and_unlinked_one_by_one():
+    async def scenario(client):
+        first, second = await create_products(client, 2)
+        location_id = await create_location(client, [first])
+        added = await client.post(
+            f"/locations/{location_id}/products",
+            json={"products": [first, second]})
+        removed = await client.delete(f"/locations/{location_id}/products/{first}")
+        removed_again = await client.delete(
+            f"/locations/{location_id}/products/{first}")
+        location = (await client.get(f"/locations/{location_id}")).json()
+        return added.json(), removed.json(), removed_again.json(), location, first, second
+
+    added, removed, removed_again, location, first, second = run_with_client(scenario)
+    assert added["added"] == [second]
+    assert removed["removed"] == [first]
+    assert removed_again["removed"] == []
+    assert location["products"] == [second]
+
+
+def test_put_replaces_the_membership():
+    async def scenario(client):
+        first, second, third = await create_products(client, 3)
+        location_id = await create_location(client, [first, second])
+        updated = await client.put(f"/locations/{location_id}", json={
+            "name": "Store", "address": "Main street", "products": [second, third],
+        })
+        location = (await client.get(f"/locations/{location_id}")).json()
+        return updated, location, second, third
+
+    updated, location, second, third = run_with_client(scenario)
+    assert updated.status_code == 200
+    assert sorted(location["products"]) == [second, third]
+
+
+def test_edits_of_a_missing_location_are_404():
+    async def scenario(client):
+        return [
+            await client.patch("/locations/1", json={"add_products": [1]}),
+            await client.post("/locations/1/products", json={"products": [1]}),
+            await client.delete("/locations/1/products/1"),
+        ]
+
+    assert [response.status_code for response in run_with_client(scenario)] == [
+        404, 404, 404]
+
+
+def test_locations_list_product_ids_unless_expanded():
+    async def scenario(client):
+        first, second = await create_products(client, 2)
+        stocked = await create_location(client, [first, second])
+        empty = await create_location(client, [])
+        listed = (await client.get("/locations")).json()
+        one = (await client.get(f"/locations/{stocked}")).json()
+        expanded = (await client.get("/locations?expand=products")).json()
+        expanded_one = (await client.get(
+            f"/locations/{stocked}?expand=products")).json()
+        return stocked, empty, [first, second], listed, one, expanded, expanded_one
+
+    stocked, empty, products, listed, one, expanded, expanded_one = (
+        run_with_client(scenario))
+    assert [(location["id"], sorted(location["products"])) for location in listed] == [
+        (stocked, products), (empty, [])]
+    assert sorted(one["products"]) == products
+    assert [location["id"] for location in expanded] == [stocked, empty]
+    assert sorted(product["id"] for product in expanded[0]["products"]) == products
+    assert expanded[1]["products"] == []
+    assert {product["name"] for product in expanded_one["products"]} == {
+        "Product 0", "Product 1"}
+
+
+def test_locations_are_paged_by_id():
+    async def scenario(client):
+        [product] = await create_products(client, 1)
+        ids = [await create_location(client, [product]) for _ in range(5)]
+        page = (await client.get("/locations?skip=1&limit=3")).json()
+        return ids, page, product
+
+    ids, page, product = run_with_client(scenario)
+    assert [location["id"] for location in page] == ids[1:4]
+    assert all(location["products"] == [product] for location in page)
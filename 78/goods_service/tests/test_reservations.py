@@ -0,0 +1,176 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from sqlalchemy import text
+
+from conftest import requires_database
+
+
+pytestmark = requires_database
+
+
+def run_with_client(scenario):
+    """Runs `scenario(client)` against the app on an emptied database."""
+    import main
+    from common.database import engine
+    from migrations import init_db
+
+    async def run():
+        await init_db()
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "TRUNCATE locations, products, location_product, reservations,"
+                " restock_dirty, open_restock_orders, location_inventory_summary,"
+                " idempotency_keys RESTART IDENTITY CASCADE"))
+        transport = httpx.ASGITransport(app=main.app)
+        try:
+            async with httpx.AsyncClient(
+                    transport=transport, base_url="http://test") as client:
+                return await scenario(client)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+async def create_product_in_location(client, stock=10):
+    product = (await client.post("/products", json={
+        "name": "Apple", "price": 2.0, "stock": stock, "restock_threshold": 0,
+    })).json()
+    location = (await client.post("/locations", json={
+        "name": "Store", "address": "Main street", "products": [product["id"]],
+    })).json()
+    return location["id"], product["id"]
+
+
+async def reserve(client, location_id, product_id, quantity, ttl_seconds=60):
+    return await client.post("/reservations", json={
+        "location_id": location_id, "product_id": product_id,
+        "quantity": quantity, "ttl_seconds": ttl_seconds,
+    })
+
+
+async def stock_and_reserved(client, product_id):
+    product = (await client.get(f"/products/{product_id}")).json()
+    return product["stock"], product["reserved"]
+
+
+def test_reservation_holds_stock_until_confirmed():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        reservation = (await reserve(client, location_id, product_id, 8)).json()
+        purchase = await client.post("/purchase", json={
+            "location_id": location_id, "product_id": product_id, "quantity": 3})
+        assert purchase.status_code == 400
+        assert (await reserve(client, location_id, product_id, 3)).status_code == 400
+
+        confirmed = await client.post(f"/reservations/{reservation['id']}/confirm")
+        assert confirmed.status_code == 200
+        assert confirmed.json()["remaining_stock"] == 2
+        assert await stock_and_reserved(client, product_id) == (2, 0)
+        again = await client.post(f"/reservations/{reservation['id']}/confirm")
+        assert again.status_code == 404
+
+    run_with_client(scenario)
+
+
+def test_released_reservation_returns_the_stock():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        reservation = (await reserve(client, location_id, product_id, 8)).json()
+        released = await client.delete(f"/reservations/{reservation['id']}")
+        assert released.status_code == 200
+        assert await stock_and_reserved(client, product_id) == (10, 0)
+
+    run_with_client(scenario)
+
+
+def test_stock_can_not_be_updated_below_reserved():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        await reserve(client, location_id, product_id, 8)
+        response = await client.put(f"/products/{product_id}", json={
+            "name": "Apple", "price": 2.0, "stock": 5, "restock_threshold": 0,
+        })
+        assert response.status_code == 409
+        assert await stock_and_reserved(client, product_id) == (10, 8)
+
+    run_with_client(scenario)
+
+
+def test_confirm_fails_without_changes_once_not_sold_in_the_location():
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        reservation = (await reserve(client, location_id, product_id, 8)).json()
+        await client.delete(f"/locations/{location_id}/products/{product_id}")
+        confirmed = await client.post(f"/reservations/{reservation['id']}/confirm")
+        assert confirmed.status_code == 404
+        # The reservation stays open and still holds the stock
+        assert (await client.get(f"/reservations/{reservation['id']}")).status_code == 200
+        assert await stock_and_reserved(client, product_id) == (10, 8)
+
+    run_with_client(scenario)
+
+
+def test_confirm_does_not_drive_stock_negative():
+    from common.database import engine
+
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        reservation = (await reserve(client, location_id, product_id, 8)).json()
+        # Written around the API, e.g. by an earlier version
+        async with engine.begin() as conn:
+            await conn.execute(text("UPDATE products SET stock = 5"))
+        confirmed = await client.post(f"/reservations/{reservation['id']}/confirm")
+        assert confirmed.status_code == 409
+        assert await stock_and_reserved(client, product_id) == (5, 8)
+
+    run_with_client(scenario)
+
+
+def test_expired_reservations_are_released_in_batches():
+    from crud import release_expired_reservations
+    from common.database import async_session, engine
+
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        other_location_id, other_product_id = await create_product_in_location(client)
+        for quantity in (1, 2, 3):
+            await reserve(client, location_id, product_id, quantity)
+        await reserve(client, other_location_id, other_product_id, 4)
+        kept = (await reserve(client, location_id, product_id, 4)).json()
+        past = datetime.now(timezone.utc) - timedelta(seconds=1)
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("UPDATE reservations SET expires_at = :past WHERE id <> :kept"),
+                {"past": past, "kept": kept["id"]})
+
+        async with async_session() as session:
+            first = await release_expired_reservations(session, limit=3)
+            second = await release_expired_reservations(session, limit=3)
+            third = await release_expired_reservations(session, limit=3)
+        return (
+            (first, second, third),
+            await stock_and_reserved(client, product_id),
+            await stock_and_reserved(client, other_product_id),
+            (await client.get(f"/reservations/{kept['id']}")).status_code,
+        )
+
+    released, product, other_product, kept_status = run_with_client(scenario)
+    assert released == (3, 1, 0)
+    assert product == (10, 4)
+    assert other_product == (10, 0)
+    assert kept_status == 200
+
+
+@pytest.mark.parametrize("ttl_seconds", [0, 24 * 60 * 60 + 1])
+def test_invalid_ttl_is_rejected(ttl_seconds):
+    async def scenario(client):
+        location_id, product_id = await create_product_in_location(client)
+        response = await reserve(
+            client, location_id, product_id, 1, ttl_seconds=ttl_seconds)
+        assert response.status_code == 400
+
+    run_with_client(scenario)
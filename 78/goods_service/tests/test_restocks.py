@@ -0,0 +1,144 @@
+import asyncio
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from conftest import requires_database
+
+
+pytestmark = requires_database
+
+REORDER_AFTER = timedelta(hours=1)
+
+
+class RecordingPublisher:
+    """Collects the delivery orders instead of sending them."""
+
+    def __init__(self):
+        self.orders = []
+
+    async def publish(self, order):
+        self.orders.append(order)
+
+
+def run_restocks(scenario):
+    import crud
+    from common.database import async_session, engine
+    from migrations import init_db
+
+    async def run():
+        await init_db()
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "TRUNCATE locations, products, location_product, reservations,"
+                " restock_dirty, open_restock_orders, location_inventory_summary"
+                " RESTART IDENTITY CASCADE"))
+        publisher = RecordingPublisher()
+        crud.set_delivery_publisher(publisher)
+
+        async def restock_run(session):
+            await crud.mark_due_restocks(session, 100, REORDER_AFTER)
+            await crud.schedule_restocks(session, 100, REORDER_AFTER)
+            orders, publisher.orders = publisher.orders, []
+            return orders
+
+        try:
+            async with async_session() as session:
+                product = await crud.create_product(session, crud.ProductCreate(
+                    name="Apple", price=2.0, stock=10, restock_threshold=5,
+                    restock_quantity=20))
+                for name in ("North", "South"):
+                    await crud.create_location(session, crud.LocationCreate(
+                        name=name, address=name, products=[product.id]))
+                return await scenario(session, product, restock_run)
+        finally:
+            crud.set_delivery_publisher(None)
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_raising_the_threshold_schedules_a_restock():
+    import crud
+
+    async def scenario(session, product, restock_run):
+        assert await restock_run(session) == []
+        await crud.update_product(session, product.id, crud.ProductUpdate(
+            name="Apple", price=2.0, stock=10, restock_threshold=15,
+            restock_quantity=2))
+        first = await restock_run(session)
+        # The open orders are not repeated
+        second = await restock_run(session)
+        return first, second
+
+    first, second = run_restocks(scenario)
+    assert sorted((order["location_id"], order["quantity"]) for order in first) == [
+        (1, 5), (2, 5)]
+    assert second == []
+
+
+def test_an_order_open_longer_than_reorder_after_is_repeated():
+    from common.database import engine
+
+    async def scenario(session, product, restock_run):
+        await session.execute(text("UPDATE products SET stock = 1"))
+        await session.commit()
+        first = await restock_run(session)
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "UPDATE open_restock_orders SET ordered_at = now() - interval '2 hours'"
+                " WHERE location_id = 1"))
+        second = await restock_run(session)
+        return first, second
+
+    first, second = run_restocks(scenario)
+    assert len(first) == 2
+    assert [(order["location_id"], order["quantity"]) for order in second] == [(1, 20)]
+
+
+def test_stock_back_at_the_threshold_closes_the_open_orders():
+    import crud
+
+    async def scenario(session, product, restock_run):
+        await crud.make_purchase(session, 1, product.id, 6)
+        first = await restock_run(session)
+        await crud.update_product(session, product.id, crud.ProductUpdate(
+            name="Apple", price=2.0, stock=25, restock_threshold=5,
+            restock_quantity=20))
+        open_orders = await session.execute(
+            text("SELECT count(*) FROM open_restock_orders"))
+        return first, open_orders.scalar(), await restock_run(session)
+
+    first, open_orders, second = run_restocks(scenario)
+    assert len(first) == 2
+    assert open_orders == 0
+    assert second == []
+
+
+def test_a_failed_send_is_ordered_again_by_the_next_run():
+    import crud
+
+    class FailingPublisher:
+        async def publish(self, order):
+            raise ConnectionError("orders_service is down")
+
+    async def scenario(session, product, restock_run):
+        await session.execute(text("UPDATE products SET stock = 1"))
+        await session.commit()
+        recording = crud._delivery_publisher
+        crud.set_delivery_publisher(FailingPublisher())
+        try:
+            await restock_run(session)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("the send error was swallowed")
+        finally:
+            crud.set_delivery_publisher(recording)
+        open_orders = await session.execute(
+            text("SELECT count(*) FROM open_restock_orders"))
+        return open_orders.scalar(), await restock_run(session)
+
+    open_orders, orders = run_restocks(scenario)
+    assert open_orders == 0
+    assert sorted(order["location_id"] for order in orders) == [1, 2]
@@ -0,0 +1,15 @@
+import pytest
+from pydantic import ValidationError
+
+from schemas import LocationPatch
+
+
+def test_location_patch_fields_may_be_left_out():
+    patch = LocationPatch(add_products=[1])
+    assert patch.dict(exclude_unset=True) == {"add_products": [1]}
+
+
+@pytest.mark.parametrize("field", ["name", "address"])
+def test_location_patch_rejects_null(field):
+    with pytest.raises(ValidationError):
+        LocationPatch(**{field: None})
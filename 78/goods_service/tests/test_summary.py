@@ -0,0 +1,81 @@
+import pytest
+
+from conftest import requires_database
+from test_reservations import run_with_client
+
+
+pytestmark = requires_database
+
+
+async def create_product(client, price, stock):
+    return (await client.post("/products", json={
+        "name": "Product", "price": price, "stock": stock, "restock_threshold": 0,
+    })).json()["id"]
+
+
+async def summaries(client):
+    return [
+        (summary["location_id"], summary["sku_count"],
+         summary["total_stock"], pytest.approx(summary["stock_value"]))
+        for summary in (await client.get("/inventory/summary?limit=100")).json()
+    ]
+
+
+async def rebuilt_summaries(client):
+    from common.database import async_session
+    from crud import rebuild_inventory_summary
+
+    async with async_session() as session:
+        await rebuild_inventory_summary(session)
+    return await summaries(client)
+
+
+def test_write_paths_keep_the_summary_equal_to_a_rebuild():
+    async def scenario(client):
+        apple = await create_product(client, 2.0, 10)
+        pear = await create_product(client, 3.0, 5)
+        plum = await create_product(client, 1.5, 4)
+        north = (await client.post("/locations", json={
+            "name": "North", "address": "North", "products": [apple, pear],
+        })).json()["id"]
+        south = (await client.post("/locations", json={
+            "name": "South", "address": "South", "products": [apple],
+        })).json()["id"]
+
+        await client.post("/purchase", json={
+            "location_id": north, "product_id": apple, "quantity": 3})
+        await client.put(f"/products/{pear}", json={
+            "name": "Pear", "price": 4.0, "stock": 8, "restock_threshold": 0})
+        await client.patch(f"/locations/{south}", json={
+            "add_products": [plum], "remove_products": [apple]})
+        await client.post(f"/locations/{north}/products", json={"products": [plum]})
+        await client.delete(f"/products/{plum}")
+        await client.put(f"/locations/{north}", json={
+            "name": "North", "address": "North", "products": [apple]})
+
+        maintained = await summaries(client)
+        north_summary = (await client.get(f"/locations/{north}/summary")).json()
+        return north, south, maintained, north_summary, await rebuilt_summaries(client)
+
+    north, south, maintained, north_summary, rebuilt = run_with_client(scenario)
+    # Locations left without products keep a zero row until a rebuild
+    assert [row for row in maintained if row[1]] == rebuilt
+    assert rebuilt == [(north, 1, 7, pytest.approx(14.0))]
+    assert north_summary == {
+        "location_id": north, "sku_count": 1, "total_stock": 7, "stock_value": 14.0}
+
+
+def test_summary_of_a_location_without_products_is_empty():
+    async def scenario(client):
+        location_id = (await client.post("/locations", json={
+            "name": "Empty", "address": "Nowhere", "products": [],
+        })).json()["id"]
+        return (
+            await client.get(f"/locations/{location_id}/summary"),
+            await client.get(f"/locations/{location_id + 1}/summary"),
+        )
+
+    empty, missing = run_with_client(scenario)
+    assert empty.json()["sku_count"] == 0
+    assert empty.json()["stock_value"] == 0
+    assert missing.status_code == 404
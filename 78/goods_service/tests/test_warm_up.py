@@ -0,0 +1,44 @@
+import asyncio
+
+from sqlalchemy import text
+
+from conftest import requires_database
+
+
+pytestmark = requires_database
+
+
+def test_warm_up_prepares_the_purchase_on_every_connection():
+    import crud
+    from common.database import engine, warm_up
+    from migrations import init_db
+
+    async def run():
+        await init_db()
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "TRUNCATE locations, products, location_product, location_inventory_summary RESTART IDENTITY CASCADE"))
+        try:
+            await warm_up(crud.warm_up_queries, connections=2)
+            # Both warmed connections are checked out again
+            conns = [await engine.connect(), await engine.connect()]
+            try:
+                caches = []
+                for conn in conns:
+                    raw = await conn.get_raw_connection()
+                    caches.append(list(raw.dbapi_connection._prepared_statement_cache))
+            finally:
+                for conn in conns:
+                    await conn.close()
+            async with engine.connect() as conn:
+                products = await conn.scalar(text("SELECT count(*) FROM products"))
+            return caches, products
+        finally:
+            await engine.dispose()
+
+    caches, products = asyncio.run(run())
+    for statements in caches:
+        assert any(sql.startswith("UPDATE products SET stock") for sql in statements)
+        assert any(
+            sql.startswith("UPDATE location_inventory_summary") for sql in statements)
+    assert products == 0
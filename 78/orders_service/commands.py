@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+
+from migrations import init_db
+
+
+async def init_schema():
+    await init_db()
+    print("Database schema created")
+
+
+async def export_schema():
+    # Imported here, the other commands do not need the app
+    from main import app
+    from common.startup import OPENAPI_FILE, export_openapi
+
+    export_openapi(app)
+    print(f"OpenAPI schema written to {OPENAPI_FILE}")
+
+
+COMMANDS = {
+    "export-openapi": export_schema,
+    "init-db": init_schema,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Maintenance commands of the orders service.")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    asyncio.run(COMMANDS[args.command]())
+
+
+if __name__ == "__main__":
+    main()
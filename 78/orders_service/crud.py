@@ -1,38 +1,182 @@
+import itertools
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from events import broadcaster
 from models import *
 from schemas import *
 
 
+MAX_BATCH_SIZE = 1000
+
 async def create_order(db: AsyncSession, order_data: OrderCreate) -> Order:
-    order = Order(
-        location_id=order_data.location_id,
-        product_id=order_data.product_id,
-        product_name=order_data.product_name,
-        quantity=order_data.quantity,
+    orders = await _upsert_pending_orders(db, [order_data.dict()])
+    await _record_transitions(db, _created_transitions(orders))
+    await db.commit()
+    _publish_upserted(orders)
+    return orders[0]
+
+async def create_orders(db: AsyncSession, orders_data: List[OrderCreate]):
+    # One statement can not update the same row twice,
+    # so repeated (location, product) pairs are summed up front
+    merged = {}
+    for order_data in orders_data:
+        key = (order_data.location_id, order_data.product_id)
+        if key in merged:
+            merged[key]["quantity"] += order_data.quantity
+        else:
+            merged[key] = order_data.dict()
+    if not merged:
+        return []
+    orders = await _upsert_pending_orders(db, list(merged.values()))
+    await _record_transitions(db, _created_transitions(orders))
+    await db.commit()
+    _publish_upserted(orders)
+    return orders
+
+async def record_processed_messages(db: AsyncSession, message_ids: List[str]) -> set:
+    """
+    Records queue message ids as processed, without committing.
+    Returns the ids that were not recorded before; the others are
+    redeliveries of messages whose orders already exist. Committed
+    together with the orders, an id is only recorded if they were created.
+    """
+    if not message_ids:
+        return set()
+    result = await db.execute(
+        insert(ProcessedMessage)
+        .values([{"message_id": message_id} for message_id in message_ids])
+        .on_conflict_do_nothing(index_elements=[ProcessedMessage.message_id])
+        .returning(ProcessedMessage.message_id)
+    )
+    return set(result.scalars().all())
+
+async def delete_processed_messages(
+        db: AsyncSession, older_than: timedelta, limit: int) -> int:
+    """
+    Forgets up to `limit` message ids recorded more than `older_than` ago,
+    longer than any message stays queued. Returns the number deleted.
+    """
+    cutoff = datetime.now(timezone.utc) - older_than
+    batch = (
+        select(ProcessedMessage.message_id)
+        .where(ProcessedMessage.processed_at < cutoff)
+        .limit(limit)
+    )
+    result = await db.execute(
+        delete(ProcessedMessage)
+        .where(ProcessedMessage.message_id.in_(batch.scalar_subquery()))
     )
-    db.add(order)
     await db.commit()
-    await db.refresh(order)
-    return order
+    return result.rowcount
+
+async def _upsert_pending_orders(db: AsyncSession, rows: List[dict]):
+    """
+    Inserts orders with a single multi-row INSERT. A row whose location
+    and product already have a pending order is merged into it instead,
+    adding up the quantities.
+    """
+    result = await db.execute(
+        _pending_orders_upsert(rows),
+        execution_options={"populate_existing": True}
+    )
+    return result.scalars().all()
+
+def _pending_orders_upsert(rows: List[dict]):
+    stmt = insert(Order).values(
+        [dict(row, status=OrderStatus.pending) for row in rows])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Order.location_id, Order.product_id],
+        index_where=PENDING_ORDERS_PREDICATE,
+        set_={
+            "quantity": Order.quantity + stmt.excluded.quantity,
+            "version": Order.version + 1,
+            "updated_at": func.now(),
+        }
+    )
+    return stmt.returning(Order)
+
+# A merged order has had its version bumped by the upsert
+def _created_transitions(orders):
+    return [
+        (order, None, OrderStatus.pending)
+        for order in orders if order.version == 1
+    ]
+
+def _publish_upserted(orders):
+    for order in orders:
+        broadcaster.publish("created" if order.version == 1 else "updated", order)
 
 async def get_order(db: AsyncSession, order_id: int) -> Order:
     result = await db.execute(select(Order).where(Order.id == order_id))
+    order = result.scalar_one_or_none()
+    if order:
+        return order
+    # Finished orders may have been moved out of the hot table
+    result = await db.execute(
+        select(ArchivedOrder).where(ArchivedOrder.id == order_id))
     return result.scalar_one_or_none()
 
-async def get_all_orders(db: AsyncSession):
-    result = await db.execute(select(Order))
+MAX_PAGE_SIZE = 1000
+
+async def get_orders(
+        db: AsyncSession, limit: int = 100, after_id: Optional[int] = None,
+        status: Optional[OrderStatus] = None, location_id: Optional[int] = None,
+        product_id: Optional[int] = None):
+    """
+    Returns one page of orders ordered by id.
+    Pass the id of the last order of a page as `after_id`
+    to get the next one; pages never exceed MAX_PAGE_SIZE rows.
+    """
+    query = select(Order)
+    if after_id is not None:
+        query = query.where(Order.id > after_id)
+    if status is not None:
+        query = query.where(Order.status == status)
+    if location_id is not None:
+        query = query.where(Order.location_id == location_id)
+    if product_id is not None:
+        query = query.where(Order.product_id == product_id)
+    result = await db.execute(
+        query.order_by(Order.id).limit(min(limit, MAX_PAGE_SIZE)))
     return result.scalars().all()
 
-async def update_order_status(db: AsyncSession, order_id: int, status: str) -> Order:
+# Lease of orders moved to in_progress by hand instead of by a claim
+MANUAL_LEASE_SECONDS = 300
+
+async def update_order_status(db: AsyncSession, order_id: int, status: OrderStatus) -> Order:
     result = await db.execute(select(Order).where(Order.id == order_id))
     order = result.scalar_one_or_none()
     if not order:
         return None
+    from_status = order.status
     order.status = status
+    order.version = Order.version + 1
+    if status != OrderStatus.in_progress:
+        order.claimed_by = None
+        order.lease_expires_at = None
+    elif from_status != OrderStatus.in_progress:
+        # Without a lease the reaper would never return the order
+        order.lease_expires_at = func.now() + timedelta(seconds=MANUAL_LEASE_SECONDS)
+    try:
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="A pending order for this location and product exists")
+    if from_status != status:
+        await _record_transitions(db, [(order, from_status, status)])
     await db.commit()
     await db.refresh(order)
+    broadcaster.publish("updated", order)
     return order
 
 async def delete_order(db: AsyncSession, order_id: int):
@@ -42,5 +186,292 @@ async def delete_order(db: AsyncSession, order_id: int):
         return False
     await db.delete(order)
     await db.commit()
+    broadcaster.publish("deleted", order)
     return True
 
+
+MAX_CLAIM_SIZE = 100
+
+async def claim_orders(
+        db: AsyncSession, worker_id: str, limit: int, lease_seconds: int):
+    """
+    Atomically moves up to `limit` pending orders to in_progress
+    for one worker. Rows locked by concurrent claims are skipped,
+    so workers never wait for or receive the same order.
+    """
+    # The literal predicate lets the planner use the partial index
+    # even for a generic plan of the prepared statement
+    claimable = (
+        select(Order.id)
+        .where(PENDING_ORDERS_PREDICATE)
+        .order_by(Order.id)
+        .limit(min(limit, MAX_CLAIM_SIZE))
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(Order)
+        .where(Order.id.in_(claimable))
+        .values(
+            status=OrderStatus.in_progress,
+            claimed_by=worker_id,
+            lease_expires_at=func.now() + timedelta(seconds=lease_seconds),
+            version=Order.version + 1,
+        )
+        .returning(Order),
+        execution_options={"populate_existing": True}
+    )
+    orders = sorted(result.scalars().all(), key=lambda order: order.id)
+    await _record_transitions(db, [
+        (order, OrderStatus.pending, OrderStatus.in_progress)
+        for order in orders
+    ])
+    await db.commit()
+    for order in orders:
+        broadcaster.publish("updated", order)
+    return orders
+
+async def release_expired_leases(db: AsyncSession, limit: int = 100) -> int:
+    """
+    Returns in_progress orders whose lease has expired to the queue.
+    If a new pending order for the same location and product appeared
+    meanwhile, the abandoned quantity is merged into it
+    and the abandoned order is canceled.
+    """
+    result = await db.execute(
+        select(Order)
+        .where(IN_PROGRESS_ORDERS_PREDICATE)
+        .where(Order.lease_expires_at < func.now())
+        .order_by(Order.lease_expires_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    expired = result.scalars().all()
+    changed = {}
+    transitions = []
+    for order in expired:
+        result = await db.execute(
+            select(Order)
+            .where(Order.status == OrderStatus.pending)
+            .where(Order.location_id == order.location_id)
+            .where(Order.product_id == order.product_id)
+            .with_for_update()
+        )
+        pending = result.scalar_one_or_none()
+        if pending:
+            pending.quantity = Order.quantity + order.quantity
+            pending.version = Order.version + 1
+            transitions.append(
+                (order, OrderStatus.in_progress, OrderStatus.canceled))
+            order.status = OrderStatus.canceled
+            changed[pending.id] = pending
+        else:
+            transitions.append(
+                (order, OrderStatus.in_progress, OrderStatus.pending))
+            order.status = OrderStatus.pending
+        order.claimed_by = None
+        order.lease_expires_at = None
+        order.version = Order.version + 1
+        changed[order.id] = order
+    await _record_transitions(db, transitions)
+    await db.commit()
+    for order in changed.values():
+        await db.refresh(order)
+        broadcaster.publish("updated", order)
+    return len(expired)
+
+
+# Location ids of the orders created by warm-up, one per connection,
+# so the connections do not wait on each other's pending order.
+# -1 is taken by the orders goods_service places for new products.
+_warm_up_locations = itertools.count(-2, -1)
+
+async def warm_up_queries(db: AsyncSession):
+    """
+    Runs the hot lookup and creates an order (see database.warm_up)
+    for a location that does not exist, so no real row is touched.
+    """
+    await get_order(db, 0)
+    orders = await _upsert_pending_orders(db, [{
+        "location_id": next(_warm_up_locations), "product_id": 0,
+        "product_name": "warm-up", "quantity": 1,
+    }])
+    await _record_transitions(db, _created_transitions(orders))
+
+
+async def _record_transitions(db: AsyncSession, transitions):
+    """
+    Appends (order, from_status, to_status) transitions to the history
+    and adds them to the hourly rollups in the caller's transaction.
+    """
+    if not transitions:
+        return
+    now = datetime.now(timezone.utc)
+    hour = now.replace(minute=0, second=0, microsecond=0)
+
+    await db.execute(_history_insert([
+        {
+            "order_id": order.id,
+            "location_id": order.location_id,
+            "from_status": from_status,
+            "to_status": to_status,
+            "changed_at": now,
+        }
+        for order, from_status, to_status in transitions
+    ]))
+
+    stats = {}
+    histogram = {}
+    for order, from_status, to_status in transitions:
+        row = stats.setdefault(order.location_id, {
+            "hour": hour, "location_id": order.location_id,
+            "created": 0, "completed": 0, "canceled": 0,
+            "lead_time_seconds_total": 0.0,
+        })
+        if from_status is None:
+            row["created"] += 1
+        elif to_status == OrderStatus.completed:
+            lead_time = (now - order.created_at).total_seconds()
+            row["completed"] += 1
+            row["lead_time_seconds_total"] += lead_time
+            key = (order.location_id, bisect_left(LEAD_TIME_BUCKETS, lead_time))
+            histogram[key] = histogram.get(key, 0) + 1
+        elif to_status == OrderStatus.canceled:
+            row["canceled"] += 1
+
+    # Rows are upserted in key order, so concurrent writers do not deadlock
+    await db.execute(_hourly_stats_upsert(
+        [stats[location_id] for location_id in sorted(stats)]))
+    if histogram:
+        stmt = insert(OrderLeadTimeHistogram).values([
+            {"hour": hour, "location_id": location_id,
+             "bucket": bucket, "count": histogram[location_id, bucket]}
+            for location_id, bucket in sorted(histogram)
+        ])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[
+                OrderLeadTimeHistogram.hour,
+                OrderLeadTimeHistogram.location_id,
+                OrderLeadTimeHistogram.bucket,
+            ],
+            set_={"count": OrderLeadTimeHistogram.count + stmt.excluded.count}
+        ))
+
+def _history_insert(rows: List[dict]):
+    return insert(OrderStatusChange).values(rows)
+
+def _hourly_stats_upsert(rows: List[dict]):
+    stmt = insert(OrderHourlyStats).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[OrderHourlyStats.hour, OrderHourlyStats.location_id],
+        set_={
+            column: getattr(OrderHourlyStats, column)
+                + getattr(stmt.excluded, column)
+            for column in (
+                "created", "completed", "canceled", "lead_time_seconds_total")
+        }
+    )
+
+async def get_order_stats(
+        db: AsyncSession, since: datetime, until: datetime,
+        location_id: Optional[int] = None):
+    """
+    Returns the hourly rollups in [since, until) with the mean and
+    the median lead time estimated from the histogram.
+    Reads only the rollup tables, never the orders themselves.
+    """
+    stats_query = (
+        select(OrderHourlyStats)
+        .where(OrderHourlyStats.hour >= since)
+        .where(OrderHourlyStats.hour < until)
+        .order_by(OrderHourlyStats.hour, OrderHourlyStats.location_id)
+    )
+    histogram_query = (
+        select(OrderLeadTimeHistogram)
+        .where(OrderLeadTimeHistogram.hour >= since)
+        .where(OrderLeadTimeHistogram.hour < until)
+    )
+    if location_id is not None:
+        stats_query = stats_query.where(
+            OrderHourlyStats.location_id == location_id)
+        histogram_query = histogram_query.where(
+            OrderLeadTimeHistogram.location_id == location_id)
+
+    histograms = {}
+    for row in (await db.execute(histogram_query)).scalars():
+        counts = histograms.setdefault(
+            (row.hour, row.location_id), [0] * (len(LEAD_TIME_BUCKETS) + 1))
+        counts[row.bucket] = row.count
+
+    result = []
+    for row in (await db.execute(stats_query)).scalars():
+        counts = histograms.get((row.hour, row.location_id))
+        result.append(OrderStatsOut(
+            hour=row.hour,
+            location_id=row.location_id,
+            created=row.created,
+            completed=row.completed,
+            canceled=row.canceled,
+            mean_lead_time_seconds=(
+                row.lead_time_seconds_total / row.completed
+                if row.completed else None),
+            median_lead_time_seconds=(
+                _histogram_median(counts) if counts else None),
+        ))
+    return result
+
+def _histogram_median(counts) -> Optional[float]:
+    total = sum(counts)
+    if not total:
+        return None
+    seen = 0
+    for bucket, count in enumerate(counts):
+        if seen + count >= total / 2:
+            lower = LEAD_TIME_BUCKETS[bucket - 1] if bucket else 0
+            if bucket == len(LEAD_TIME_BUCKETS):
+                return float(lower)
+            upper = LEAD_TIME_BUCKETS[bucket]
+            # Linear interpolation inside the bucket holding the median
+            return lower + (upper - lower) * (total / 2 - seen) / count
+        seen += count
+
+
+async def archive_orders(
+        db: AsyncSession, older_than: timedelta, limit: int) -> int:
+    """
+    Moves up to `limit` completed or canceled orders last changed
+    more than `older_than` ago from `orders` to `orders_archive`
+    with a single DELETE ... RETURNING feeding an INSERT.
+    Returns the number of archived orders.
+    """
+    cutoff = datetime.now(timezone.utc) - older_than
+    batch = (
+        select(Order.id)
+        .where(TERMINAL_ORDERS_PREDICATE)
+        .where(Order.updated_at < cutoff)
+        .order_by(Order.updated_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    columns = [column.name for column in Order.__table__.columns]
+    moved = (
+        delete(Order)
+        .where(Order.id.in_(batch.scalar_subquery()))
+        .returning(*Order.__table__.columns)
+        .cte("moved")
+    )
+    result = await db.execute(
+        insert(ArchivedOrder).from_select(
+            columns, select(*(moved.c[name] for name in columns)))
+    )
+    await db.commit()
+    return result.rowcount
+
+async def get_hot_table_size(db: AsyncSession) -> int:
+    """
+    Returns the planner's estimate of the number of rows in `orders`.
+    Cheap to read, unlike COUNT(*), and refreshed by (auto)vacuum.
+    """
+    result = await db.execute(
+        text("SELECT reltuples::bigint FROM pg_class"
+             " WHERE oid = 'orders'::regclass"))
+    return max(result.scalar() or 0, 0)
@@ -0,0 +1,124 @@
+import asyncio
+import os
+from collections import deque
+from typing import Optional
+
+from schemas import OrderResponse
+
+
+EVENTS_REPLAY_SIZE = int(os.getenv("EVENTS_REPLAY_SIZE", 1000))
+EVENTS_SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_SUBSCRIBER_QUEUE_SIZE", 1000))
+
+
+class OrderEvent:
+    """
+    Change of one order.
+    Types: 'created', 'updated', 'deleted' and 'reset', which tells
+    a resuming subscriber that events were missed and it must refetch.
+    """
+    __slots__ = ("id", "type", "location_id", "status", "data")
+
+    def __init__(self, event_id: int, event_type: str, order=None):
+        self.id = event_id
+        self.type = event_type
+        self.location_id = order.location_id if order else None
+        self.status = order.status if order else None
+        # Serialized once and shared by all subscribers
+        self.data = _order_json(order) if order else "null"
+
+    def to_json(self) -> str:
+        return f'{{"id": {self.id}, "type": "{self.type}", "order": {self.data}}}'
+
+
+def _order_json(order) -> str:
+    return OrderResponse(**{
+        field: getattr(order, field) for field in OrderResponse.__fields__
+    }).json()
+
+
+class SubscriberLagged(Exception):
+    pass
+
+
+class Subscription:
+    """
+    Stream of the events matching the given filters.
+    A subscriber that falls more than its queue size behind
+    is dropped and should resume with its last event id.
+    """
+
+    def __init__(self, broadcaster, location_id=None, status=None):
+        self.broadcaster = broadcaster
+        self.location_id = location_id
+        self.status = status
+        self.queue = asyncio.Queue(EVENTS_SUBSCRIBER_QUEUE_SIZE)
+        self.lagged = False
+
+    def offer(self, event: OrderEvent):
+        if self.lagged:
+            return
+        if event.type != "reset" and (
+                self.location_id is not None
+                and event.location_id != self.location_id
+                or self.status is not None and event.status != self.status):
+            return
+        if self.queue.full():
+            self.lagged = True
+            return
+        self.queue.put_nowait(event)
+
+    async def next(self, timeout: float) -> Optional[OrderEvent]:
+        """
+        Returns the next event, or None if nothing came within `timeout`.
+        Raises SubscriberLagged once the queued events are drained
+        after the subscriber fell behind.
+        """
+        if self.lagged and self.queue.empty():
+            raise SubscriberLagged
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broadcaster._subscribers.discard(self)
+
+
+class Broadcaster:
+    """
+    In-process fan-out of order change events.
+    The last `replay_size` events are kept, so a subscriber
+    can resume from its last event id after a reconnect.
+    Each worker process has its own broadcaster and event ids.
+    """
+
+    def __init__(self, replay_size: int = EVENTS_REPLAY_SIZE):
+        self._last_id = 0
+        self._buffer = deque(maxlen=replay_size)
+        self._subscribers = set()
+
+    def publish(self, event_type: str, order):
+        self._last_id += 1
+        event = OrderEvent(self._last_id, event_type, order)
+        self._buffer.append(event)
+        for subscription in self._subscribers:
+            subscription.offer(event)
+
+    def subscribe(
+            self, last_event_id: Optional[int] = None,
+            location_id: Optional[int] = None,
+            status: Optional[str] = None) -> Subscription:
+        subscription = Subscription(self, location_id, status)
+        if last_event_id is not None:
+            oldest_id = self._buffer[0].id if self._buffer else self._last_id + 1
+            if last_event_id + 1 < oldest_id or last_event_id > self._last_id:
+                subscription.offer(OrderEvent(self._last_id, "reset"))
+            else:
+                for event in self._buffer:
+                    if event.id > last_event_id:
+                        subscription.offer(event)
+        self._subscribers.add(subscription)
+        return subscription
+
+
+broadcaster = Broadcaster()
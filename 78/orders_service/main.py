@@ -1,65 +1,446 @@
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import (
+    FastAPI, HTTPException, Depends, Header, Query, Request, Response,
+    WebSocket
+)
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db, init_db
+from common.background import start_periodic, stop_all
+from common.database import async_session, get_db, warm_up
+from common.etag import entity_etag, is_not_modified, not_modified, versions_etag
+from common.idempotency import (
+    IDEMPOTENCY_TTL, IdempotencyMiddleware, delete_expired_idempotency_keys,
+    idempotency_key_claim
+)
+from common.messaging import DELIVERY_QUEUE, PUBLISH_BATCH_SIZE, create_transport
+from common.metrics import metrics
+from common.profiler import ProfilerMiddleware, authorize, profile
+from common.startup import serve_prebuilt_openapi, timeline
+from common.tracing import TRACEPARENT_HEADER, TracingMiddleware, start_consumer_span
+from common.wire import DELIVERY_ORDER, WireError, decode
+
+from events import SubscriberLagged, broadcaster
+from migrations import init_db
 from schemas import *
 from crud import *
 
+timeline.mark("imports")
+
+
+logger = logging.getLogger(__name__)
+
+# "rabbitmq" consumes delivery orders from DELIVERY_QUEUE
+# in addition to the HTTP API
+DELIVERY_TRANSPORT = os.getenv("DELIVERY_TRANSPORT", "http")
+# Schema creation normally runs once per deploy with `commands.py init-db`
+INIT_DB_ON_STARTUP = os.getenv("INIT_DB_ON_STARTUP", "0") == "1"
+LEASE_REAPER_INTERVAL = float(os.getenv("LEASE_REAPER_INTERVAL", 5))
+EVENTS_KEEPALIVE_INTERVAL = 15
+STATS_DEFAULT_WINDOW = timedelta(hours=24)
+STATS_MAX_WINDOW = timedelta(days=31)
+ARCHIVE_AFTER = timedelta(
+    seconds=float(os.getenv("ORDER_ARCHIVE_AFTER", 7 * 24 * 60 * 60)))
+ARCHIVE_INTERVAL = float(os.getenv("ORDER_ARCHIVE_INTERVAL", 60))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", 1000))
+# Ids of consumed delivery messages are kept this long to skip redeliveries
+PROCESSED_MESSAGES_RETENTION = timedelta(
+    seconds=float(os.getenv("PROCESSED_MESSAGES_RETENTION", 7 * 24 * 60 * 60)))
+
+
+async def release_expired_leases_job():
+    async with async_session() as session:
+        while await release_expired_leases(session) > 0:
+            pass
+
+async def archive_orders_job():
+    # One transaction per batch keeps locks and WAL bursts bounded
+    async with async_session() as session:
+        while True:
+            archived = await archive_orders(
+                session, ARCHIVE_AFTER, ARCHIVE_BATCH_SIZE)
+            metrics.inc("orders_archived_total", archived)
+            if archived < ARCHIVE_BATCH_SIZE:
+                break
+        while await delete_processed_messages(
+                session, PROCESSED_MESSAGES_RETENTION,
+                ARCHIVE_BATCH_SIZE) == ARCHIVE_BATCH_SIZE:
+            pass
+        while await delete_expired_idempotency_keys(
+                session, idempotency_keys, IDEMPOTENCY_TTL,
+                ARCHIVE_BATCH_SIZE) == ARCHIVE_BATCH_SIZE:
+            pass
+        metrics.set("orders_hot_table_rows", await get_hot_table_size(session))
+
+async def consume_delivery_orders(messages):
+    # The batch is handled in one transaction under one consumer span,
+    # continuing the trace of its first traced message
+    traceparents = [
+        message.headers[TRACEPARENT_HEADER] for message in messages
+        if TRACEPARENT_HEADER in message.headers
+    ]
+    span = start_consumer_span(
+        f"consume {DELIVERY_QUEUE}",
+        {TRACEPARENT_HEADER: traceparents[0]} if traceparents else {},
+        **{
+            "messaging.destination": DELIVERY_QUEUE,
+            "messaging.batch_size": len(messages),
+            "messaging.linked_traceparents": traceparents[1:],
+        })
+    if span is None:
+        await _create_delivery_orders(messages)
+        return
+    with span:
+        await _create_delivery_orders(messages)
+
+async def _create_delivery_orders(messages):
+    # One transaction records the message ids and creates the orders,
+    # so a redelivered message is either skipped or never half applied
+    async with async_session() as session:
+        new_ids = await record_processed_messages(session, [
+            message.message_id for message in messages
+            if message.message_id is not None
+        ])
+        orders = []
+        for message in messages:
+            if message.message_id is not None:
+                if message.message_id not in new_ids:
+                    metrics.inc("delivery_messages_redelivered_total")
+                    continue
+                # A copy later in the same batch is skipped too
+                new_ids.remove(message.message_id)
+            try:
+                message_type, records = decode(message.body)
+                if message_type is not DELIVERY_ORDER:
+                    raise WireError(f"Unexpected {message_type.name} message")
+                orders.extend(OrderCreate(**record) for record in records)
+            except (TypeError, ValueError):
+                # Redelivering a malformed message would never succeed
+                logger.exception(
+                    "Dropping malformed delivery message %r", message.body)
+        if orders:
+            await create_orders(session, orders)
+        else:
+            await session.commit()
+
+delivery_transport = None
+ready = False
+
+async def warm_up_job():
+    started = time.perf_counter()
+    try:
+        await warm_up(warm_up_queries)
+    except Exception:
+        # Warm-up only saves latency, serve cold rather than never
+        logger.exception("Warm-up failed")
+    metrics.set("startup_warm_up_seconds", time.perf_counter() - started)
+    timeline.mark("warm_up")
 
 async def startup_event():
-    await init_db()
+    global delivery_transport, ready
+    if INIT_DB_ON_STARTUP:
+        await init_db()
+        timeline.mark("db_init")
+    # Awaited before requests are accepted and the queue is consumed
+    await warm_up_job()
+    if DELIVERY_TRANSPORT != "http":
+        delivery_transport = create_transport(DELIVERY_TRANSPORT)
+        await delivery_transport.connect()
+        # Each message carries up to PUBLISH_BATCH_SIZE orders
+        await delivery_transport.consume(
+            DELIVERY_QUEUE, consume_delivery_orders,
+            batch_size=max(1, MAX_BATCH_SIZE // PUBLISH_BATCH_SIZE))
+    start_periodic(
+        "release_expired_leases", LEASE_REAPER_INTERVAL,
+        release_expired_leases_job)
+    start_periodic("archive_orders", ARCHIVE_INTERVAL, archive_orders_job)
+    ready = True
+    timeline.finish("startup")
+    timeline.export(metrics)
+
+async def shutdown_event():
+    await stop_all()
+    if delivery_transport is not None:
+        await delivery_transport.close()
+
+app = FastAPI(on_startup=[startup_event], on_shutdown=[shutdown_event])
+app.add_middleware(ProfilerMiddleware)
+claim_idempotency_key = idempotency_key_claim(get_db)
+app.add_middleware(
+    IdempotencyMiddleware, paths={"/orders", "/orders/batch"},
+    table=idempotency_keys, session_factory=async_session)
+app.add_middleware(TracingMiddleware)
+serve_prebuilt_openapi(app)
+
 
-app = FastAPI(on_startup=[startup_event])
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics():
+    return metrics.render()
+
+@app.get("/health/ready", include_in_schema=False)
+async def read_readiness():
+    if not ready:
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"status": "ready"}
+
+@app.get("/admin/profile", response_class=PlainTextResponse, include_in_schema=False)
+async def read_profile(
+        seconds: float = 5, route: Optional[str] = None,
+        x_profiler_token: Optional[str] = Header(None)):
+    authorize(x_profiler_token)
+    return await profile(seconds, route)
 
 
 @app.post(
     "/orders",
     summary="Create a new order",
     description="Creates a new order with the provided details,"
-        " such as location, product, quantity, and total price.",
+        " such as location, product, quantity, and total price."
+        " If a pending order for the same location and product exists,"
+        " the quantity is added to it instead."
+        " Send an `Idempotency-Key` header to make retries safe.",
     response_model=OrderResponse,
-    responses={201: {"description": "Order successfully created"}}
+    responses={
+        201: {"description": "Order successfully created"},
+        409: {"description": "A request with the same Idempotency-Key is in progress"},
+        422: {"description": "The Idempotency-Key was used for another request"}
+    },
+    dependencies=[Depends(claim_idempotency_key)]
 )
 async def create_order_endpoint(
         order: OrderCreate, db: AsyncSession = Depends(get_db)):
     return await create_order(db, order)
 
+@app.post(
+    "/orders/batch",
+    summary="Create many orders",
+    description="Creates all given orders with a single multi-row insert."
+        " Orders for a location and product that already has"
+        " a pending order are merged into it, as in `POST /orders`.",
+    response_model=list[OrderResponse],
+    responses={
+        201: {"description": "Orders successfully created"},
+        400: {"description": "Too many orders in one batch"},
+        409: {"description": "A request with the same Idempotency-Key is in progress"},
+        422: {"description": "The Idempotency-Key was used for another request"}
+    },
+    dependencies=[Depends(claim_idempotency_key)]
+)
+async def create_orders_endpoint(
+        batch: OrderBatchCreate, db: AsyncSession = Depends(get_db)):
+    if len(batch.orders) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_SIZE} orders per batch")
+    return await create_orders(db, batch.orders)
+
+@app.post(
+    "/orders/claim",
+    summary="Claim pending orders",
+    description="Atomically moves up to `limit` pending orders"
+        " to 'in_progress' for the given worker and returns them."
+        " Orders that are not completed or canceled before"
+        " `lease_seconds` pass are returned to the queue.",
+    response_model=list[OrderResponse],
+    responses={
+        200: {"description": "Orders claimed successfully"},
+        400: {"description": "Invalid limit or lease"}
+    }
+)
+async def claim_orders_endpoint(
+        claim: OrderClaim, db: AsyncSession = Depends(get_db)):
+    if not 0 < claim.limit <= MAX_CLAIM_SIZE or claim.lease_seconds <= 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be in 1..{MAX_CLAIM_SIZE}"
+                " and lease_seconds must be positive")
+    return await claim_orders(
+        db, claim.worker_id, claim.limit, claim.lease_seconds)
+
+@app.get(
+    "/orders/events",
+    summary="Stream order changes",
+    description="Streams order change events as Server-Sent Events,"
+        " optionally filtered by `location_id` and `status`."
+        " Send the `Last-Event-ID` header to resume after a reconnect;"
+        " a 'reset' event means events were missed and orders"
+        " must be fetched again.",
+    responses={200: {"description": "Event stream opened"}}
+)
+async def stream_order_events(
+        request: Request,
+        location_id: Optional[int] = None,
+        status: Optional[OrderStatus] = None,
+        last_event_id: Optional[int] = Header(None)):
+    subscription = broadcaster.subscribe(last_event_id, location_id, status)
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                event = await subscription.next(EVENTS_KEEPALIVE_INTERVAL)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield (
+                    f"id: {event.id}\nevent: {event.type}\n"
+                    f"data: {event.data}\n\n"
+                )
+        except SubscriberLagged:
+            pass
+        finally:
+            subscription.close()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.websocket("/orders/ws")
+async def order_events_websocket(
+        websocket: WebSocket,
+        location_id: Optional[int] = None,
+        status: Optional[OrderStatus] = None,
+        last_event_id: Optional[int] = None):
+    """
+    Streams order change events over a WebSocket as JSON messages
+    with the same filters and resume semantics as `/orders/events`.
+    """
+    await websocket.accept()
+    subscription = broadcaster.subscribe(last_event_id, location_id, status)
+
+    async def send_events():
+        while True:
+            event = await subscription.next(EVENTS_KEEPALIVE_INTERVAL)
+            if event is not None:
+                await websocket.send_text(event.to_json())
+
+    async def receive_until_disconnect():
+        # Client messages are ignored; receiving is how a disconnect
+        # is noticed while no matching events come in
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    sender = asyncio.create_task(send_events())
+    receiver = asyncio.create_task(receive_until_disconnect())
+    try:
+        done, _ = await asyncio.wait(
+            {sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        if sender in done and isinstance(sender.exception(), SubscriberLagged):
+            await websocket.close(code=1013)
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        subscription.close()
+
+@app.get(
+    "/orders/stats",
+    summary="Get hourly order statistics",
+    description="Returns per-hour and per-location counts of created,"
+        " completed and canceled orders with the mean and median lead time"
+        " from creation to completion. Covers the last 24 hours"
+        " unless `since` and `until` are given; at most 31 days at once."
+        " Served from rollup tables, so it does not scan the orders.",
+    response_model=list[OrderStatsOut],
+    responses={
+        200: {"description": "Order statistics retrieved successfully"},
+        400: {"description": "Invalid time range"}
+    }
+)
+async def get_order_stats_endpoint(
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        location_id: Optional[int] = None,
+        db: AsyncSession = Depends(get_db)):
+    until = _as_utc(until) if until else datetime.now(timezone.utc)
+    since = _as_utc(since) if since else until - STATS_DEFAULT_WINDOW
+    if since >= until:
+        raise HTTPException(
+            status_code=400, detail="`since` must be before `until`")
+    if until - since > STATS_MAX_WINDOW:
+        raise HTTPException(
+            status_code=400, detail="Time range must not exceed 31 days")
+    return await get_order_stats(db, since, until, location_id)
+
+def _as_utc(moment: datetime) -> datetime:
+    # Naive timestamps in the query string are taken as UTC
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
 @app.get(
     "/orders/{order_id}",
     summary="Get an order by ID",
-    description="Fetches the details of a specific order using its unique ID.",
+    description="Fetches the details of a specific order using its unique ID."
+        " Archived orders are returned as well.",
     response_model=OrderResponse,
     responses={
         200: {"description": "Order details retrieved successfully"},
+        304: {"description": "Not modified since the `If-None-Match` ETag"},
         404: {"description": "Order not found"}
     }
 )
 async def get_order_endpoint(
+        request: Request, response: Response,
         order_id: int, db: AsyncSession = Depends(get_db)):
     order = await get_order(db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    etag = entity_etag("order", order.id, order.version)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return order
 
 @app.get(
     "/orders",
-    summary="Get all orders",
-    description="Retrieves a list of all orders currently stored in the database.",
+    summary="Get a page of orders",
+    description="Retrieves orders ordered by ID, optionally filtered"
+        " by `status`, `location_id` and `product_id`."
+        " At most `limit` orders are returned; to get the next page"
+        " pass the `X-Next-After-Id` response header as `after_id`.",
     response_model=list[OrderResponse],
-    responses={200: {"description": "List of all orders retrieved successfully"}}
+    responses={
+        200: {"description": "List of all orders retrieved successfully"},
+        304: {"description": "Not modified since the `If-None-Match` ETag"}
+    }
 )
-async def get_all_orders_endpoint(db: AsyncSession = Depends(get_db)):
-    return await get_all_orders(db)
+async def get_all_orders_endpoint(
+        request: Request, response: Response,
+        limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+        after_id: Optional[int] = None,
+        status: Optional[OrderStatus] = None,
+        location_id: Optional[int] = None,
+        product_id: Optional[int] = None,
+        db: AsyncSession = Depends(get_db)):
+    orders = await get_orders(
+        db, limit=limit, after_id=after_id, status=status,
+        location_id=location_id, product_id=product_id)
+    etag = versions_etag(
+        "orders", ((order.id, order.version) for order in orders))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    if len(orders) == limit:
+        response.headers["X-Next-After-Id"] = str(orders[-1].id)
+    return orders
 
 @app.put(
     "/orders/{order_id}",
     summary="Update an order's status",
     description="Updates the status of a specific order using its ID."
-        " Status can be 'pending', 'completed', or 'canceled'.",
+        " Status can be 'pending', 'in_progress', 'completed', or 'canceled'."
+        " An order set to 'in_progress' here gets a 300 second lease,"
+        " as if it had been claimed.",
     response_model=OrderResponse,
     responses={
         200: {"description": "Order status updated successfully"},
-        404: {"description": "Order not found"}
+        404: {"description": "Order not found"},
+        409: {"description": "Another pending order exists"
+            " for the same location and product"}
     }
 )
 async def update_order_status_endpoint(
@@ -87,3 +468,5 @@ async def delete_order_endpoint(
         raise HTTPException(status_code=404, detail="Order not found")
     return {"message": "Order deleted successfully"}
 
+
+timeline.mark("app")
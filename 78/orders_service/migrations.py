@@ -0,0 +1,86 @@
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+
+from common.database import engine
+
+from models import Base
+
+
+# create_all only creates missing tables, it never changes existing ones.
+# These statements bring a database created by an earlier version up to
+# date and are safe to run on every deploy: each one checks first
+# or does nothing the second time.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS"
+    " version INTEGER NOT NULL DEFAULT 1",
+    # Earlier versions allowed several pending orders per location and
+    # product. They are merged into the oldest one, as new orders are,
+    # so the unique index below can be built; the others are canceled.
+    """
+    UPDATE orders SET quantity = merged.quantity, version = orders.version + 1
+    FROM (
+        SELECT min(id) AS id, sum(quantity) AS quantity FROM orders
+        WHERE status = 'pending'
+          AND location_id IS NOT NULL AND product_id IS NOT NULL
+        GROUP BY location_id, product_id HAVING count(*) > 1
+    ) AS merged
+    WHERE orders.id = merged.id
+    """,
+    """
+    UPDATE orders SET status = 'canceled', version = version + 1
+    WHERE status = 'pending'
+      AND location_id IS NOT NULL AND product_id IS NOT NULL
+      AND id NOT IN (
+        SELECT min(id) FROM orders WHERE status = 'pending'
+        GROUP BY location_id, product_id)
+    """,
+    """
+    DO $$ BEGIN
+        CREATE TYPE order_status AS ENUM (
+            'pending', 'in_progress', 'completed', 'canceled');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    # status used to be a nullable VARCHAR
+    """
+    DO $$ BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND table_name = 'orders' AND column_name = 'status'
+           ) <> 'USER-DEFINED' THEN
+            UPDATE orders SET status = 'pending' WHERE status IS NULL;
+            ALTER TABLE orders ALTER COLUMN status DROP DEFAULT;
+            ALTER TABLE orders
+                ALTER COLUMN status TYPE order_status
+                USING status::order_status;
+            ALTER TABLE orders ALTER COLUMN status SET NOT NULL;
+        END IF;
+    END $$
+    """,
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS claimed_by VARCHAR",
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS"
+    " lease_expires_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS"
+    " created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()",
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS"
+    " updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()",
+]
+
+
+async def upgrade_schema(conn):
+    """
+    Runs SCHEMA_UPGRADES, then creates every index of the models that
+    is missing, including those of tables that existed before the index.
+    """
+    for statement in SCHEMA_UPGRADES:
+        await conn.execute(text(statement))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            await conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+async def init_db():
+    """Creates the tables that are missing, then runs upgrade_schema."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await upgrade_schema(conn)
@@ -1,18 +1,173 @@
+import enum
+
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, Float, ForeignKey, Index, DateTime,
+    Enum, func, text
+)
+
+from common.idempotency import idempotency_table
 
 
 Base = declarative_base()
 
+PENDING_ORDERS_PREDICATE = text("status = 'pending'")
+IN_PROGRESS_ORDERS_PREDICATE = text("status = 'in_progress'")
+TERMINAL_ORDERS_PREDICATE = text("status IN ('completed', 'canceled')")
+
+
+class OrderStatus(str, enum.Enum):
+    """
+    Statuses an order goes through.
+    - pending: The order waits for a fulfillment worker.
+    - in_progress: The order is claimed by a worker until its lease expires.
+    - completed: The order has been fulfilled.
+    - canceled: The order will not be fulfilled.
+    """
+    pending = "pending"
+    in_progress = "in_progress"
+    completed = "completed"
+    canceled = "canceled"
+
+
+order_status_type = Enum(OrderStatus, name="order_status")
+
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Keyset pagination: filters first, then id for ordering
+        Index("ix_orders_status_id", "status", "id"),
+        Index("ix_orders_status_location_id_id", "status", "location_id", "id"),
+        Index("ix_orders_status_product_id_id", "status", "product_id", "id"),
+        Index(
+            "ix_orders_location_id_product_id_id",
+            "location_id", "product_id", "id"),
+        # At most one pending order per location and product,
+        # new restock requests are merged into it
+        Index(
+            "uq_orders_pending_location_id_product_id",
+            "location_id", "product_id",
+            unique=True,
+            postgresql_where=PENDING_ORDERS_PREDICATE),
+        # Claims scan only the pending rows, expiry only the leased ones
+        Index(
+            "ix_orders_pending_id", "id",
+            postgresql_where=PENDING_ORDERS_PREDICATE),
+        Index(
+            "ix_orders_in_progress_lease_expires_at", "lease_expires_at",
+            postgresql_where=IN_PROGRESS_ORDERS_PREDICATE),
+        # The archiver picks the oldest finished orders
+        Index(
+            "ix_orders_terminal_updated_at", "updated_at",
+            postgresql_where=TERMINAL_ORDERS_PREDICATE),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     location_id = Column(Integer, index=True)
     product_id = Column(Integer, index=True)
     product_name = Column(String, nullable=False)
     quantity = Column(Integer, nullable=False)
-    status = Column(String, default="pending") # pending, completed, canceled
+    status = Column(
+        order_status_type, nullable=False, default=OrderStatus.pending)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    claimed_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False,
+        server_default=func.now(), onupdate=func.now())
+
+
+class ArchivedOrder(Base):
+    """
+    Completed and canceled orders moved out of `orders`
+    by the archiver. Same columns as Order, plus the archival time.
+    """
+    __tablename__ = "orders_archive"
+
+    id = Column(Integer, primary_key=True)
+    location_id = Column(Integer, index=True)
+    product_id = Column(Integer)
+    product_name = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    status = Column(order_status_type, nullable=False)
+    version = Column(Integer, nullable=False)
+    claimed_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    archived_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class OrderStatusChange(Base):
+    """
+    Append-only log of order status transitions,
+    written in the same transaction as the change itself.
+    """
+    __tablename__ = "order_status_history"
+
+    id = Column(BigInteger, primary_key=True)
+    order_id = Column(Integer, nullable=False, index=True)
+    location_id = Column(Integer, nullable=False)
+    from_status = Column(order_status_type, nullable=True)
+    to_status = Column(order_status_type, nullable=False)
+    changed_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class OrderHourlyStats(Base):
+    """
+    Per-hour and per-location counters of status transitions,
+    incremented together with the history log.
+    """
+    __tablename__ = "order_hourly_stats"
+
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    location_id = Column(Integer, primary_key=True)
+    created = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    canceled = Column(Integer, nullable=False, default=0)
+    lead_time_seconds_total = Column(Float, nullable=False, default=0)
+
+
+class OrderLeadTimeHistogram(Base):
+    """
+    Per-hour and per-location histogram of the time from creation
+    to completion of the orders completed in that hour.
+    `bucket` indexes LEAD_TIME_BUCKETS; the last bucket is unbounded.
+    """
+    __tablename__ = "order_lead_time_histogram"
+
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    location_id = Column(Integer, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class ProcessedMessage(Base):
+    """
+    Ids of the queue messages whose orders have been created, recorded
+    in the same transaction, so a redelivered message is skipped.
+    """
+    __tablename__ = "processed_messages"
+
+    message_id = Column(String, primary_key=True)
+    processed_at = Column(
+        DateTime(timezone=True), nullable=False,
+        server_default=func.now(), index=True)
+
+
+# Keys of the POST /orders and POST /orders/batch requests
+idempotency_keys = idempotency_table(Base.metadata)
+
+
+# Upper bounds of the lead time histogram buckets, in seconds
+LEAD_TIME_BUCKETS = (
+    60, 5 * 60, 15 * 60, 30 * 60,
+    60 * 60, 2 * 60 * 60, 4 * 60 * 60, 8 * 60 * 60, 16 * 60 * 60,
+    24 * 60 * 60, 2 * 24 * 60 * 60, 7 * 24 * 60 * 60,
+)
 
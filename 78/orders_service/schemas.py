@@ -1,5 +1,8 @@
+from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
+
+from models import OrderStatus
 
 class OrderCreate(BaseModel):
     """
@@ -15,14 +18,35 @@ class OrderCreate(BaseModel):
     product_name: str
     quantity: int
 
+class OrderBatchCreate(BaseModel):
+    """
+    Schema for creating many orders in one request.
+    Fields:
+        - orders: Orders to be created.
+    """
+    orders: List[OrderCreate]
+
 class OrderUpdate(BaseModel):
     """
     Schema for updating the status of an existing order.
     Fields:
         - status: New status for the order
-            (e.g., 'pending', 'completed', 'canceled').
+            ('pending', 'in_progress', 'completed', 'canceled').
     """
-    status: str
+    status: OrderStatus
+
+class OrderClaim(BaseModel):
+    """
+    Schema for claiming pending orders by a fulfillment worker.
+    Fields:
+        - worker_id: Identifier of the claiming worker.
+        - limit: Maximum number of orders to claim.
+        - lease_seconds: Time after which unfinished orders
+            are returned to the queue.
+    """
+    worker_id: str
+    limit: int = 10
+    lease_seconds: int = 300
 
 class OrderResponse(BaseModel):
     """
@@ -34,14 +58,39 @@ class OrderResponse(BaseModel):
         - product_name: Name of the product being ordered.
         - quantity: Quantity of the product ordered.
         - status: Current status of the order.
+        - claimed_by: Worker holding the order while it is in progress.
+        - lease_expires_at: Time the worker's claim expires.
     """
     id: int
     location_id: int
     product_id: int
     product_name: str
     quantity: int
-    status: str
+    status: OrderStatus
+    claimed_by: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
 
+class OrderStatsOut(BaseModel):
+    """
+    Schema for returning order throughput of one location in one hour.
+    Fields:
+        - hour: Start of the hour.
+        - location_id: ID of the location.
+        - created: Number of orders created.
+        - completed: Number of orders completed.
+        - canceled: Number of orders canceled.
+        - mean_lead_time_seconds: Mean time from creation
+            to completion of the orders completed in the hour.
+        - median_lead_time_seconds: Median of the same time,
+            estimated from a histogram.
+    """
+    hour: datetime
+    location_id: int
+    created: int
+    completed: int
+    canceled: int
+    mean_lead_time_seconds: Optional[float] = None
+    median_lead_time_seconds: Optional[float] = None
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from conftest import requires_database
+from test_orders import create_orders, run_with_client
+
+
+pytestmark = requires_database
+
+ARCHIVE_AFTER = timedelta(days=7)
+
+
+async def age_orders(order_ids, days):
+    from common.database import engine
+
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "UPDATE orders SET updated_at = now() - make_interval(days => :days)"
+            " WHERE id = ANY(:ids)"), {"days": days, "ids": order_ids})
+
+
+async def archive(limit=100):
+    from common.database import async_session
+    from crud import archive_orders
+
+    async with async_session() as session:
+        return await archive_orders(session, ARCHIVE_AFTER, limit)
+
+
+async def table_ids(table):
+    from common.database import engine
+
+    async with engine.connect() as conn:
+        result = await conn.execute(text(f"SELECT id FROM {table} ORDER BY id"))
+        return list(result.scalars())
+
+
+def test_only_old_finished_orders_are_archived():
+    async def scenario(client):
+        completed, canceled, pending, in_progress, recent = await create_orders(
+            client, [(1, product) for product in range(5)])
+        for order_id, status in (
+                (completed, "completed"), (canceled, "canceled"),
+                (in_progress, "in_progress"), (recent, "completed")):
+            await client.put(f"/orders/{order_id}", json={"status": status})
+        await age_orders([completed, canceled, pending, in_progress], days=8)
+        archived = await archive()
+        return (
+            [completed, canceled, pending, in_progress, recent], archived,
+            await table_ids("orders"), await table_ids("orders_archive"),
+        )
+
+    ids, archived, hot, cold = run_with_client(scenario)
+    completed, canceled, pending, in_progress, recent = ids
+    assert archived == 2
+    assert cold == [completed, canceled]
+    assert hot == [pending, in_progress, recent]
+
+
+def test_archiving_moves_batches_of_at_most_limit_orders():
+    async def scenario(client):
+        ids = await create_orders(client, [(1, product) for product in range(5)])
+        for order_id in ids:
+            await client.put(f"/orders/{order_id}", json={"status": "canceled"})
+        await age_orders(ids, days=8)
+        return [await archive(limit=2) for _ in range(4)]
+
+    assert run_with_client(scenario) == [2, 2, 1, 0]
+
+
+def test_archived_orders_are_still_found_by_id():
+    async def scenario(client):
+        [order_id] = await create_orders(client, [(1, 1)])
+        await client.put(f"/orders/{order_id}", json={"status": "completed"})
+        before = (await client.get(f"/orders/{order_id}")).json()
+        await age_orders([order_id], days=8)
+        await archive()
+        after = await client.get(f"/orders/{order_id}")
+        listed = (await client.get("/orders")).json()
+        return before, after, listed
+
+    before, after, listed = run_with_client(scenario)
+    assert after.status_code == 200
+    assert after.json() == before
+    # Listing reads the hot table only
+    assert listed == []
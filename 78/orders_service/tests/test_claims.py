@@ -0,0 +1,106 @@
+import asyncio
+
+from sqlalchemy import text
+
+from conftest import requires_database
+from test_orders import create_orders, run_with_client
+
+
+pytestmark = requires_database
+
+
+async def claim(client, worker_id, limit, lease_seconds=300):
+    response = await client.post("/orders/claim", json={
+        "worker_id": worker_id, "limit": limit, "lease_seconds": lease_seconds})
+    return [order["id"] for order in response.json()]
+
+
+async def expire_leases():
+    from common.database import async_session
+    from crud import release_expired_leases
+
+    async with async_session() as session:
+        await session.execute(text(
+            "UPDATE orders SET lease_expires_at = now() - interval '1 second'"
+            " WHERE status = 'in_progress'"))
+        await session.commit()
+        return await release_expired_leases(session)
+
+
+def test_concurrent_workers_claim_disjoint_orders():
+    async def scenario(client):
+        ids = await create_orders(client, [(1, product) for product in range(10)])
+        claims = await asyncio.gather(
+            *(claim(client, f"worker-{number}", 3) for number in range(4)))
+        orders = (await client.get("/orders", params={"status": "in_progress"})).json()
+        return ids, claims, orders
+
+    ids, claims, orders = run_with_client(scenario)
+    claimed = [order_id for worker_claim in claims for order_id in worker_claim]
+    assert sorted(claimed) == ids
+    assert {order["claimed_by"] for order in orders} == {
+        f"worker-{number}" for number in range(4)}
+
+
+def test_rows_locked_by_another_transaction_are_skipped():
+    async def scenario(client):
+        from common.database import engine
+
+        ids = await create_orders(client, [(1, product) for product in range(4)])
+        async with engine.connect() as conn:
+            await conn.execute(text(
+                "SELECT id FROM orders WHERE id = ANY(:ids) FOR UPDATE"),
+                {"ids": ids[:2]})
+            # Would wait for the lock without SKIP LOCKED
+            claimed = await asyncio.wait_for(claim(client, "worker", 4), 5)
+            await conn.rollback()
+        return ids, claimed
+
+    ids, claimed = run_with_client(scenario)
+    assert claimed == ids[2:]
+
+
+def test_expired_leases_return_the_orders_to_the_queue():
+    async def scenario(client):
+        [order_id] = await create_orders(client, [(1, 1)])
+        await claim(client, "worker", 1)
+        released = await expire_leases()
+        order = (await client.get(f"/orders/{order_id}")).json()
+        return released, order, await claim(client, "other", 1)
+
+    released, order, claimed_again = run_with_client(scenario)
+    assert released == 1
+    assert order["status"] == "pending"
+    assert order["claimed_by"] is None
+    assert claimed_again == [order["id"]]
+
+
+def test_an_expired_order_is_merged_into_a_new_pending_one():
+    async def scenario(client):
+        [abandoned] = await create_orders(client, [(1, 1)])
+        await claim(client, "worker", 1)
+        [pending] = await create_orders(client, [(1, 1)])
+        await expire_leases()
+        return [
+            (await client.get(f"/orders/{order_id}")).json()
+            for order_id in (abandoned, pending)
+        ]
+
+    abandoned, pending = run_with_client(scenario)
+    assert abandoned["status"] == "canceled"
+    assert pending["status"] == "pending"
+    assert pending["quantity"] == 2 * abandoned["quantity"]
+
+
+def test_claim_limits_are_validated():
+    async def scenario(client):
+        return [
+            (await client.post("/orders/claim", json=body)).status_code
+            for body in (
+                {"worker_id": "worker", "limit": 0},
+                {"worker_id": "worker", "limit": 101},
+                {"worker_id": "worker", "lease_seconds": 0},
+            )
+        ]
+
+    assert run_with_client(scenario) == [400, 400, 400]
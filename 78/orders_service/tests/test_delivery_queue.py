@@ -0,0 +1,215 @@
+import asyncio
+
+from common.messaging import BatchingPublisher, InMemoryBroker, Message
+from common.wire import DELIVERY_ORDER, decode, encode
+from conftest import requires_database
+
+
+QUEUE = "delivery_orders_test"
+
+
+def delivery_order(location_id, product_id, quantity):
+    return {
+        "location_id": location_id, "product_id": product_id,
+        "product_name": f"product {product_id}", "quantity": quantity,
+    }
+
+
+def encode_delivery_orders(orders):
+    return encode(DELIVERY_ORDER, orders)
+
+
+async def wait_for(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_publisher_batches_orders_into_one_message_with_an_id():
+    async def run():
+        broker = InMemoryBroker()
+        publisher = BatchingPublisher(
+            broker, QUEUE, batch_size=10, flush_interval=0.01,
+            encode_batch=encode_delivery_orders)
+        received = []
+
+        async def handler(messages):
+            received.extend(messages)
+
+        await broker.consume(QUEUE, handler)
+        publisher.start()
+        for product_id in range(3):
+            await publisher.publish(delivery_order(1, product_id, 5))
+        await wait_for(lambda: received)
+        await publisher.stop()
+        await broker.close()
+        return received
+
+    received = asyncio.run(run())
+    assert len(received) == 1
+    assert received[0].message_id
+    message_type, records = decode(received[0].body)
+    assert message_type is DELIVERY_ORDER
+    assert [record["product_id"] for record in records] == [0, 1, 2]
+
+
+def test_failed_batch_is_redelivered_with_the_same_id():
+    async def run():
+        broker = InMemoryBroker()
+        publisher = BatchingPublisher(
+            broker, QUEUE, flush_interval=0.01,
+            encode_batch=encode_delivery_orders)
+        attempts = []
+
+        async def handler(messages):
+            attempts.append([message.message_id for message in messages])
+            if len(attempts) == 1:
+                raise RuntimeError("database is down")
+
+        await broker.consume(QUEUE, handler)
+        publisher.start()
+        await publisher.publish(delivery_order(1, 1, 5))
+        await wait_for(lambda: len(attempts) == 2, timeout=5.0)
+        await publisher.stop()
+        await broker.close()
+        return attempts
+
+    first, second = asyncio.run(run())
+    assert first == second
+
+
+def test_unconfirmed_batch_is_republished_with_the_same_id():
+    class FlakyBroker(InMemoryBroker):
+        failures = 1
+
+        async def publish_batch(self, queue, messages):
+            # The broker got the messages, but the confirm was lost
+            await super().publish_batch(queue, messages)
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("confirm lost")
+
+    async def run():
+        broker = FlakyBroker()
+        publisher = BatchingPublisher(
+            broker, QUEUE, flush_interval=0.01,
+            encode_batch=encode_delivery_orders)
+        publisher.start()
+        await publisher.publish(delivery_order(1, 1, 5))
+        await wait_for(lambda: broker.pending(QUEUE) == 2, timeout=5.0)
+        await publisher.stop()
+        return [broker._queue(QUEUE).get_nowait() for _ in range(2)]
+
+    first, second = asyncio.run(run())
+    assert first.message_id == second.message_id
+
+
+@requires_database
+def test_redelivered_message_does_not_add_to_pending_orders():
+    from sqlalchemy import text
+
+    import main
+    from common.database import engine
+    from migrations import init_db
+
+    async def pending_quantity(session):
+        result = await session.execute(text(
+            "SELECT quantity FROM orders WHERE status = 'pending'"
+            " AND location_id = 1 AND product_id = 1"))
+        return result.scalar()
+
+    async def run():
+        await init_db()
+        async with engine.begin() as conn:
+            await conn.execute(text("TRUNCATE orders, processed_messages"))
+        broker = InMemoryBroker()
+        publisher = BatchingPublisher(
+            broker, QUEUE, flush_interval=0.01,
+            encode_batch=encode_delivery_orders)
+        consumed = []
+
+        async def handler(messages):
+            await main.consume_delivery_orders(messages)
+            consumed.extend(messages)
+            if len(consumed) == 1:
+                # Committed, but the ack is lost: the broker delivers again
+                raise ConnectionError("channel closed before the ack")
+
+        try:
+            await broker.consume(QUEUE, handler)
+            publisher.start()
+            await publisher.publish(delivery_order(1, 1, 5))
+            await publisher.publish(delivery_order(1, 1, 2))
+            await wait_for(lambda: len(consumed) == 2, timeout=5.0)
+            # A new message with the same orders is not a redelivery
+            await main.consume_delivery_orders([
+                Message(encode_delivery_orders([delivery_order(1, 1, 3)]), "other")])
+            await publisher.stop()
+            await broker.close()
+            async with main.async_session() as session:
+                return consumed, await pending_quantity(session)
+        finally:
+            await engine.dispose()
+
+    consumed, quantity = asyncio.run(run())
+    assert consumed[0].message_id == consumed[1].message_id
+    assert quantity == 5 + 2 + 3
+
+
+@requires_database
+def test_consumer_span_continues_the_publishing_trace():
+    import main
+    from common import tracing
+    from common.database import engine
+    from migrations import init_db
+
+    async def run():
+        await init_db()
+        broker = InMemoryBroker()
+        publisher = BatchingPublisher(
+            broker, QUEUE, flush_interval=0.01,
+            encode_batch=encode_delivery_orders)
+        consumed = []
+
+        async def handler(messages):
+            await main.consume_delivery_orders(messages)
+            consumed.extend(messages)
+
+        tracing.configure("memory")
+        tracing.memory_exporter.clear()
+        try:
+            await broker.consume(QUEUE, handler)
+            publisher.start()
+            with tracing.start_span("POST /purchase", kind="server") as request_span:
+                await publisher.publish(delivery_order(2, 2, 1))
+            await wait_for(lambda: consumed)
+            await publisher.stop()
+            await broker.close()
+            return request_span, consumed[0]
+        finally:
+            tracing.configure("none")
+            await engine.dispose()
+
+    request_span, message = asyncio.run(run())
+    assert message.headers["traceparent"].split("-")[1] == f"{request_span.trace_id:032x}"
+    [(root, children)] = tracing.memory_exporter.tree(request_span.trace_id)
+    assert root == "POST /purchase"
+    [(consumer, statements)] = children
+    assert consumer == f"consume {main.DELIVERY_QUEUE}"
+    assert statements and all(name == "db.query" for name, _ in statements)
+
+
+def test_messages_without_a_traced_publisher_have_no_traceparent():
+    async def run():
+        broker = InMemoryBroker()
+        publisher = BatchingPublisher(
+            broker, QUEUE, flush_interval=0.01,
+            encode_batch=encode_delivery_orders)
+        publisher.start()
+        await publisher.publish(delivery_order(1, 1, 1))
+        await publisher.stop()
+        return broker._queue(QUEUE).get_nowait()
+
+    assert "traceparent" not in asyncio.run(run()).headers
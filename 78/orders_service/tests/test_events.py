@@ -0,0 +1,99 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from events import Broadcaster, SubscriberLagged, Subscription
+from schemas import OrderStatus
+
+
+def order(order_id, location_id=1, status=OrderStatus.pending):
+    return SimpleNamespace(
+        id=order_id, location_id=location_id, product_id=1,
+        product_name="Apple", quantity=5, status=status,
+        claimed_by=None, lease_expires_at=None)
+
+
+def drain(subscription):
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait())
+    return events
+
+
+def test_subscribers_get_the_events_matching_their_filters():
+    broadcaster = Broadcaster()
+    everything = broadcaster.subscribe()
+    location = broadcaster.subscribe(location_id=2)
+    completed = broadcaster.subscribe(status=OrderStatus.completed)
+    broadcaster.publish("created", order(1, location_id=1))
+    broadcaster.publish("created", order(2, location_id=2))
+    broadcaster.publish(
+        "updated", order(1, location_id=1, status=OrderStatus.completed))
+
+    assert [event.id for event in drain(everything)] == [1, 2, 3]
+    assert [event.id for event in drain(location)] == [2]
+    assert [event.id for event in drain(completed)] == [3]
+
+
+def test_events_are_serialized_once_as_json():
+    broadcaster = Broadcaster()
+    subscription = broadcaster.subscribe()
+    broadcaster.publish("deleted", order(7))
+    [event] = drain(subscription)
+    message = json.loads(event.to_json())
+    assert message["type"] == "deleted"
+    assert message["order"]["id"] == 7
+    assert message["order"]["status"] == "pending"
+
+
+def test_a_resuming_subscriber_gets_the_events_it_missed():
+    broadcaster = Broadcaster(replay_size=10)
+    for order_id in range(5):
+        broadcaster.publish("created", order(order_id))
+    resumed = broadcaster.subscribe(last_event_id=3)
+    assert [event.id for event in drain(resumed)] == [4, 5]
+    up_to_date = broadcaster.subscribe(last_event_id=5)
+    assert drain(up_to_date) == []
+
+
+@pytest.mark.parametrize("last_event_id", [1, 9])
+def test_resuming_outside_the_replay_buffer_gets_a_reset(last_event_id):
+    broadcaster = Broadcaster(replay_size=3)
+    for order_id in range(5):
+        broadcaster.publish("created", order(order_id))
+    # Events 3 to 5 are kept, 2 is lost; 9 was never published here
+    [event] = drain(broadcaster.subscribe(last_event_id=last_event_id))
+    assert event.type == "reset"
+    assert event.id == 5
+
+
+def test_a_lagging_subscriber_is_dropped_after_its_queued_events(monkeypatch):
+    broadcaster = Broadcaster()
+    monkeypatch.setattr("events.EVENTS_SUBSCRIBER_QUEUE_SIZE", 2)
+    subscription = broadcaster.subscribe()
+    for order_id in range(3):
+        broadcaster.publish("created", order(order_id))
+
+    async def read_all():
+        events = []
+        with pytest.raises(SubscriberLagged):
+            while True:
+                events.append(await subscription.next(timeout=1))
+        return events
+
+    assert [event.id for event in asyncio.run(read_all())] == [1, 2]
+
+
+def test_next_returns_none_when_nothing_comes_in_time():
+    subscription = Subscription(Broadcaster())
+    assert asyncio.run(subscription.next(timeout=0.001)) is None
+
+
+def test_closed_subscriptions_get_no_more_events():
+    broadcaster = Broadcaster()
+    subscription = broadcaster.subscribe()
+    subscription.close()
+    broadcaster.publish("created", order(1))
+    assert drain(subscription) == []
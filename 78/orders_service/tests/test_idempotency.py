@@ -0,0 +1,38 @@
+from conftest import requires_database
+from test_orders import ORDER, run_with_client
+
+
+pytestmark = requires_database
+
+
+def test_a_retried_order_is_not_merged_twice():
+    async def scenario(client):
+        headers = {"Idempotency-Key": "a"}
+        first = await client.post("/orders", json=ORDER, headers=headers)
+        retry = await client.post("/orders", json=ORDER, headers=headers)
+        merged = await client.post(
+            "/orders", json=ORDER, headers={"Idempotency-Key": "b"})
+        return first, retry, merged
+
+    first, retry, merged = run_with_client(scenario)
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert merged.json()["quantity"] == 10
+
+
+def test_a_rejected_batch_is_replayed_without_creating_orders():
+    import main
+
+    async def scenario(client):
+        batch = {"orders": [ORDER] * (main.MAX_BATCH_SIZE + 1)}
+        headers = {"Idempotency-Key": "a"}
+        first = await client.post("/orders/batch", json=batch, headers=headers)
+        retry = await client.post("/orders/batch", json=batch, headers=headers)
+        orders = await client.get("/orders")
+        return first, retry, orders.json()
+
+    first, retry, orders = run_with_client(scenario)
+    assert first.status_code == retry.status_code == 400
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert orders == []
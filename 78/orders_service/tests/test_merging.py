@@ -0,0 +1,68 @@
+from sqlalchemy import text
+
+from conftest import requires_database
+from test_orders import ORDER, run_with_client
+
+
+pytestmark = requires_database
+
+
+def test_orders_for_a_pending_location_and_product_are_merged():
+    async def scenario(client):
+        first = (await client.post("/orders", json=ORDER)).json()
+        merged = (await client.post("/orders", json=dict(ORDER, quantity=3))).json()
+        other_product = (await client.post(
+            "/orders", json=dict(ORDER, product_id=3))).json()
+        etag = (await client.get(f"/orders/{first['id']}")).headers["etag"]
+        return first, merged, other_product, etag
+
+    first, merged, other_product, etag = run_with_client(scenario)
+    assert merged["id"] == first["id"]
+    assert merged["quantity"] == 8
+    # The merge is a change of the order, cached copies are stale
+    assert etag == f'"order-{first["id"]}-2"'
+    assert other_product["id"] != first["id"]
+
+
+def test_a_batch_sums_up_repeated_pairs_and_merges_into_pending_orders():
+    async def scenario(client):
+        existing = (await client.post("/orders", json=ORDER)).json()
+        batch = (await client.post("/orders/batch", json={"orders": [
+            ORDER, dict(ORDER, quantity=2), dict(ORDER, location_id=9),
+        ]})).json()
+        return existing, batch, (await client.get("/orders")).json()
+
+    existing, batch, orders = run_with_client(scenario)
+    assert [(order["id"], order["quantity"]) for order in batch][0] == (
+        existing["id"], 12)
+    assert len(orders) == 2
+
+
+def test_only_pending_orders_take_merges():
+    async def scenario(client):
+        first = (await client.post("/orders", json=ORDER)).json()
+        await client.put(f"/orders/{first['id']}", json={"status": "in_progress"})
+        second = (await client.post("/orders", json=ORDER)).json()
+        # Two pending orders for one pair would break the merging
+        back_to_pending = await client.put(
+            f"/orders/{first['id']}", json={"status": "pending"})
+        return first, second, back_to_pending
+
+    first, second, back_to_pending = run_with_client(scenario)
+    assert second["id"] != first["id"]
+    assert second["quantity"] == ORDER["quantity"]
+    assert back_to_pending.status_code == 409
+
+
+def test_merging_keeps_one_history_entry_per_created_order():
+    async def scenario(client):
+        from common.database import engine
+
+        await client.post("/orders", json=ORDER)
+        await client.post("/orders", json=ORDER)
+        async with engine.connect() as conn:
+            result = await conn.execute(text(
+                "SELECT count(*) FROM order_status_history"))
+            return result.scalar()
+
+    assert run_with_client(scenario) == 1
@@ -0,0 +1,104 @@
+import asyncio
+
+import httpx
+from sqlalchemy import text
+
+from conftest import requires_database
+
+
+pytestmark = requires_database
+
+
+def run_with_client(scenario):
+    """Runs `scenario(client)` against the app on an emptied database."""
+    import main
+    from common.database import engine
+    from migrations import init_db
+
+    async def run():
+        await init_db()
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "TRUNCATE orders, orders_archive, order_status_history,"
+                " order_hourly_stats, order_lead_time_histogram,"
+                " processed_messages, idempotency_keys RESTART IDENTITY CASCADE"))
+        transport = httpx.ASGITransport(app=main.app)
+        try:
+            async with httpx.AsyncClient(
+                    transport=transport, base_url="http://test") as client:
+                return await scenario(client)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+ORDER = {"location_id": 1, "product_id": 2, "product_name": "Apple", "quantity": 5}
+
+
+async def create_orders(client, pairs):
+    """Creates one order per (location_id, product_id) pair."""
+    response = await client.post("/orders/batch", json={"orders": [
+        dict(ORDER, location_id=location_id, product_id=product_id)
+        for location_id, product_id in pairs
+    ]})
+    return [order["id"] for order in response.json()]
+
+
+def test_pages_follow_the_next_after_id_header():
+    async def scenario(client):
+        ids = await create_orders(client, [(1, product) for product in range(7)])
+        pages = []
+        params = {"limit": 3}
+        while True:
+            response = await client.get("/orders", params=params)
+            pages.append([order["id"] for order in response.json()])
+            if "x-next-after-id" not in response.headers:
+                return ids, pages
+            params["after_id"] = response.headers["x-next-after-id"]
+
+    ids, pages = run_with_client(scenario)
+    assert pages == [ids[0:3], ids[3:6], ids[6:7]]
+
+
+def test_a_full_last_page_is_followed_by_an_empty_one():
+    async def scenario(client):
+        await create_orders(client, [(1, 1), (1, 2)])
+        first = await client.get("/orders", params={"limit": 2})
+        last = await client.get("/orders", params={
+            "limit": 2, "after_id": first.headers["x-next-after-id"]})
+        return last
+
+    last = run_with_client(scenario)
+    assert last.json() == []
+    assert "x-next-after-id" not in last.headers
+
+
+def test_orders_are_filtered_by_status_location_and_product():
+    async def scenario(client):
+        ids = await create_orders(client, [(1, 1), (1, 2), (2, 1), (2, 2)])
+        await client.put(f"/orders/{ids[3]}", json={"status": "completed"})
+
+        async def listed(**params):
+            orders = (await client.get("/orders", params=params)).json()
+            return [order["id"] for order in orders]
+
+        return ids, [
+            await listed(location_id=2),
+            await listed(product_id=1),
+            await listed(status="pending", location_id=2),
+            await listed(status="completed"),
+        ]
+
+    ids, results = run_with_client(scenario)
+    assert results == [[ids[2], ids[3]], [ids[0], ids[2]], [ids[2]], [ids[3]]]
+
+
+def test_page_size_is_bounded():
+    async def scenario(client):
+        return [
+            (await client.get("/orders", params={"limit": limit})).status_code
+            for limit in (0, 1000, 1001)
+        ]
+
+    assert run_with_client(scenario) == [422, 200, 422]
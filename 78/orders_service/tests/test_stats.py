@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import requires_database
+from crud import _histogram_median
+from models import LEAD_TIME_BUCKETS
+from test_orders import create_orders, run_with_client
+
+
+def histogram(**counts_by_bucket):
+    counts = [0] * (len(LEAD_TIME_BUCKETS) + 1)
+    for bucket, count in counts_by_bucket.items():
+        counts[int(bucket[1:])] = count
+    return counts
+
+
+def test_median_of_an_empty_histogram_is_none():
+    assert _histogram_median(histogram()) is None
+
+
+def test_median_is_interpolated_inside_its_bucket():
+    # 4 lead times under a minute: the median is half way through it
+    assert _histogram_median(histogram(b0=4)) == 30
+    # 1 under a minute, 3 in 1..5 minutes: the median is 1/3 into the second
+    assert _histogram_median(histogram(b0=1, b1=3)) == pytest.approx(60 + 240 / 3)
+
+
+def test_median_in_the_unbounded_bucket_is_its_lower_bound():
+    assert _histogram_median(histogram(b12=3)) == LEAD_TIME_BUCKETS[-1]
+
+
+@requires_database
+def test_status_changes_are_rolled_up_per_hour_and_location():
+    async def scenario(client):
+        ids = await create_orders(client, [(1, 1), (1, 2), (1, 3), (2, 1)])
+        await client.put(f"/orders/{ids[0]}", json={"status": "completed"})
+        await client.put(f"/orders/{ids[1]}", json={"status": "completed"})
+        await client.put(f"/orders/{ids[2]}", json={"status": "canceled"})
+        stats = (await client.get("/orders/stats")).json()
+        location = (await client.get("/orders/stats", params={"location_id": 2})).json()
+        return stats, location
+
+    stats, location = run_with_client(scenario)
+    hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    [first, second] = stats
+    assert datetime.fromisoformat(first["hour"]) == hour
+    assert (first["location_id"], first["created"], first["completed"],
+            first["canceled"]) == (1, 3, 2, 1)
+    assert first["mean_lead_time_seconds"] < 60
+    assert first["median_lead_time_seconds"] == 30
+    assert (second["location_id"], second["created"], second["completed"]) == (2, 1, 0)
+    assert second["mean_lead_time_seconds"] is None
+    assert second["median_lead_time_seconds"] is None
+    assert location == [second]
+
+
+@requires_database
+def test_stats_time_range_is_validated():
+    async def scenario(client):
+        now = datetime.now(timezone.utc)
+        return [
+            (await client.get("/orders/stats", params={
+                "since": since.isoformat(), "until": now.isoformat(),
+            })).status_code
+            for since in (now, now - timedelta(days=32), now - timedelta(days=31))
+        ]
+
+    assert run_with_client(scenario) == [400, 400, 200]
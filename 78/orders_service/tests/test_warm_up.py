@@ -0,0 +1,47 @@
+import asyncio
+
+from sqlalchemy import text
+
+from conftest import requires_database
+
+
+pytestmark = requires_database
+
+
+def test_warm_up_prepares_order_creation_and_rolls_it_back():
+    import crud
+    from common.database import engine, warm_up
+    from migrations import init_db
+
+    async def run():
+        await init_db()
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "TRUNCATE orders, order_status_history, order_hourly_stats RESTART IDENTITY CASCADE"))
+        try:
+            await warm_up(crud.warm_up_queries, connections=2)
+            conns = [await engine.connect(), await engine.connect()]
+            try:
+                caches = []
+                for conn in conns:
+                    raw = await conn.get_raw_connection()
+                    caches.append(list(raw.dbapi_connection._prepared_statement_cache))
+            finally:
+                for conn in conns:
+                    await conn.close()
+            async with engine.connect() as conn:
+                counts = [
+                    await conn.scalar(text(f"SELECT count(*) FROM {table}"))
+                    for table in (
+                        "orders", "order_status_history", "order_hourly_stats")
+                ]
+            return caches, counts
+        finally:
+            await engine.dispose()
+
+    caches, counts = asyncio.run(run())
+    for statements in caches:
+        for table in ("orders", "order_status_history", "order_hourly_stats"):
+            assert any(
+                sql.startswith(f"INSERT INTO {table} ") for sql in statements)
+    assert counts == [0, 0, 0]
@@ -0,0 +1,5 @@
+"""
+Modules shared by the services of 6/ and 78/. Each service image copies
+this package next to the service modules, so they import it as `common`
+both in the container and from the repository root.
+"""
@@ -0,0 +1,33 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+_tasks = []
+
+
+def start_periodic(name: str, interval: float, job):
+    """
+    Runs `job` every `interval` seconds in the background
+    until `stop_all` is called. Failures are logged, not raised.
+    """
+    _tasks.append(asyncio.create_task(_run_periodic(name, interval, job)))
+
+
+async def _run_periodic(name: str, interval: float, job):
+    while True:
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Background job %s failed", name)
+        await asyncio.sleep(interval)
+
+
+async def stop_all():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
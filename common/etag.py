@@ -0,0 +1,34 @@
+import hashlib
+
+from fastapi import Request, Response
+
+
+def entity_etag(kind: str, entity_id: int, version: int) -> str:
+    """Strong ETag of a single row, derived from its version column."""
+    return f'"{kind}-{entity_id}-{version}"'
+
+
+def versions_etag(kind: str, versions) -> str:
+    """
+    Strong ETag of a representation built from several rows,
+    derived from their (id, version) pairs in response order.
+    """
+    digest = hashlib.sha1()
+    for entity_id, version in versions:
+        digest.update(f"{entity_id}:{version};".encode())
+    return f'"{kind}-{digest.hexdigest()}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    candidates = (tag.strip() for tag in header.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import (
+    JSON, Column, DateTime, Integer, LargeBinary, String, Table, delete,
+    func, select, tuple_, update
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+IDEMPOTENCY_TTL = timedelta(
+    seconds=float(os.getenv("IDEMPOTENCY_TTL", 24 * 60 * 60)))
+
+
+def idempotency_table(metadata) -> Table:
+    """
+    The table of idempotency keys, defined on the metadata of a service
+    so it is created with the rest of its schema. `request_id` tells
+    which request claimed the key; `status_code` stays NULL until its
+    response is stored.
+    """
+    return Table(
+        "idempotency_keys", metadata,
+        Column("path", String, primary_key=True),
+        Column("key", String, primary_key=True),
+        Column("request_hash", String, nullable=False),
+        Column("request_id", String, nullable=False),
+        Column("status_code", Integer, nullable=True),
+        Column("headers", JSON, nullable=True),
+        Column("response", LargeBinary, nullable=True),
+        Column(
+            "created_at", DateTime(timezone=True), nullable=False,
+            server_default=func.now(), index=True),
+    )
+
+
+class _Claim:
+    """What the middleware passes to the idempotency_key_claim dependency."""
+    __slots__ = ("table", "path", "key", "request_hash", "request_id", "conflict")
+
+    def __init__(self, table, path: str, key: str, request_hash: str):
+        self.table = table
+        self.path = path
+        self.key = key
+        self.request_hash = request_hash
+        self.request_id = uuid.uuid4().hex
+        self.conflict = False
+
+
+def idempotency_key_claim(get_db):
+    """
+    Builds the dependency the endpoints behind IdempotencyMiddleware
+    need. It records the idempotency key of the request in the session
+    from `get_db`, which the endpoint shares, so the key is committed
+    together with what the endpoint writes, or rolled back with it.
+    A request that finds the key claimed by another one gets 409.
+    """
+    async def claim_idempotency_key(
+            request: Request, db: AsyncSession = Depends(get_db)):
+        claim = request.scope.get("state", {}).get("idempotency")
+        if claim is None:
+            return
+        table = claim.table
+        result = await db.execute(
+            insert(table)
+            .values(
+                path=claim.path, key=claim.key,
+                request_hash=claim.request_hash, request_id=claim.request_id)
+            .on_conflict_do_nothing()
+            .returning(table.c.key)
+        )
+        if result.scalar_one_or_none() is None:
+            claim.conflict = True
+            await db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is in progress")
+
+    return claim_idempotency_key
+
+
+async def delete_expired_idempotency_keys(
+        db: AsyncSession, table, older_than: timedelta, limit: int) -> int:
+    """
+    Forgets up to `limit` keys stored more than `older_than` ago,
+    longer than any client retries. Returns the number deleted.
+    """
+    cutoff = datetime.now(timezone.utc) - older_than
+    batch = (
+        select(table.c.path, table.c.key)
+        .where(table.c.created_at < cutoff)
+        .limit(limit)
+    )
+    result = await db.execute(
+        delete(table).where(tuple_(table.c.path, table.c.key).in_(batch)))
+    await db.commit()
+    return result.rowcount
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware that makes POST requests to `paths` idempotent
+    when the client sends an `Idempotency-Key` header. The endpoints
+    of `paths` must depend on the idempotency_key_claim dependency.
+
+    Keys are stored in `table` (see idempotency_table) through sessions
+    of `session_factory`, so they are shared by every worker. The first response for a key is stored
+    together with a hash of the request, and a retry with the same key
+    and body gets it without reaching the endpoint. A retry that
+    arrives while the first request is still running gets 409 and
+    should be retried later. Server errors (5xx) are not stored,
+    so the request can be retried; if the endpoint had committed
+    before failing, the key stays in progress until it expires.
+    """
+
+    def __init__(self, app, paths, table, session_factory):
+        self.app = app
+        self.paths = set(paths)
+        self.table = table
+        self.session_factory = session_factory
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or scope["path"] not in self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        idempotency_key = dict(scope["headers"]).get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        claim = _Claim(
+            self.table, scope["path"], idempotency_key.decode("latin-1"),
+            hashlib.sha256(scope["query_string"] + b"\n" + body).hexdigest())
+
+        stored = await self._lookup(claim)
+        if stored is not None:
+            if stored.request_hash != claim.request_hash:
+                await _send_error(
+                    send, 422,
+                    "Idempotency-Key was already used with a different request")
+            elif stored.status_code is None:
+                await _send_error(
+                    send, 409, "A request with this Idempotency-Key is in progress")
+            else:
+                await _send_response(
+                    send, stored.status_code,
+                    [(name.encode("latin-1"), value.encode("latin-1"))
+                     for name, value in stored.headers],
+                    stored.response, replayed=True)
+            return
+
+        scope.setdefault("state", {})["idempotency"] = claim
+        status, headers, chunks = 500, [], []
+
+        async def replay_receive():
+            nonlocal body
+            if body is None:
+                return await receive()
+            message = {"type": "http.request", "body": body, "more_body": False}
+            body = None
+            return message
+
+        async def capture_send(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, replay_receive, capture_send)
+        if status < 500 and not claim.conflict:
+            await self._store(claim, status, headers, b"".join(chunks))
+
+    async def _lookup(self, claim: _Claim):
+        table = self.table
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(
+                    table.c.request_hash, table.c.status_code,
+                    table.c.headers, table.c.response)
+                .where(table.c.path == claim.path)
+                .where(table.c.key == claim.key)
+            )
+            return result.one_or_none()
+
+    async def _store(self, claim: _Claim, status, headers, body):
+        table = self.table
+        response = {
+            "status_code": status,
+            "headers": [
+                [name.decode("latin-1"), value.decode("latin-1")]
+                for name, value in headers],
+            "response": body,
+        }
+        async with self.session_factory() as session:
+            # The key committed by the endpoint, if it got that far
+            result = await session.execute(
+                update(table)
+                .where(table.c.path == claim.path)
+                .where(table.c.key == claim.key)
+                .where(table.c.request_id == claim.request_id)
+                .values(**response)
+            )
+            if result.rowcount == 0:
+                # The endpoint rolled back, e.g. a 4xx, or never claimed
+                await session.execute(
+                    insert(table)
+                    .values(
+                        path=claim.path, key=claim.key,
+                        request_hash=claim.request_hash,
+                        request_id=claim.request_id, **response)
+                    .on_conflict_do_nothing()
+                )
+            await session.commit()
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _send_error(send, status, detail):
+    await _send_response(
+        send, status, [(b"content-type", b"application/json")],
+        json.dumps({"detail": detail}).encode(), replayed=False)
+
+
+async def _send_response(send, status, headers, body, replayed):
+    headers = [
+        (name, value) for name, value in headers
+        if name.lower() != b"content-length"
+    ]
+    headers.append((b"content-length", str(len(body)).encode()))
+    if replayed:
+        headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
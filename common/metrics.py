@@ -0,0 +1,49 @@
+import threading
+
+
+class Metrics:
+    """
+    Process-local registry of counters and gauges.
+    Rendered in the Prometheus text format by the `/metrics` endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}
+        self._values = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types.setdefault(name, "counter")
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types.setdefault(name, "gauge")
+            self._values[key] = value
+
+    def get(self, name: str, **labels) -> float:
+        return self._values.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(self._types):
+                lines.append(f"# TYPE {name} {self._types[name]}")
+                for (key_name, labels), value in sorted(self._values.items()):
+                    if key_name != name:
+                        continue
+                    label_text = ",".join(
+                        f'{label}="{label_value}"'
+                        for label, label_value in labels
+                    )
+                    if label_text:
+                        lines.append(f"{name}{{{label_text}}} {value}")
+                    else:
+                        lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,126 @@
+import asyncio
+import collections
+import hmac
+import os
+import sys
+import threading
+import time
+
+from fastapi import HTTPException
+
+
+# Profiling is disabled unless a token is configured
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN")
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", 0.005))
+MAX_PROFILE_SECONDS = 60
+
+_task_scopes = {}
+_lock = threading.Lock()
+_active = False
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware that remembers which request each asyncio task
+    serves while a profile runs, so samples can be filtered by route.
+    Does nothing when no profile is running.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not _active or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        _task_scopes[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _task_scopes.pop(task, None)
+
+
+def authorize(token):
+    """Raises 404 while profiling is disabled and 403 for a wrong token."""
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token, PROFILER_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid profiler token")
+
+
+async def profile(seconds: float, route: str = None) -> str:
+    """
+    Samples the stack of the event loop thread every PROFILER_INTERVAL
+    seconds for `seconds` seconds and returns the samples as collapsed
+    stacks ("outer;inner count" per line), the input format of
+    flamegraph.pl and speedscope.
+
+    Only samples taken while a task runs are kept, so an idle loop adds
+    nothing. With `route` (a path template such as "/products/{product_id}")
+    only samples of requests matched to that route are kept.
+    """
+    global _active
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+    if not _lock.acquire(blocking=False):
+        raise HTTPException(
+            status_code=409, detail="A profile is already running")
+    try:
+        _active = True
+        loop = asyncio.get_running_loop()
+        sampler = _Sampler(loop, threading.get_ident(), route)
+        thread = threading.Thread(target=sampler.run, daemon=True)
+        thread.start()
+        await asyncio.sleep(seconds)
+        sampler.stop()
+        await asyncio.to_thread(thread.join)
+        return sampler.collapsed()
+    finally:
+        _active = False
+        _task_scopes.clear()
+        _lock.release()
+
+
+class _Sampler:
+    def __init__(self, loop, thread_id, route):
+        self.loop = loop
+        self.thread_id = thread_id
+        self.route = route
+        self.counts = collections.Counter()
+        self._stopped = threading.Event()
+        # The profiling request itself only sleeps, skip its samples
+        self._own_task = asyncio.current_task()
+
+    def run(self):
+        while not self._stopped.wait(PROFILER_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            task = asyncio.current_task(self.loop)
+            if frame is None or task is None or task is self._own_task:
+                continue
+            if self.route is not None:
+                scope = _task_scopes.get(task)
+                matched = scope.get("route") if scope else None
+                if matched is None or matched.path != self.route:
+                    continue
+            self.counts[_collapse(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        module = frame.f_globals.get("__name__", "?")
+        name = getattr(code, "co_qualname", code.co_name)
+        names.append(f"{module}:{name}".replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import time
+
+
+# Written at build time by `python commands.py export-openapi`
+OPENAPI_FILE = os.getenv("OPENAPI_FILE", "openapi.json")
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age() -> float:
+    """
+    Seconds since the process was started, read from /proc, so the
+    interpreter start and the imports before this module count too.
+    Falls back to 0 (now) where /proc is not available.
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            # The command name may contain spaces, fields follow its ")"
+            fields = stat.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as uptime:
+            uptime_seconds = float(uptime.read().split()[0])
+        started_ticks = int(fields[19])
+        return max(0.0, uptime_seconds - started_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimeline:
+    """
+    Time from process start to the end of each startup phase.
+    `mark` ends a phase, `finish` ends the last one, after which
+    the service is ready, and logs the timeline.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic() - _process_age()
+        self.marks = []
+        self.ready = False
+
+    def mark(self, phase: str) -> float:
+        elapsed = time.monotonic() - self.started
+        self.marks.append((phase, elapsed))
+        return elapsed
+
+    def durations(self):
+        """(phase, seconds spent in it) pairs in order."""
+        previous = 0.0
+        for phase, elapsed in self.marks:
+            yield phase, elapsed - previous
+            previous = elapsed
+
+    def finish(self, phase: str):
+        if self.ready:
+            return
+        self.mark(phase)
+        self.ready = True
+        phases = " ".join(
+            f"{phase}={seconds:.3f}s" for phase, seconds in self.durations())
+        logger.info(
+            "Startup timeline: %s total=%.3fs", phases, self.marks[-1][1])
+
+    def export(self, metrics):
+        """Sets the timeline as gauges of a metrics.Metrics registry."""
+        for phase, seconds in self.durations():
+            metrics.set("startup_phase_seconds", seconds, phase=phase)
+        if self.ready:
+            metrics.set("startup_ready_seconds", self.marks[-1][1])
+
+    def render(self) -> str:
+        """The timeline in the Prometheus text format."""
+        lines = ["# TYPE startup_phase_seconds gauge"]
+        lines.extend(
+            f'startup_phase_seconds{{phase="{phase}"}} {seconds}'
+            for phase, seconds in self.durations())
+        if self.ready:
+            lines.append("# TYPE startup_ready_seconds gauge")
+            lines.append(f"startup_ready_seconds {self.marks[-1][1]}")
+        return "\n".join(lines) + "\n"
+
+
+timeline = StartupTimeline()
+
+
+def serve_prebuilt_openapi(app, path: str = OPENAPI_FILE):
+    """
+    Makes `app` serve the schema exported at build time from `path`,
+    read on the first request for it. Without the file the schema is
+    generated on the first request instead; either way it is built once
+    per process and never at startup.
+    """
+    generate = app.openapi
+
+    def openapi():
+        if app.openapi_schema is None:
+            try:
+                with open(path) as schema:
+                    app.openapi_schema = json.load(schema)
+            except (OSError, ValueError):
+                app.openapi_schema = generate()
+        return app.openapi_schema
+
+    app.openapi = openapi
+
+
+def export_openapi(app, path: str = OPENAPI_FILE):
+    """Writes the schema generated from the routes of `app` to `path`."""
+    # Generated from the routes even when serve_prebuilt_openapi is in place
+    app.openapi_schema = None
+    with open(path, "w") as schema:
+        json.dump(type(app).openapi(app), schema)
@@ -0,0 +1,28 @@
+import asyncio
+import logging
+
+from common.background import start_periodic, stop_all
+
+
+def test_a_failing_job_keeps_running_until_stopped(caplog):
+    runs = []
+
+    async def job():
+        runs.append(len(runs))
+        if len(runs) == 1:
+            raise RuntimeError("first run fails")
+
+    async def run():
+        start_periodic("test", 0.001, job)
+        while len(runs) < 3:
+            await asyncio.sleep(0.001)
+        await stop_all()
+        stopped_at = len(runs)
+        await asyncio.sleep(0.01)
+        return stopped_at
+
+    with caplog.at_level(logging.ERROR, logger="common.background"):
+        stopped_at = asyncio.run(run())
+    assert len(runs) == stopped_at
+    assert [record.getMessage() for record in caplog.records] == [
+        "Background job test failed"]
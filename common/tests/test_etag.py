@@ -0,0 +1,40 @@
+import pytest
+from starlette.requests import Request
+
+from common.etag import entity_etag, is_not_modified, not_modified, versions_etag
+
+
+def request_with(if_none_match=None):
+    headers = []
+    if if_none_match is not None:
+        headers.append((b"if-none-match", if_none_match.encode()))
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False),
+    ('"product-1-2"', True),
+    ('"product-1-1"', False),
+    ('W/"product-1-2"', True),
+    ('"product-1-1", W/"product-1-2"', True),
+    ("*", True),
+])
+def test_if_none_match_uses_the_weak_comparison(header, matches):
+    etag = entity_etag("product", 1, 2)
+    assert is_not_modified(request_with(header), etag) is matches
+
+
+def test_versions_etag_changes_with_any_version_or_the_order():
+    etag = versions_etag("products", [(1, 1), (2, 1)])
+    assert etag.startswith('"products-') and etag.endswith('"')
+    assert versions_etag("products", [(1, 1), (2, 1)]) == etag
+    assert versions_etag("products", [(1, 1), (2, 2)]) != etag
+    assert versions_etag("products", [(2, 1), (1, 1)]) != etag
+    assert versions_etag("locations", [(1, 1), (2, 1)]) != etag
+
+
+def test_not_modified_has_no_body_and_keeps_the_etag():
+    response = not_modified('"product-1-2"')
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == '"product-1-2"'
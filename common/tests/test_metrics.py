@@ -0,0 +1,24 @@
+from common.metrics import Metrics
+
+
+def test_counters_add_up_per_label_set():
+    metrics = Metrics()
+    metrics.inc("requests_total", route="a")
+    metrics.inc("requests_total", 2, route="a")
+    metrics.inc("requests_total", route="b")
+    assert metrics.get("requests_total", route="a") == 3
+    assert metrics.get("requests_total", route="b") == 1
+    assert metrics.get("requests_total", route="c") == 0
+
+
+def test_render_uses_the_prometheus_text_format():
+    metrics = Metrics()
+    metrics.set("queue_depth", 4, route_class="reads", pool="main")
+    metrics.set("queue_depth", 5, route_class="reads", pool="main")
+    metrics.inc("errors_total")
+    assert metrics.render() == (
+        "# TYPE errors_total counter\n"
+        "errors_total 1\n"
+        "# TYPE queue_depth gauge\n"
+        'queue_depth{pool="main",route_class="reads"} 5\n'
+    )
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from common import profiler
+from common.profiler import ProfilerMiddleware, authorize, profile
+
+
+def spin(seconds):
+    # Blocks the event loop, like a CPU-bound request handler
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def test_the_endpoint_is_hidden_without_a_token(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILER_TOKEN", None)
+    with pytest.raises(HTTPException) as error:
+        authorize("anything")
+    assert error.value.status_code == 404
+
+
+def test_a_wrong_token_is_rejected(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILER_TOKEN", "secret")
+    for token in (None, "wrong"):
+        with pytest.raises(HTTPException) as error:
+            authorize(token)
+        assert error.value.status_code == 403
+    authorize("secret")
+
+
+@pytest.mark.parametrize("seconds", [0, profiler.MAX_PROFILE_SECONDS + 1])
+def test_profile_length_is_bounded(seconds):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(profile(seconds))
+    assert error.value.status_code == 400
+
+
+def test_one_profile_runs_at_a_time():
+    async def run():
+        running = asyncio.create_task(profile(0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as error:
+            await profile(0.05)
+        await running
+        return error.value.status_code
+
+    assert asyncio.run(run()) == 409
+
+
+def test_samples_are_collapsed_stacks_of_the_busy_task():
+    async def busy():
+        await asyncio.sleep(0.01)
+        spin(0.1)
+
+    async def run():
+        task = asyncio.create_task(busy())
+        stacks = await profile(0.2)
+        await task
+        return stacks
+
+    lines = asyncio.run(run()).splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert stack.split(";")[-1] == f"{__name__}:spin"
+
+
+def test_samples_can_be_limited_to_one_route():
+    app = FastAPI()
+    app.add_middleware(ProfilerMiddleware)
+
+    @app.get("/slow/{item_id}")
+    async def slow(item_id: int):
+        spin(0.05)
+
+    @app.get("/other")
+    async def other():
+        spin(0.05)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def requests():
+                await asyncio.sleep(0.01)
+                for _ in range(2):
+                    await client.get("/slow/1")
+                    await client.get("/other")
+
+            load = asyncio.create_task(requests())
+            stacks = await profile(0.3, route="/slow/{item_id}")
+            await load
+            return stacks
+
+    stacks = asyncio.run(run())
+    assert ".slow;" in stacks
+    assert ".other;" not in stacks
@@ -0,0 +1,33 @@
+import logging
+
+import pytest
+
+from common.startup import StartupTimeline
+
+
+@pytest.fixture
+def timeline(monkeypatch):
+    clock = iter([0.5, 1.5, 4.0])
+    timeline = StartupTimeline()
+    timeline.started = 0.0
+    monkeypatch.setattr("common.startup.time.monotonic", lambda: next(clock))
+    return timeline
+
+
+def test_durations_are_the_time_spent_in_each_phase(timeline):
+    timeline.mark("imports")
+    timeline.mark("database")
+    timeline.finish("warm-up")
+    assert list(timeline.durations()) == [
+        ("imports", 0.5), ("database", 1.0), ("warm-up", 2.5)]
+    assert "startup_ready_seconds 4.0" in timeline.render()
+
+
+def test_finish_logs_the_timeline_once(timeline, caplog):
+    timeline.mark("imports")
+    with caplog.at_level(logging.INFO, logger="common.startup"):
+        timeline.finish("startup")
+        timeline.finish("startup")
+    assert [record.getMessage() for record in caplog.records] == [
+        "Startup timeline: imports=0.500s startup=1.000s total=1.500s"]
+    assert timeline.ready
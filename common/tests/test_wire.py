@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from common import wire
+from common.wire import (
+    DELIVERY_ORDER, FLAG_COMPRESSED, FLAG_JSON, INVENTORY_EVENT, WIRE_VERSION,
+    MessageType, WireError, decode, encode
+)
+
+
+ORDERS = [
+    {"location_id": 1, "product_id": 2, "product_name": "Apple", "quantity": 100},
+    {"location_id": 3, "product_id": 4, "product_name": "Pear", "quantity": 200},
+]
+
+
+@pytest.mark.parametrize("use_json", [False, True])
+def test_records_survive_a_round_trip(use_json):
+    data = encode(DELIVERY_ORDER, ORDERS, use_json=use_json)
+    assert data[0] == WIRE_VERSION
+    assert bool(data[1] & FLAG_JSON) is use_json
+    assert decode(data) == (DELIVERY_ORDER, ORDERS)
+
+
+def test_large_batches_are_compressed():
+    records = ORDERS * 50
+    data = encode(DELIVERY_ORDER, records)
+    assert data[1] & FLAG_COMPRESSED
+    assert decode(data) == (DELIVERY_ORDER, records)
+    assert not encode(DELIVERY_ORDER, ORDERS[:1])[1] & FLAG_COMPRESSED
+
+
+def test_fields_are_sent_by_id_and_none_is_left_out():
+    record = {"product_id": 1, "location_id": 2, "stock": None, "delta": -1}
+    assert INVENTORY_EVENT.pack(record) == {1: 1, 2: 2, 4: -1}
+    assert decode(encode(INVENTORY_EVENT, [record])) == (
+        INVENTORY_EVENT, [{"product_id": 1, "location_id": 2, "delta": -1}])
+
+
+def test_old_decoders_skip_fields_they_do_not_know():
+    newer = MessageType("delivery_order", 1, dict(DELIVERY_ORDER.fields, priority=5))
+    data = encode(newer, [dict(ORDERS[0], priority=9)])
+    assert decode(data) == (DELIVERY_ORDER, [ORDERS[0]])
+
+
+def test_a_bare_json_object_is_a_single_delivery_order():
+    assert decode(json.dumps(ORDERS[0]).encode()) == (DELIVERY_ORDER, [ORDERS[0]])
+
+
+def test_json_is_used_without_msgpack(monkeypatch):
+    monkeypatch.setattr(wire, "msgpack", None)
+    data = encode(DELIVERY_ORDER, ORDERS)
+    assert data[1] & FLAG_JSON
+    assert decode(data) == (DELIVERY_ORDER, ORDERS)
+
+
+def test_msgpack_envelopes_need_msgpack(monkeypatch):
+    data = encode(DELIVERY_ORDER, ORDERS)
+    monkeypatch.setattr(wire, "msgpack", None)
+    with pytest.raises(WireError, match="msgpack"):
+        decode(data)
+
+
+@pytest.mark.parametrize("data", [
+    b"\x01",
+    bytes((WIRE_VERSION + 1, 0)) + b"\x90",
+    bytes((WIRE_VERSION, FLAG_COMPRESSED)) + b"not zlib",
+    bytes((WIRE_VERSION, FLAG_JSON)) + b'{"type": "unknown", "records": []}',
+    bytes((WIRE_VERSION, 0)) + b"\x92\x63\x90",
+])
+def test_malformed_envelopes_raise_wire_error(data):
+    with pytest.raises(WireError):
+        decode(data)
@@ -0,0 +1,310 @@
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import httpx
+from sqlalchemy import event
+
+
+# "none" disables tracing, "stdout" and "file" write one JSON span
+# per line, "memory" keeps spans in `memory_exporter` for tests
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+MAX_STATEMENT_LENGTH = 1000
+
+TRACEPARENT_HEADER = "traceparent"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation of a trace. Spans of a trace share `trace_id`
+    and point to the span they were started under with `parent_id`.
+    Unsampled spans only carry ids for propagation and are not exported.
+    """
+
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "kind", "sampled",
+        "attributes", "error", "start", "end", "_start_counter", "_token")
+
+    def __init__(self, name, kind, trace_id, parent_id, sampled, attributes):
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.attributes = attributes
+        self.error = None
+        self.start = time.time()
+        self.end = None
+        self._start_counter = time.perf_counter()
+        self._token = None
+
+    @property
+    def duration(self):
+        return None if self.end is None else self.end - self.start
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        flags = "01" if self.sampled else "00"
+        return f"00-{self.trace_id:032x}-{self.span_id:016x}-{flags}"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": f"{self.trace_id:032x}",
+            "span_id": f"{self.span_id:016x}",
+            "parent_id": (
+                None if self.parent_id is None else f"{self.parent_id:016x}"),
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "duration_ms": self.duration * 1000,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = repr(exc)
+        finish_span(self)
+        _current_span.reset(self._token)
+
+
+class InMemoryExporter:
+    """Keeps finished spans, so tests can assert on the span tree."""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+    def tree(self, trace_id=None):
+        """
+        Returns the spans as nested (name, [children]) pairs
+        ordered by start time, roots first.
+        """
+        spans = [
+            span for span in self.spans
+            if trace_id is None or span.trace_id == trace_id
+        ]
+        children = {}
+        for span in sorted(spans, key=lambda span: span.start):
+            children.setdefault(span.parent_id, []).append(span)
+        ids = {span.span_id for span in spans}
+
+        def build(span):
+            return span.name, [build(child) for child in children.get(span.span_id, [])]
+
+        return [
+            build(span) for span in sorted(spans, key=lambda span: span.start)
+            if span.parent_id is None or span.parent_id not in ids
+        ]
+
+
+class JsonLinesExporter:
+    """Writes every finished span as a JSON line to a stream or file."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+memory_exporter = InMemoryExporter()
+
+
+def _create_exporter(name: str):
+    if name == "none":
+        return None
+    if name == "stdout":
+        return JsonLinesExporter(sys.stdout)
+    if name == "file":
+        return JsonLinesExporter(open(TRACE_FILE, "a"))
+    if name == "memory":
+        return memory_exporter
+    raise ValueError(f"Unknown trace exporter: {name}")
+
+
+exporter = _create_exporter(TRACE_EXPORTER)
+
+
+def configure(exporter_name: str = None, sample_rate: float = None):
+    """Switches the exporter or the sample rate at runtime, e.g. in tests."""
+    global exporter, TRACE_SAMPLE_RATE
+    if exporter_name is not None:
+        exporter = _create_exporter(exporter_name)
+    if sample_rate is not None:
+        TRACE_SAMPLE_RATE = sample_rate
+
+
+def current_span():
+    return _current_span.get()
+
+
+def start_span(name: str, kind: str = "internal", parent=None, **attributes) -> Span:
+    """
+    Starts a span under `parent` (a Span or a parsed traceparent tuple)
+    or else under the current span. Use it as a context manager,
+    or call finish_span() when it is not entered.
+    Returns None when tracing is disabled.
+    """
+    if exporter is None:
+        return None
+    parent = parent if parent is not None else _current_span.get()
+    if isinstance(parent, Span):
+        trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+    elif parent is not None:
+        trace_id, parent_id, sampled = parent
+    else:
+        # The sampling decision is made once per trace, at its root
+        trace_id, parent_id = random.getrandbits(128), None
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    return Span(name, kind, trace_id, parent_id, sampled, attributes)
+
+
+def finish_span(span: Span):
+    if span.end is not None:
+        return
+    span.end = span.start + (time.perf_counter() - span._start_counter)
+    if span.sampled and exporter is not None:
+        exporter.export(span)
+
+
+def parse_traceparent(value):
+    """Returns (trace_id, parent span_id, sampled) or None if invalid."""
+    try:
+        version, trace_id, span_id, flags = value.split("-")
+        if len(trace_id) != 32 or len(span_id) != 16 or version == "ff":
+            return None
+        trace_id, span_id = int(trace_id, 16), int(span_id, 16)
+        if not trace_id or not span_id:
+            return None
+        return trace_id, span_id, bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+
+
+def start_consumer_span(name: str, headers: dict, **attributes) -> Span:
+    """
+    Starts a consumer span that continues the trace of a queue message
+    from its `traceparent` header, or a new trace without one.
+    """
+    header = headers.get(TRACEPARENT_HEADER)
+    if isinstance(header, bytes):
+        header = header.decode()
+    parent = parse_traceparent(header) if header else None
+    return start_span(name, kind="consumer", parent=parent, **attributes)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that continues the trace of an incoming W3C
+    `traceparent` header, or starts a new one, with a server span
+    around the whole request, named after the matched route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or exporter is None:
+            await self.app(scope, receive, send)
+            return
+
+        header = dict(scope["headers"]).get(TRACEPARENT_HEADER.encode())
+        parent = parse_traceparent(header.decode()) if header else None
+        span = start_span(
+            f'{scope["method"]} {scope["path"]}', kind="server", parent=parent,
+            **{"http.method": scope["method"], "http.target": scope["path"]})
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+            await send(message)
+
+        with span:
+            try:
+                await self.app(scope, receive, traced_send)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    span.name = f'{scope["method"]} {route.path}'
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that wraps outgoing requests in a client span
+    and passes the trace on in the `traceparent` header.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport = None):
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        span = start_span(
+            f"{request.method} {request.url.host}{request.url.path}",
+            kind="client",
+            **{"http.method": request.method, "http.url": str(request.url)})
+        if span is None:
+            return await self.transport.handle_async_request(request)
+        with span:
+            request.headers[TRACEPARENT_HEADER] = span.traceparent()
+            response = await self.transport.handle_async_request(request)
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def instrument_engine(engine):
+    """Records a span for every SQL statement run by the engine."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = start_span(
+            "db.query", kind="client",
+            **{"db.statement": statement[:MAX_STATEMENT_LENGTH]})
+        if span is not None:
+            context._trace_span = span
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            span.set_attribute("db.rowcount", cursor.rowcount)
+            finish_span(span)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        context = exception_context.execution_context
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            span.error = repr(exception_context.original_exception)
+            finish_span(span)
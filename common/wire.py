@@ -0,0 +1,126 @@
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # JSON is used instead
+    msgpack = None
+
+
+WIRE_VERSION = 1
+COMPRESS_THRESHOLD = 512
+
+# Envelope header: version byte, then flags
+FLAG_COMPRESSED = 0x01
+FLAG_JSON = 0x02
+
+
+class WireError(ValueError):
+    pass
+
+
+class MessageType:
+    """
+    Schema of one kind of record. Fields are sent by numeric id,
+    never by name, so names can change freely. Ids must never be reused:
+    add new fields with new ids and old decoders skip them.
+    """
+
+    def __init__(self, name: str, type_id: int, fields: dict):
+        self.name = name
+        self.type_id = type_id
+        self.fields = fields
+        self.names = {field_id: field for field, field_id in fields.items()}
+
+    def pack(self, record: dict) -> dict:
+        return {
+            self.fields[field]: value
+            for field, value in record.items() if value is not None
+        }
+
+    def unpack(self, packed: dict) -> dict:
+        return {
+            self.names[field_id]: value
+            for field_id, value in packed.items() if field_id in self.names
+        }
+
+
+DELIVERY_ORDER = MessageType("delivery_order", 1, {
+    "location_id": 1,
+    "product_id": 2,
+    "product_name": 3,
+    "quantity": 4,
+})
+
+INVENTORY_EVENT = MessageType("inventory_event", 2, {
+    "product_id": 1,
+    "location_id": 2,
+    "stock": 3,
+    "delta": 4,
+    "version": 5,
+})
+
+MESSAGE_TYPES = {
+    message_type.type_id: message_type
+    for message_type in (DELIVERY_ORDER, INVENTORY_EVENT)
+}
+MESSAGE_TYPES_BY_NAME = {
+    message_type.name: message_type for message_type in MESSAGE_TYPES.values()
+}
+
+
+def encode(message_type: MessageType, records: list, use_json: bool = False) -> bytes:
+    """
+    Encodes a batch of records of one type into a single envelope.
+    msgpack with field ids by default, JSON with field names when
+    `use_json` is set or msgpack is not installed. Payloads above
+    COMPRESS_THRESHOLD bytes are compressed with zlib.
+    """
+    flags = 0
+    if use_json or msgpack is None:
+        flags |= FLAG_JSON
+        payload = json.dumps(
+            {"type": message_type.name, "records": records},
+            separators=(",", ":")).encode()
+    else:
+        payload = msgpack.packb(
+            [message_type.type_id, [message_type.pack(record) for record in records]])
+    if len(payload) > COMPRESS_THRESHOLD:
+        compressed = zlib.compress(payload)
+        if len(compressed) < len(payload):
+            flags |= FLAG_COMPRESSED
+            payload = compressed
+    return bytes((WIRE_VERSION, flags)) + payload
+
+
+def decode(data: bytes):
+    """
+    Returns (message type, list of records with field names).
+    A bare JSON object is read as a single delivery order,
+    which is what publishers sent before the envelope existed.
+    """
+    if data[:1] == b"{":
+        return DELIVERY_ORDER, [json.loads(data)]
+    if len(data) < 2:
+        raise WireError("Truncated envelope")
+    version, flags = data[0], data[1]
+    if version != WIRE_VERSION:
+        raise WireError(f"Unsupported wire version {version}")
+    if not flags & FLAG_JSON and msgpack is None:
+        raise WireError("msgpack is not installed")
+    payload = data[2:]
+    try:
+        if flags & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        if flags & FLAG_JSON:
+            message = json.loads(payload)
+            message_type = MESSAGE_TYPES_BY_NAME[message["type"]]
+            return message_type, message["records"]
+        type_id, packed_records = msgpack.unpackb(
+            payload, strict_map_key=False)
+        message_type = MESSAGE_TYPES[type_id]
+        return message_type, [
+            message_type.unpack(record) for record in packed_records]
+    except (KeyError, TypeError, ValueError, AttributeError, zlib.error) as e:
+        # msgpack and json errors are ValueErrors
+        raise WireError(f"Malformed envelope: {e!r}") from e
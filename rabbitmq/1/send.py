@@ -1,29 +1,46 @@
+import argparse
+import os
 import pika
+import sys
 
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(
-        '51.250.26.59', 5672, '/', pika.PlainCredentials('guest', 'guest123')
-        )
-    )
-channel = connection.channel()
-
-# create queue
-queue_name = 'ikbo-06_bondar'
-# durable=True means that queue will be preserved when the server is restarted
-channel.queue_declare(queue=queue_name, durable=True)
-
-# send message
-message = 'Yo, I am Bondar'
-channel.basic_publish(
-    exchange='', 
-    routing_key=queue_name,
-    body=message,
-    properties=pika.BasicProperties(
-        # make message persistent
-        delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from producer import BatchingProducer, read_lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('message', nargs='*')
+    parser.add_argument(
+        '--stdin', action='store_true', help='send every line of stdin')
+    parser.add_argument(
+        '--file', action='append', default=[], help='send every line of a file')
+    args = parser.parse_args()
+
+    # create queue
+    queue_name = 'ikbo-06_bondar'
+    producer = BatchingProducer(
+        pika.ConnectionParameters(
+            '51.250.26.59', 5672, '/', pika.PlainCredentials('guest', 'guest123')
+            ),
+        declarations=[('queue_declare', {'queue': queue_name, 'durable': True})],
+        properties=pika.BasicProperties(
+            # make message persistent
+            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
+            )
         )
-    )
-print(f"Sent '{message}'")
 
-connection.close()
+    if args.stdin or args.file:
+        messages = read_lines(args.file, args.stdin)
+    else:
+        messages = [' '.join(args.message) or 'Yo, I am Bondar']
+
+    with producer:
+        for message in messages:
+            producer.publish(queue_name, message.encode())
+    print(f"Sent {producer.confirmed} messages")
+    if producer.unconfirmed:
+        sys.exit(f"{producer.unconfirmed} messages were not confirmed")
+
 
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,43 @@
+import argparse
+import os
 import pika
 import sys
 
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(
-        '51.250.26.59', 5672, '/', pika.PlainCredentials('guest', 'guest123')))
-channel = connection.channel()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from producer import BatchingProducer, read_lines
 
-# create exchange wiht type direct
-exchange_name = 'ikbo-06_bondar_direct_exchange'
-channel.exchange_declare(exchange=exchange_name, exchange_type='direct')
 
-# send message
-severity = sys.argv[1] if len(sys.argv) > 1 else 'info'
-message = ' '.join(sys.argv[2:]) or 'ARBON'
-channel.basic_publish(
-    exchange=exchange_name, routing_key=severity, body=message)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('severity', nargs='?', default='info')
+    parser.add_argument('message', nargs='*')
+    parser.add_argument(
+        '--stdin', action='store_true', help='send every line of stdin')
+    parser.add_argument(
+        '--file', action='append', default=[], help='send every line of a file')
+    args = parser.parse_args()
 
-print(f"Sent {severity}:{message}")
-connection.close()
+    # create exchange wiht type direct
+    exchange_name = 'ikbo-06_bondar_direct_exchange'
+    producer = BatchingProducer(
+        pika.ConnectionParameters(
+            '51.250.26.59', 5672, '/', pika.PlainCredentials('guest', 'guest123')),
+        exchange=exchange_name,
+        declarations=[('exchange_declare', {
+            'exchange': exchange_name, 'exchange_type': 'direct'})])
 
+    if args.stdin or args.file:
+        messages = read_lines(args.file, args.stdin)
+    else:
+        messages = [' '.join(args.message) or 'ARBON']
+
+    with producer:
+        for message in messages:
+            producer.publish(args.severity, message.encode())
+    print(f"Sent {producer.confirmed} messages as {args.severity}")
+    if producer.unconfirmed:
+        sys.exit(f"{producer.unconfirmed} messages were not confirmed")
+
+
+if __name__ == '__main__':
+    main()
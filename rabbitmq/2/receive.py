@@ -1,36 +1,59 @@
+import argparse
+import os
 import pika
 import sys
 import time
 
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(
-        '51.250.26.59', 5672, '/', pika.PlainCredentials('guest', 'guest123')))
-channel = connection.channel()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from consumer import PooledConsumer
 
-# create exchange wiht type direct
-exchange_name = 'ikbo-06_bondar_direct_exchange'
-channel.exchange_declare(exchange=exchange_name, exchange_type='direct')
 
-queue = channel.queue_declare(queue='', exclusive=True)
-queue_name = queue.method.queue
-
-severities = sys.argv[1:]
-if not severities:
-    sys.exit(1)
-for severity in severities:
-    channel.queue_bind(
-        exchange=exchange_name, queue=queue_name, routing_key=severity)
-
-def callback(ch, method, properties, body):
+def work(body):
     task = body.decode()
     print(f"\tReceived {task}")
     sleep_time = task.count('*')
     time.sleep(sleep_time)  # Задержка на время, равное количеству символов '*'
     print(f"\tDone, slept for {sleep_time} seconds")
-    ch.basic_ack(method.delivery_tag)
 
-print('Waiting for logs. To exit press CTRL+C')
-channel.basic_consume(queue=queue_name, on_message_callback=callback)
 
-channel.start_consuming()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('severities', nargs='+')
+    parser.add_argument(
+        '--workers', type=int, default=4, help='number of parallel workers')
+    parser.add_argument(
+        '--prefetch', type=int, default=None,
+        help='max unacked messages, 2 per worker by default')
+    parser.add_argument(
+        '--processes', action='store_true',
+        help='run workers in processes instead of threads')
+    args = parser.parse_args()
+
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(
+            '51.250.26.59', 5672, '/', pika.PlainCredentials('guest', 'guest123')))
+    consumer = PooledConsumer(
+        connection, work, workers=args.workers, prefetch=args.prefetch,
+        processes=args.processes)
+    channel = consumer.channel
+
+    # create exchange wiht type direct
+    exchange_name = 'ikbo-06_bondar_direct_exchange'
+    channel.exchange_declare(exchange=exchange_name, exchange_type='direct')
+
+    queue = channel.queue_declare(queue='', exclusive=True)
+    queue_name = queue.method.queue
+
+    for severity in args.severities:
+        channel.queue_bind(
+            exchange=exchange_name, queue=queue_name, routing_key=severity)
+
+    consumer.consume(queue_name)
+
+    print('Waiting for logs. To exit press CTRL+C')
+    consumer.run()
+    connection.close()
+
 
+if __name__ == '__main__':
+    main()
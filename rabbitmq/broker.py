@@ -0,0 +1,422 @@
+import collections
+import heapq
+import itertools
+import queue
+import tempfile
+import threading
+import time
+import types
+
+import pika
+
+
+class InProcessBroker:
+    """
+    In-process stand-in for a RabbitMQ broker, for benchmarks and tests
+    that should not depend on a live server.
+
+    It implements the part of AMQP the scripts in this directory use:
+    the default and direct exchanges, durable and exclusive queues,
+    bindings, prefetch, acks and nacks with requeue. Persistent messages
+    (delivery_mode=2) on durable queues are appended to a journal file,
+    so persistence has a cost comparable in kind to the real broker.
+
+    `latency` is the one-way network delay in seconds between a client
+    and the broker: publishes, deliveries, acks and publisher confirms
+    take effect that long after they are sent, so prefetch and batching
+    pay off as they do over a network. Everything else about a real
+    broker (its own CPU cost, fsync batching, memory alarms) is absent,
+    so the numbers are only comparable with each other.
+
+    Connections are obtained with `connect()` and mimic the subset of
+    pika's BlockingConnection and BlockingChannel these scripts call;
+    `select_connection` mimics the SelectConnection producer.py uses.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._scheduler = _Scheduler() if latency else None
+        self._lock = threading.Lock()
+        self._exchanges = {'': 'direct'}
+        self._bindings = collections.defaultdict(set)
+        self._queues = {}
+        self._journal = tempfile.TemporaryFile()
+        self._names = itertools.count(1)
+
+    def connect(self):
+        return Connection(self)
+
+    def select_connection(
+            self, parameters=None, on_open_callback=None,
+            on_open_error_callback=None, on_close_callback=None):
+        return SelectConnection(self, on_open_callback, on_close_callback)
+
+    def _later(self, callback):
+        # Runs callback once it has crossed the network
+        if self._scheduler is None:
+            callback()
+        else:
+            self._scheduler.call_at(time.monotonic() + self.latency, callback)
+
+    def _declare_queue(self, name, durable):
+        with self._lock:
+            if not name:
+                name = f'amq.gen-{next(self._names)}'
+            self._queues.setdefault(name, _Queue(name, durable))
+            return name
+
+    def _delete_queue(self, name):
+        with self._lock:
+            self._queues.pop(name, None)
+            for queues in self._bindings.values():
+                queues.discard(name)
+
+    def _bind(self, exchange, queue_name, routing_key):
+        with self._lock:
+            self._bindings[exchange, routing_key].add(queue_name)
+
+    def _publish(self, exchange, routing_key, body, properties):
+        persistent = (
+            properties is not None and properties.delivery_mode == 2)
+        with self._lock:
+            if exchange == '':
+                names = (routing_key,) if routing_key in self._queues else ()
+            else:
+                names = self._bindings.get((exchange, routing_key), ())
+            for name in names:
+                amqp_queue = self._queues[name]
+                if persistent and amqp_queue.durable:
+                    self._journal.write(body)
+                    self._journal.flush()
+                amqp_queue.ready.append((routing_key, body, properties))
+                amqp_queue.dispatch()
+
+    def _consume(self, channel, queue_name, callback):
+        with self._lock:
+            amqp_queue = self._queues[queue_name]
+            consumer = _Consumer(channel, amqp_queue, callback)
+            amqp_queue.consumers.append(consumer)
+            channel._consumers[consumer.tag] = consumer
+            amqp_queue.dispatch()
+            return consumer.tag
+
+    def _cancel(self, channel, consumer_tag):
+        with self._lock:
+            consumer = channel._consumers.pop(consumer_tag, None)
+            if consumer is not None:
+                consumer.active = False
+                consumer.queue.consumers.remove(consumer)
+
+    def _settle(self, channel, delivery_tag, multiple, requeue):
+        with self._lock:
+            if multiple:
+                tags = [tag for tag in channel._unacked if tag <= delivery_tag]
+            else:
+                tags = [delivery_tag]
+            touched = set()
+            for tag in tags:
+                consumer, message = channel._unacked.pop(tag)
+                consumer.unacked -= 1
+                if requeue:
+                    consumer.queue.ready.appendleft(message)
+                touched.add(consumer.queue)
+            for amqp_queue in touched:
+                amqp_queue.dispatch()
+
+
+class _Scheduler:
+    """Runs callbacks at their due time, in order, on one thread."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._due = []
+        self._sequence = itertools.count()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def call_at(self, when, callback):
+        with self._condition:
+            heapq.heappush(self._due, (when, next(self._sequence), callback))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._due or self._due[0][0] > time.monotonic():
+                    self._condition.wait(
+                        self._due[0][0] - time.monotonic() if self._due else None)
+                _, _, callback = heapq.heappop(self._due)
+            callback()
+
+
+class _Queue:
+    def __init__(self, name, durable):
+        self.name = name
+        self.durable = durable
+        self.ready = collections.deque()
+        self.consumers = []
+        self._next = 0
+
+    def dispatch(self):
+        # Called with the broker lock held; round robin over the consumers
+        # that are below their prefetch limit
+        while self.ready and self.consumers:
+            for _ in range(len(self.consumers)):
+                self._next = (self._next + 1) % len(self.consumers)
+                consumer = self.consumers[self._next]
+                if consumer.has_capacity():
+                    break
+            else:
+                return
+            consumer.deliver(self.ready.popleft())
+
+
+class _Consumer:
+    _tags = itertools.count(1)
+
+    def __init__(self, channel, amqp_queue, callback):
+        self.tag = f'ctag-{next(self._tags)}'
+        self.channel = channel
+        self.queue = amqp_queue
+        self.callback = callback
+        self.active = True
+        self.unacked = 0
+
+    def has_capacity(self):
+        # Like RabbitMQ's default basic_qos, the limit is per consumer
+        prefetch = self.channel._prefetch
+        return not prefetch or self.unacked < prefetch
+
+    def deliver(self, message):
+        routing_key, body, properties = message
+        delivery_tag = next(self.channel._delivery_tags)
+        self.channel._unacked[delivery_tag] = (self, message)
+        self.unacked += 1
+        method = types.SimpleNamespace(
+            delivery_tag=delivery_tag, routing_key=routing_key,
+            consumer_tag=self.tag)
+        events = self.channel.connection._events
+        self.channel.broker._later(
+            lambda: events.put(
+                lambda: self._dispatch(method, properties, body)))
+
+    def _dispatch(self, method, properties, body):
+        if not self.active:
+            self.channel.basic_nack(method.delivery_tag, requeue=True)
+            return
+        self.callback(self.channel, method, properties, body)
+
+
+class Connection:
+    """Subset of pika.BlockingConnection backed by an InProcessBroker."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self._events = queue.SimpleQueue()
+        self.is_open = True
+
+    def channel(self):
+        return Channel(self)
+
+    def add_callback_threadsafe(self, callback):
+        self._events.put(callback)
+
+    def process_data_events(self, time_limit=0):
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            try:
+                event = self._events.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            event()
+
+    def close(self):
+        self.is_open = False
+
+
+class Channel:
+    """Subset of pika.BlockingChannel backed by an InProcessBroker."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self._prefetch = 0
+        self._consumers = {}
+        self._unacked = {}
+        self._delivery_tags = itertools.count(1)
+        self._consuming = False
+
+    def basic_qos(self, prefetch_count=0):
+        self._prefetch = prefetch_count
+
+    def confirm_delivery(self):
+        # The stand-in never loses a publish, so they are always confirmed
+        pass
+
+    def exchange_declare(self, exchange, exchange_type='direct', **kwargs):
+        self.broker._exchanges.setdefault(exchange, exchange_type)
+
+    def queue_declare(self, queue='', durable=False, **kwargs):
+        name = self.broker._declare_queue(queue, durable)
+        return types.SimpleNamespace(
+            method=types.SimpleNamespace(queue=name))
+
+    def queue_delete(self, queue):
+        self.broker._delete_queue(queue)
+
+    def queue_bind(self, queue, exchange, routing_key=None):
+        self.broker._bind(exchange, queue, routing_key or queue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.broker._later(
+            lambda: self.broker._publish(exchange, routing_key, body, properties))
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        if auto_ack:
+            callback = on_message_callback
+
+            def on_message_callback(channel, method, properties, body):
+                self.basic_ack(method.delivery_tag)
+                callback(channel, method, properties, body)
+        return self.broker._consume(self, queue, on_message_callback)
+
+    def basic_cancel(self, consumer_tag):
+        self.broker._cancel(self, consumer_tag)
+        # Like pika, messages that were delivered but not dispatched
+        # to the callback yet go back to the queue
+        return []
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.broker._later(
+            lambda: self.broker._settle(self, delivery_tag, multiple, False))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.broker._later(
+            lambda: self.broker._settle(self, delivery_tag, multiple, requeue))
+
+    def start_consuming(self):
+        self._consuming = True
+        while self._consuming:
+            self.connection.process_data_events(time_limit=0.1)
+
+    def stop_consuming(self, consumer_tag=None):
+        for tag in list(self._consumers):
+            self.basic_cancel(tag)
+        self._consuming = False
+
+
+class _IOLoop:
+    """Callback loop of a SelectConnection, run by whoever calls start()."""
+
+    def __init__(self):
+        self._events = queue.SimpleQueue()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._running = False
+
+    def add_callback_threadsafe(self, callback):
+        self._events.put(callback)
+
+    def call_later(self, delay, callback):
+        # Only called from the loop itself, like producer.py does
+        heapq.heappush(
+            self._timers,
+            (time.monotonic() + delay, next(self._sequence), callback))
+
+    def start(self):
+        self._running = True
+        while self._running:
+            timeout = None
+            if self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+            try:
+                self._events.get(timeout=timeout)()
+            except queue.Empty:
+                pass
+            while self._timers and self._timers[0][0] <= time.monotonic():
+                heapq.heappop(self._timers)[2]()
+
+    def stop(self):
+        self._running = False
+
+
+class SelectConnection:
+    """Subset of pika.SelectConnection backed by an InProcessBroker."""
+
+    def __init__(self, broker, on_open_callback=None, on_close_callback=None):
+        self.broker = broker
+        self.ioloop = _IOLoop()
+        self.is_open = True
+        self._on_close_callback = on_close_callback
+        self._channel_numbers = itertools.count(1)
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    def add_on_connection_blocked_callback(self, callback):
+        # The stand-in never raises a resource alarm
+        pass
+
+    def add_on_connection_unblocked_callback(self, callback):
+        pass
+
+    def channel(self, on_open_callback):
+        channel = AsyncChannel(self, next(self._channel_numbers))
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(channel))
+        return channel
+
+    def close(self):
+        self.is_open = False
+        if self._on_close_callback is not None:
+            self.ioloop.add_callback_threadsafe(
+                lambda: self._on_close_callback(self, None))
+
+
+class AsyncChannel:
+    """Subset of pika's callback based Channel backed by an InProcessBroker."""
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self._on_confirm = None
+        self._delivery_tags = itertools.count(1)
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def confirm_delivery(self, ack_nack_callback):
+        self._on_confirm = ack_nack_callback
+
+    def exchange_declare(
+            self, exchange, exchange_type='direct', callback=None, **kwargs):
+        self.broker._exchanges.setdefault(exchange, exchange_type)
+        self._reply(callback, None)
+
+    def queue_declare(self, queue, callback=None, durable=False, **kwargs):
+        name = self.broker._declare_queue(queue, durable)
+        self._reply(callback, types.SimpleNamespace(
+            method=types.SimpleNamespace(queue=name)))
+
+    def queue_bind(self, queue, exchange, routing_key=None, callback=None):
+        self.broker._bind(exchange, queue, routing_key or queue)
+        self._reply(callback, None)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        delivery_tag = next(self._delivery_tags)
+
+        def publish():
+            self.broker._publish(exchange, routing_key, body, properties)
+            if self._on_confirm is not None:
+                # The confirm travels back over the network as well
+                frame = types.SimpleNamespace(
+                    method=pika.spec.Basic.Ack(delivery_tag=delivery_tag))
+                self.broker._later(lambda: self._reply(self._on_confirm, frame))
+
+        self.broker._later(publish)
+
+    def _reply(self, callback, frame):
+        if callback is not None:
+            self.connection.ioloop.add_callback_threadsafe(
+                lambda: callback(frame))
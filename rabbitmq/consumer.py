@@ -0,0 +1,105 @@
+import functools
+import logging
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConsumer:
+    """
+    Runs the handler of a pika consumer in a pool of worker threads
+    or processes instead of inside the connection's I/O loop.
+
+    `handler(body)` runs in a worker. When it returns the message
+    is acked, when it raises the message is rejected; acks and rejects
+    are sent from the connection thread via `add_callback_threadsafe`,
+    because pika connections are not thread safe.
+
+    `prefetch` (basic_qos) caps the number of unacked messages the broker
+    pushes to us; by default two per worker, so every worker has the next
+    message at hand without hoarding the queue.
+
+    When run on the main thread, SIGINT and SIGTERM stop the consumer
+    gracefully, as stop() does from any thread: no new messages are
+    taken, messages that were delivered but not started are returned to
+    the queue, and the ones being handled are finished and acked.
+    """
+
+    def __init__(
+            self, connection, handler, workers=4, prefetch=None,
+            processes=False, requeue_failed=False):
+        self.connection = connection
+        self.channel = connection.channel()
+        self.handler = handler
+        self.workers = workers
+        self.prefetch = prefetch or workers * 2
+        self.requeue_failed = requeue_failed
+        pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self._executor = pool(max_workers=workers)
+        self._consumer_tags = []
+        self._futures = set()
+        self._stopping = False
+        self.channel.basic_qos(prefetch_count=self.prefetch)
+
+    def consume(self, queue):
+        self._consumer_tags.append(
+            self.channel.basic_consume(
+                queue=queue, on_message_callback=self._on_message))
+
+    def run(self):
+        """Consumes until stop() is called or a signal arrives, then drains."""
+        previous = {}
+        # Only the main thread may install signal handlers
+        if threading.current_thread() is threading.main_thread():
+            previous = {
+                signum: signal.signal(signum, self._on_signal)
+                for signum in (signal.SIGINT, signal.SIGTERM)
+            }
+        try:
+            while not self._stopping:
+                self.connection.process_data_events(time_limit=1)
+            self._drain()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def stop(self):
+        self._stopping = True
+
+    def _on_signal(self, signum, frame):
+        logger.info("Received signal %s, draining", signum)
+        self.stop()
+
+    def _on_message(self, channel, method, properties, body):
+        future = self._executor.submit(self.handler, body)
+        self._futures.add(future)
+        future.add_done_callback(
+            lambda future: self.connection.add_callback_threadsafe(
+                functools.partial(self._settle, method.delivery_tag, future)))
+
+    def _settle(self, delivery_tag, future):
+        # Runs on the connection thread
+        self._futures.discard(future)
+        if future.cancelled():
+            self.channel.basic_nack(delivery_tag, requeue=True)
+            return
+        error = future.exception()
+        if error is None:
+            self.channel.basic_ack(delivery_tag)
+            return
+        logger.error("Handler failed: %r", error)
+        self.channel.basic_nack(delivery_tag, requeue=self.requeue_failed)
+
+    def _drain(self):
+        # Cancelling nacks the prefetched messages that were not dispatched
+        for consumer_tag in self._consumer_tags:
+            self.channel.basic_cancel(consumer_tag)
+        self._consumer_tags.clear()
+        for future in list(self._futures):
+            future.cancel()
+        while self._futures:
+            self.connection.process_data_events(time_limit=0.1)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,274 @@
+import collections
+import functools
+import itertools
+import logging
+import sys
+import threading
+import time
+
+import pika
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingProducer:
+    """
+    Publisher that keeps one connection open for its whole life
+    instead of connecting for every message.
+
+    The connection runs in a background thread (SelectConnection) with
+    a pool of `channels` channels in confirm mode. `publish` only buffers
+    the message; the I/O thread publishes buffered messages in batches of
+    up to `batch_size`, round robin over the channels.
+
+    Flow control: `publish` blocks while `max_in_flight` messages are
+    published but not confirmed yet, and publishing pauses while the
+    broker reports the connection as blocked (resource alarm).
+
+    If the connection is lost, it is reopened after `reconnect_delay`
+    seconds and unconfirmed messages are published again, so delivery is
+    at least once. `declarations` are (channel method, kwargs) pairs,
+    e.g. ("queue_declare", {"queue": "q", "durable": True}), run in
+    order before the first publish on every connection.
+    `connection_factory` is called like pika.SelectConnection, e.g.
+    InProcessBroker.select_connection in the benchmark.
+
+    Closing waits at most `close_timeout` seconds for the confirms, so
+    an unreachable broker does not hang the caller; messages still
+    unconfirmed then are lost and counted by `unconfirmed`.
+    """
+
+    def __init__(
+            self, parameters, exchange='', declarations=(),
+            properties=None, channels=4, batch_size=500,
+            max_in_flight=10000, flush_interval=0.05, reconnect_delay=2,
+            close_timeout=30, connection_factory=pika.SelectConnection):
+        self.parameters = parameters
+        self.exchange = exchange
+        self.declarations = list(declarations)
+        self.properties = properties
+        self.channel_count = channels
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.flush_interval = flush_interval
+        self.reconnect_delay = reconnect_delay
+        self.close_timeout = close_timeout
+        self.connection_factory = connection_factory
+
+        self._buffer = collections.deque()
+        self._outstanding = 0
+        self._condition = threading.Condition()
+        self._connection = None
+        self._channels = []
+        self._unconfirmed = {}
+        self._delivery_tags = {}
+        self._next_channel = None
+        self._ready = False
+        self._blocked = False
+        self._stopping = False
+        self._thread = None
+        self.published = 0
+        self.confirmed = 0
+
+    # Called from the application thread
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def publish(self, routing_key, body):
+        with self._condition:
+            while self._outstanding >= self.max_in_flight:
+                self._condition.wait()
+            self._outstanding += 1
+        self._buffer.append((routing_key, body))
+        if len(self._buffer) >= self.batch_size:
+            self._schedule(self._flush)
+
+    def flush(self, timeout=None):
+        """Waits until every published message is confirmed."""
+        self._schedule(self._flush)
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._outstanding == 0, timeout)
+
+    @property
+    def unconfirmed(self):
+        """Messages published but not confirmed by the broker yet."""
+        with self._condition:
+            return self._outstanding
+
+    def close(self, timeout=None):
+        """
+        Flushes and closes the connection within `timeout` seconds,
+        `close_timeout` by default. Returns the unconfirmed count.
+        """
+        if timeout is None:
+            timeout = self.close_timeout
+        deadline = time.monotonic() + timeout
+        self.flush(timeout)
+        self._stopping = True
+        self._schedule(self._close_connection)
+        self._thread.join(max(0, deadline - time.monotonic()))
+        unconfirmed = self.unconfirmed
+        if unconfirmed:
+            logger.warning(
+                "Closed with %d messages not confirmed by the broker",
+                unconfirmed)
+        return unconfirmed
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _schedule(self, callback):
+        connection = self._connection
+        if connection is None:
+            return
+        try:
+            connection.ioloop.add_callback_threadsafe(callback)
+        except Exception:
+            # The connection is being replaced, the buffer is
+            # published once the next one is ready
+            pass
+
+    # Runs in the I/O thread
+
+    def _run(self):
+        while not self._stopping:
+            self._connection = self.connection_factory(
+                self.parameters,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_error,
+                on_close_callback=self._on_connection_closed)
+            self._connection.ioloop.start()
+            if not self._stopping:
+                logger.warning(
+                    "Connection lost, reconnecting in %ss", self.reconnect_delay)
+                time.sleep(self.reconnect_delay)
+
+    def _on_connection_open(self, connection):
+        connection.add_on_connection_blocked_callback(self._on_blocked)
+        connection.add_on_connection_unblocked_callback(self._on_unblocked)
+        for _ in range(self.channel_count):
+            connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        logger.error("Failed to connect: %s", error)
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self._ready = False
+        self._channels = []
+        self._delivery_tags = {}
+        # Unconfirmed messages go back to the front of the buffer
+        for unconfirmed in self._unconfirmed.values():
+            self._buffer.extendleft(reversed(list(unconfirmed.values())))
+        self._unconfirmed = {}
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(
+            functools.partial(self._on_confirm, channel.channel_number))
+        self._unconfirmed[channel.channel_number] = collections.OrderedDict()
+        self._delivery_tags[channel.channel_number] = 0
+        self._channels.append(channel)
+        if len(self._channels) == self.channel_count:
+            self._declare(0)
+
+    def _on_channel_closed(self, channel, reason):
+        # Reconnecting is simpler than repairing the pool and its tags
+        if self._connection.is_open and not self._stopping:
+            logger.error("Channel closed: %s", reason)
+            self._connection.close()
+
+    def _declare(self, index):
+        if index == len(self.declarations):
+            self._next_channel = itertools.cycle(self._channels)
+            self._ready = True
+            self._tick()
+            return
+        method, kwargs = self.declarations[index]
+        getattr(self._channels[0], method)(
+            callback=lambda frame: self._declare(index + 1), **kwargs)
+
+    def _on_blocked(self, connection, frame):
+        logger.warning("Broker blocked the connection, pausing")
+        self._blocked = True
+
+    def _on_unblocked(self, connection, frame):
+        self._blocked = False
+        self._flush()
+
+    def _flush(self):
+        if not self._ready or self._blocked:
+            return
+        sent = 0
+        while self._buffer and sent < self.batch_size:
+            routing_key, body = self._buffer.popleft()
+            channel = next(self._next_channel)
+            unconfirmed = self._unconfirmed[channel.channel_number]
+            channel.basic_publish(
+                self.exchange, routing_key, body, self.properties)
+            # Delivery tags count the publishes on each channel from 1
+            self._delivery_tags[channel.channel_number] += 1
+            unconfirmed[self._delivery_tags[channel.channel_number]] = (
+                routing_key, body)
+            sent += 1
+        self.published += sent
+        if self._buffer:
+            # Yield to the I/O loop between batches so confirms get read
+            self._connection.ioloop.add_callback_threadsafe(self._flush)
+
+    def _tick(self):
+        # Publishes what is left below a full batch every flush_interval
+        if not self._ready:
+            return
+        self._flush()
+        self._connection.ioloop.call_later(self.flush_interval, self._tick)
+
+    def _on_confirm(self, channel_number, frame):
+        method = frame.method
+        unconfirmed = self._unconfirmed.get(channel_number)
+        if unconfirmed is None:
+            return
+        if method.multiple:
+            # Tags are kept in publish order, so stop at the first newer one
+            tags = list(itertools.takewhile(
+                lambda tag: tag <= method.delivery_tag, unconfirmed))
+        else:
+            tags = [method.delivery_tag]
+        settled = 0
+        for tag in tags:
+            message = unconfirmed.pop(tag, None)
+            if message is None:
+                continue
+            if isinstance(method, pika.spec.Basic.Nack):
+                self._buffer.append(message)
+            else:
+                settled += 1
+        self.confirmed += settled
+        if settled:
+            with self._condition:
+                self._outstanding -= settled
+                self._condition.notify_all()
+
+    def _close_connection(self):
+        if self._connection.is_open:
+            self._connection.close()
+
+
+def read_lines(paths, stdin=False):
+    """Yields the lines of stdin and then of the files, one message each."""
+    if stdin:
+        for line in sys.stdin:
+            yield line.rstrip('\n')
+    for path in paths:
+        with open(path) as lines:
+            for line in lines:
+                yield line.rstrip('\n')
@@ -0,0 +1,64 @@
+import time
+
+import pika
+
+import bench
+from broker import InProcessBroker
+from producer import BatchingProducer
+
+
+def receive(connection, channel, queue_name, count, timeout=5):
+    bodies = []
+    channel.basic_consume(
+        queue=queue_name,
+        on_message_callback=lambda channel, method, properties, body:
+            bodies.append(body),
+        auto_ack=True)
+    deadline = time.monotonic() + timeout
+    while len(bodies) < count and time.monotonic() < deadline:
+        connection.process_data_events(time_limit=0.01)
+    return bodies
+
+
+def test_latency_delays_the_publish_and_the_delivery():
+    broker = InProcessBroker(latency=0.05)
+    connection = broker.connect()
+    channel = connection.channel()
+    channel.queue_declare(queue="queue")
+
+    started = time.monotonic()
+    channel.basic_publish("", "queue", b"message")
+    assert receive(connection, channel, "queue", 1) == [b"message"]
+    assert time.monotonic() - started >= 0.1
+
+
+def test_batching_producer_publishes_through_the_stand_in():
+    broker = InProcessBroker(latency=0.001)
+    producer = BatchingProducer(
+        None, declarations=[("queue_declare", {"queue": "queue", "durable": True})],
+        connection_factory=broker.select_connection, close_timeout=5)
+    with producer:
+        for number in range(100):
+            producer.publish("queue", str(number).encode())
+    assert producer.confirmed == 100
+    assert producer.unconfirmed == 0
+
+    connection = broker.connect()
+    bodies = receive(connection, connection.channel(), "queue", 100)
+    # Round robin over the channels may reorder the messages
+    assert sorted(bodies) == sorted(str(number).encode() for number in range(100))
+
+
+def test_bench_run_receives_every_message():
+    broker = InProcessBroker(latency=0.0005)
+
+    def producer(exchange, properties):
+        return BatchingProducer(
+            None, exchange=exchange, properties=properties,
+            connection_factory=broker.select_connection)
+
+    result = bench.run(
+        broker.connect, producer, "routing", messages=200, size=64,
+        prefetch=10, keys=2, persistent=True, consumers=2)
+    assert result["complete"]
+    assert result["received"] == 200
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from broker import InProcessBroker
+from consumer import PooledConsumer
+
+
+def setup(messages):
+    broker = InProcessBroker()
+    channel = broker.connect().channel()
+    channel.queue_declare(queue="queue", durable=True)
+    for body in messages:
+        channel.basic_publish("", "queue", body)
+    return broker
+
+
+def run_until(consumer, condition, timeout=5):
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    consumer.stop()
+    thread.join(timeout)
+    assert not thread.is_alive()
+
+
+def ready(broker):
+    return len(broker._queues["queue"].ready)
+
+
+def test_handled_messages_are_acked():
+    broker = setup([b"1", b"2", b"3"])
+    handled = []
+    consumer = PooledConsumer(broker.connect(), handled.append, workers=2)
+    consumer.consume("queue")
+    run_until(consumer, lambda: len(handled) == 3)
+
+    assert sorted(handled) == [b"1", b"2", b"3"]
+    assert ready(broker) == 0
+    assert consumer.channel._unacked == {}
+
+
+def test_failed_messages_are_rejected_or_requeued():
+    for requeue_failed, left in ((False, 0), (True, 1)):
+        broker = setup([b"bad"])
+        attempts = []
+
+        def handler(body):
+            attempts.append(body)
+            raise ValueError(body)
+
+        consumer = PooledConsumer(
+            broker.connect(), handler, workers=1,
+            requeue_failed=requeue_failed)
+        consumer.consume("queue")
+        run_until(consumer, lambda: attempts)
+        assert ready(broker) == left
+
+
+def test_prefetch_limits_the_unacked_messages():
+    broker = setup([str(number).encode() for number in range(10)])
+    release = threading.Event()
+    consumer = PooledConsumer(
+        broker.connect(), lambda body: release.wait(), workers=1, prefetch=3)
+    consumer.consume("queue")
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        assert len(consumer.channel._unacked) == 3
+        assert ready(broker) == 7
+    finally:
+        consumer.stop()
+        release.set()
+        thread.join(5)
+
+
+def test_stop_returns_the_messages_that_were_not_started():
+    broker = setup([str(number).encode() for number in range(10)])
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(body):
+        started.set()
+        release.wait()
+
+    consumer = PooledConsumer(broker.connect(), handler, workers=1, prefetch=5)
+    consumer.consume("queue")
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    started.wait(5)
+    consumer.stop()
+    # The handler finishes only once the drain has cancelled the consumer
+    deadline = time.monotonic() + 5
+    while consumer._consumer_tags and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    thread.join(5)
+
+    # The message being handled is finished and acked, the rest requeued
+    assert ready(broker) == 9
+    assert consumer.channel._unacked == {}
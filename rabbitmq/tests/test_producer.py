@@ -0,0 +1,27 @@
+import socket
+import time
+
+import pika
+
+from producer import BatchingProducer
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_close_gives_up_on_an_unreachable_broker():
+    producer = BatchingProducer(
+        pika.ConnectionParameters(
+            "127.0.0.1", unused_port(), connection_attempts=1, retry_delay=0),
+        reconnect_delay=0.1, close_timeout=0.5)
+
+    started = time.monotonic()
+    with producer:
+        producer.publish("queue", b"message")
+
+    assert time.monotonic() - started < 5
+    assert producer.unconfirmed == 1
+    assert producer.confirmed == 0